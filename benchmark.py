@@ -0,0 +1,259 @@
+import base64
+import contextlib
+import importlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import time
+import wave
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import file_manifest
+import stage_registry
+
+try:
+    import resource
+except ImportError:  # Not available on Windows; peak RSS is then left out of the results.
+    resource = None
+
+# Benchmark Parameters
+CORPUS_FOLDER = "benchmark_corpus"
+RESULTS_FILE = stage_registry.PROFILE_FILE # main.py plans its backends from these results
+SEED = 1234 # Same seed and scale always give a byte-identical corpus
+SCALE = 1 # Multiplies the number of files per corpus group
+
+# (case name, corpus group, module, folder function, keyword arguments)
+BENCHMARK_CASES = [
+    *stage_registry.candidate_cases(),
+    ("auto-size", "text", "compressor_auto", "compress_folder_auto", {'objective': 'size'}),
+    ("auto-speed", "text", "compressor_auto", "compress_folder_auto", {'objective': 'speed'}),
+]
+
+
+def _text_lines(rng: random.Random, redundancy: float, size: int) -> bytes:
+    # With probability `redundancy` a line repeats one of the last 64, otherwise it is new random words.
+    vocabulary = ["".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(2, 9))) for _ in range(2000)]
+    lines = []
+    total = 0
+    while total < size:
+        if lines and rng.random() < redundancy:
+            line = rng.choice(lines[-64:])
+        else:
+            line = f"{len(lines):08d} " + " ".join(rng.choice(vocabulary) for _ in range(rng.randint(4, 14))) + "\n"
+        lines.append(line)
+        total += len(line)
+    return "".join(lines).encode('ascii')[:size]
+
+
+def _generate_text(folder: str, rng: random.Random, count: int):
+    for i in range(count):
+        for redundancy in (0.1, 0.5, 0.9):
+            size = rng.randint(64, 2048) * 1024
+            with open(os.path.join(folder, f"lines_r{int(redundancy * 100):02d}_{i:03d}.log"), 'wb') as f:
+                f.write(_text_lines(rng, redundancy, size))
+
+        random_bytes = rng.randbytes(rng.randint(256, 1024) * 1024)
+        with open(os.path.join(folder, f"random_{i:03d}.json"), 'wb') as f:
+            f.write(random_bytes)
+        with open(os.path.join(folder, f"base64_{i:03d}.txt"), 'wb') as f:
+            f.write(base64.b64encode(random_bytes))
+
+
+def _generate_images(folder: str, rng: np.random.Generator, count: int):
+    from PIL import Image
+
+    for i in range(count):
+        height, width = 480, 640
+        y, x = np.mgrid[0:height, 0:width]
+        gradient = np.stack([x * 255 // width, y * 255 // height, (x + y) * 255 // (width + height)], axis=-1)
+        noise = rng.normal(0, 4 + 12 * (i % 3), gradient.shape)
+        pixels = np.clip(gradient + noise, 0, 255).astype(np.uint8)
+
+        image = Image.fromarray(pixels, "RGB")
+        image.save(os.path.join(folder, f"gradient_{i:03d}.png"))
+        image.save(os.path.join(folder, f"gradient_{i:03d}.jpg"), quality=95)
+
+
+def _generate_audio(folder: str, rng: np.random.Generator, count: int):
+    sample_rate = 44100
+    seconds = 5
+
+    for i in range(count):
+        t = np.arange(sample_rate * seconds) / sample_rate
+        tone = sum(np.sin(2 * np.pi * frequency * t) / (n + 1) for n, frequency in enumerate((220 * (i + 1), 330, 440)))
+        noise = rng.normal(0, 0.02, (t.size, 2))
+        samples = np.clip(tone[:, None] * 0.3 + noise, -1, 1)
+
+        with wave.open(os.path.join(folder, f"tone_{i:03d}.wav"), 'wb') as f:
+            f.setnchannels(2)
+            f.setsampwidth(2)
+            f.setframerate(sample_rate)
+            f.writeframes((samples * 32767).astype('<i2').tobytes())
+
+
+def _generate_video(folder: str, count: int):
+    for i in range(count):
+        # Deterministic lavfi sources, stored lossless (FFV1) so every encoder starts from the same pixels.
+        subprocess.run([
+            'ffmpeg', '-v', 'error', '-y',
+            '-f', 'lavfi', '-i', "testsrc2=duration=3:size=640x360:rate=25",
+            '-f', 'lavfi', '-i', f"sine=frequency={440 + 110 * i}:duration=3",
+            '-c:v', 'ffv1', '-c:a', 'pcm_s16le', '-fflags', '+bitexact',
+            os.path.join(folder, f"testsrc_{i:03d}.mkv")
+        ], check=True, capture_output=True)
+
+
+def generate_corpus(corpus_folder=CORPUS_FOLDER, seed=SEED, scale=SCALE) -> dict:
+    """Regenerate the synthetic corpus from scratch; returns file count and size per group."""
+    if os.path.isdir(corpus_folder):
+        shutil.rmtree(corpus_folder)
+
+    generators = {
+        'text': lambda folder: _generate_text(folder, random.Random(seed), 2 * scale),
+        'image': lambda folder: _generate_images(folder, np.random.default_rng(seed), 3 * scale),
+        'audio': lambda folder: _generate_audio(folder, np.random.default_rng(seed), 3 * scale),
+        'video': lambda folder: _generate_video(folder, 2 * scale),
+    }
+
+    corpus = {}
+    for group, generate in generators.items():
+        folder = os.path.join(corpus_folder, group)
+        os.makedirs(folder)
+        try:
+            generate(folder)
+        except Exception as e:
+            print(f"Warning: Could not generate the {group} corpus ({e}); its cases will be skipped.")
+            shutil.rmtree(folder)
+            continue
+
+        manifest = file_manifest.build_manifest(folder, "")
+        corpus[group] = {'files': len(manifest['entries']), 'bytes': file_manifest.total_input_size(manifest)}
+        print(f"Generated {group} corpus: {corpus[group]['files']} files, {corpus[group]['bytes'] / (1024 * 1024):.2f} MB")
+
+    return corpus
+
+
+def _percentile(values: list, percent: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(percent / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def _peak_rss_kb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def _run_case(module_name, function_name, kwargs, input_dir, output_dir) -> dict:
+    """Run one case in a fresh worker process so its peak RSS is its own."""
+    result = {'status': 'ok'}
+    try:
+        module = importlib.import_module(module_name)
+    except ImportError as e:
+        return {'status': 'skipped', 'reason': str(e)}
+
+    manifest = file_manifest.build_manifest(input_dir, output_dir)
+    completed_at = []
+    file_manifest.watch_outputs(manifest, lambda entry, output_path: completed_at.append(time.perf_counter()))
+
+    start_time = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        getattr(module, function_name)(input_dir, output_dir, manifest=manifest, **kwargs)
+    duration = time.perf_counter() - start_time
+
+    # Stages run one file at a time here, so the gap between two recorded outputs is one file's latency.
+    latencies = [(end - begin) * 1000 for begin, end in zip([start_time] + completed_at, completed_at)]
+    bytes_in = sum(entry['size'] for entry in manifest['entries'] if entry['outputs'])
+    # Files packed into a solid archive all list it as their output; count it once.
+    bytes_out = sum(os.path.getsize(path) for path in {path for entry in manifest['entries'] for path in entry['outputs']})
+
+    result.update({
+        'files': len(completed_at),
+        'bytes_in': bytes_in,
+        'bytes_out': bytes_out,
+        'ratio': bytes_in / bytes_out if bytes_out else 0.0,
+        'seconds': duration,
+        'mb_per_s': bytes_in / (1024 * 1024) / duration if duration > 0 else 0.0,
+        'peak_rss_kb': _peak_rss_kb(),
+        'latency_ms': {
+            'p50': _percentile(latencies, 50),
+            'p90': _percentile(latencies, 90),
+            'p99': _percentile(latencies, 99),
+            'max': max(latencies, default=0.0),
+        },
+    })
+    if not completed_at:
+        result['status'] = 'failed'
+    return result
+
+
+def run_benchmarks(corpus_folder=CORPUS_FOLDER, results_file=RESULTS_FILE, seed=SEED, scale=SCALE, cases=None):
+    print("=" * 90)
+    print(f"Compressor Benchmark (seed: {seed}, scale: {scale})")
+    print("=" * 90)
+
+    corpus = generate_corpus(corpus_folder, seed, scale)
+    output_root = corpus_folder + "_output"
+    context = multiprocessing.get_context('spawn')
+    results = []
+
+    print("-" * 90)
+    print(f"{'Case':<16} {'Status':<8} {'Files':>6} {'Ratio':>8} {'MB/s':>10} {'p50 ms':>10} {'p99 ms':>10} {'Peak RSS MB':>12}")
+    print("-" * 90)
+
+    for name, group, module_name, function_name, kwargs in cases or BENCHMARK_CASES:
+        if group not in corpus:
+            result = {'status': 'skipped', 'reason': f"no {group} corpus"}
+        else:
+            output_dir = os.path.join(output_root, name)
+            try:
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                    result = executor.submit(_run_case, module_name, function_name, kwargs,
+                                             os.path.join(corpus_folder, group), output_dir).result()
+            except Exception as e:
+                result = {'status': 'failed', 'reason': str(e)}
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+        result = {'case': name, 'corpus': group, 'module': module_name, 'function': function_name, 'params': kwargs, **result}
+        results.append(result)
+
+        if result['status'] == 'ok':
+            rss = f"{result['peak_rss_kb'] / 1024:.1f}" if result['peak_rss_kb'] is not None else "n/a"
+            print(f"{name:<16} {'ok':<8} {result['files']:>6} {result['ratio']:>8.2f} {result['mb_per_s']:>10.2f} "
+                  f"{result['latency_ms']['p50']:>10.1f} {result['latency_ms']['p99']:>10.1f} {rss:>12}")
+        else:
+            print(f"{name:<16} {result['status']:<8} {result.get('reason', '')}")
+
+    shutil.rmtree(output_root, ignore_errors=True)
+
+    report = {
+        'created': time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'seed': seed,
+        'scale': scale,
+        'corpus': corpus,
+        'results': results,
+    }
+    with open(results_file, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+
+    print("-" * 90)
+    print(f"Results written to {results_file}")
+    print("=" * 90 + "\n")
+    return report
+
+
+if __name__ == "__main__":
+    run_benchmarks()
@@ -4,6 +4,8 @@ import librosa
 import os
 from typing import Optional, Dict, List, Tuple
 
+AUDIO_EXTS = ('.wav', '.mp3', '.ogg', '.flac', '.m4a')
+
 
 def calculate_audio_metrics(original_file_path: str, compressed_file_path: str) -> Tuple[
     Optional[float], Optional[float]]:
@@ -42,19 +44,15 @@ def calculate_audio_metrics(original_file_path: str, compressed_file_path: str)
     return mse_value, psnr_value
 
 
-def compare_folders_recursive(input_dir: str, output_dir: str):
-    os.makedirs(input_dir, exist_ok=True)
-    os.makedirs(output_dir, exist_ok=True)
-
-    AUDIO_EXTS = ('.wav', '.mp3', '.ogg', '.flac', '.m4a')
-
+def _collect_from_folders(input_dir: str, output_dir: str, audio_exts: Tuple[str, ...]) -> Tuple[
+    Dict[str, str], List[Tuple[str, str]]]:
     output_files_map: Dict[str, str] = {}
 
     for root, _, files in os.walk(output_dir):
         relative_dir = os.path.relpath(root, output_dir)
 
         for filename in files:
-            if filename.lower().endswith(AUDIO_EXTS) and not filename.startswith('.'):
+            if filename.lower().endswith(audio_exts) and not filename.startswith('.'):
                 stem = os.path.splitext(filename)[0]
                 map_key = os.path.join(relative_dir, stem)
                 output_files_map[map_key] = os.path.join(relative_dir, filename)
@@ -65,45 +63,48 @@ def compare_folders_recursive(input_dir: str, output_dir: str):
         relative_dir = os.path.relpath(root, input_dir)
 
         for filename in files:
-            if filename.lower().endswith(AUDIO_EXTS) and not filename.startswith('.'):
+            if filename.lower().endswith(audio_exts) and not filename.startswith('.'):
                 stem = os.path.splitext(filename)[0]
                 map_key = os.path.join(relative_dir, stem)
                 input_files_list.append((map_key, os.path.join(relative_dir, filename)))
 
-    results = []
+    return output_files_map, input_files_list
 
-    for map_key, input_relative_path in sorted(input_files_list):
 
-        input_full_path = os.path.join(input_dir, input_relative_path)
-        input_filename_only = os.path.basename(input_relative_path)
+def _collect_from_manifest(manifest: dict, output_dir: str, audio_exts: Tuple[str, ...]) -> Tuple[
+    Dict[str, str], List[Tuple[str, str]]]:
+    output_files_map: Dict[str, str] = {}
+    input_files_list: List[Tuple[str, str]] = []
 
-        if map_key in output_files_map:
-            output_relative_path = output_files_map[map_key]
-            output_full_path = os.path.join(output_dir, output_relative_path)
-            output_filename_only = os.path.basename(output_relative_path)
+    for entry in manifest['entries']:
+        filename = entry['name']
+        if not filename.lower().endswith(audio_exts) or filename.startswith('.'):
+            continue
 
-            mse, psnr = calculate_audio_metrics(input_full_path, output_full_path)
+        stem = os.path.splitext(filename)[0]
+        map_key = os.path.join(entry['relative_dir'], stem)
+        input_files_list.append((map_key, os.path.join(entry['relative_dir'], filename)))
 
-            results.append({
-                'Original Path': input_relative_path,
-                'Compressed File': output_filename_only,
-                'MSE': f"{mse:.8f}" if mse is not None else 'Error',
-                'PSNR (dB)': f"{psnr:.2f}" if psnr is not None else 'Error',
-                'Status': 'OK' if mse is not None else 'Error'
-            })
+        for output_path in entry['outputs']:
+            if output_path.lower().endswith(audio_exts):
+                output_files_map[map_key] = os.path.relpath(output_path, output_dir)
 
-        else:
-            results.append({
-                'Original Path': input_relative_path,
-                'Compressed File': 'N/A',
-                'MSE': 'N/A', 'PSNR (dB)': 'N/A',
-                'Status': 'Missing Corresponding File in Output'
-            })
+    return output_files_map, input_files_list
+
+
+def compare_pair(input_path: str, output_path: str, input_relative_path: str) -> Dict[str, str]:
+    mse, psnr = calculate_audio_metrics(input_path, output_path)
+
+    return {
+        'Original Path': input_relative_path,
+        'Compressed File': os.path.basename(output_path),
+        'MSE': f"{mse:.8f}" if mse is not None else 'Error',
+        'PSNR (dB)': f"{psnr:.2f}" if psnr is not None else 'Error',
+        'Status': 'OK' if mse is not None else 'Error'
+    }
 
-    if not results:
-        print(f"\nNo matching audio files found between '{input_dir}' and '{output_dir}' (including subfolders).")
-        return
 
+def print_results(results: List[Dict[str, str]], input_dir: str, output_dir: str):
     print("\n--- Audio Quality Comparison Results (MSE/PSNR) ---")
     print(f"Checking directories recursively: {input_dir} vs {output_dir}")
 
@@ -137,6 +138,40 @@ def compare_folders_recursive(input_dir: str, output_dir: str):
         if r['Status'] != 'OK':
             print(f"   -> Status: {r['Status']}")
 
+
+def compare_folders_recursive(input_dir: str, output_dir: str, manifest: Optional[dict] = None):
+    os.makedirs(input_dir, exist_ok=True)
+    os.makedirs(output_dir, exist_ok=True)
+
+    if manifest is not None:
+        output_files_map, input_files_list = _collect_from_manifest(manifest, output_dir, AUDIO_EXTS)
+    else:
+        output_files_map, input_files_list = _collect_from_folders(input_dir, output_dir, AUDIO_EXTS)
+
+    results = []
+
+    for map_key, input_relative_path in sorted(input_files_list):
+
+        input_full_path = os.path.join(input_dir, input_relative_path)
+
+        if map_key in output_files_map:
+            output_full_path = os.path.join(output_dir, output_files_map[map_key])
+            results.append(compare_pair(input_full_path, output_full_path, input_relative_path))
+
+        else:
+            results.append({
+                'Original Path': input_relative_path,
+                'Compressed File': 'N/A',
+                'MSE': 'N/A', 'PSNR (dB)': 'N/A',
+                'Status': 'Missing Corresponding File in Output'
+            })
+
+    if not results:
+        print(f"\nNo matching audio files found between '{input_dir}' and '{output_dir}' (including subfolders).")
+        return
+
+    print_results(results, input_dir, output_dir)
+
 # --- Test ---
 # INPUT_DIR = 'input/audio/A-3'
 # OUTPUT_DIR = 'output/audio/FLAC/A-3'
@@ -5,6 +5,8 @@ import os
 import re
 from skimage.metrics import structural_similarity as ssim
 
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tiff')
+
 
 def calculate_metrics(image_path_1: str, image_path_2: str, max_i: float = 255.0):
     try:
@@ -40,18 +42,38 @@ def calculate_metrics(image_path_1: str, image_path_2: str, max_i: float = 255.0
     return mse_value, psnr_value, ssim_value
 
 
-def compare_folders(input_dir: str, output_dir: str, optimized_suffix: str):
+def _collect_from_manifest(manifest: dict, output_dir: str, optimized_suffix: str, image_extensions: tuple):
     input_images = {}
     output_images = {}
 
-    IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tiff')
+    pattern = re.compile(f'(.+?){optimized_suffix}(\..+)?$', re.IGNORECASE)
+
+    for entry in manifest['entries']:
+        filename = entry['name']
+        if filename.startswith('.'): continue
+        if not filename.lower().endswith(image_extensions): continue
+
+        stem, _ = os.path.splitext(filename)
+        map_key = os.path.join(entry['relative_dir'], stem)
+        input_images[map_key] = os.path.join(entry['relative_dir'], filename)
+
+        for output_path in entry['outputs']:
+            if pattern.match(os.path.basename(output_path)):
+                output_images[map_key] = os.path.relpath(output_path, output_dir)
+
+    return input_images, output_images
+
+
+def _collect_from_folders(input_dir: str, output_dir: str, optimized_suffix: str, image_extensions: tuple):
+    input_images = {}
+    output_images = {}
 
     for root, _, files in os.walk(input_dir):
         relative_dir = os.path.relpath(root, input_dir)
 
         for filename in files:
             if filename.startswith('.'): continue
-            if not filename.lower().endswith(IMAGE_EXTENSIONS): continue
+            if not filename.lower().endswith(image_extensions): continue
 
             stem, _ = os.path.splitext(filename)
             map_key = os.path.join(relative_dir, stem)
@@ -71,42 +93,27 @@ def compare_folders(input_dir: str, output_dir: str, optimized_suffix: str):
                 map_key = os.path.join(relative_dir, original_stem)
                 output_images[map_key] = os.path.join(relative_dir, filename)
 
-    results = []
+    return input_images, output_images
 
-    if not input_images:
-        print(f"\nNo image files found in the '{input_dir}' directory.")
-        return
-
-    for map_key, input_relative_path in sorted(input_images.items()):
 
-        input_full_path = os.path.join(input_dir, input_relative_path)
-
-        if map_key in output_images:
-            output_relative_path = output_images[map_key]
-            output_full_path = os.path.join(output_dir, output_relative_path)
+def compare_pair(input_path: str, output_path: str, input_relative_path: str) -> dict:
+    output_filename = os.path.basename(output_path)
+    if not output_filename.lower().endswith(IMAGE_EXTENSIONS):
+        return {'filename': input_relative_path, 'mse': 'N/A', 'psnr': 'N/A', 'ssim': 'N/A',
+                'status': 'Output File is Not an Image'}
 
-            output_filename = os.path.basename(output_relative_path)
-            if not output_filename.lower().endswith(IMAGE_EXTENSIONS):
-                results.append({'filename': input_relative_path, 'mse': 'N/A', 'psnr': 'N/A', 'ssim': 'N/A',
-                                'status': 'Output File is Not an Image'})
-                continue
+    mse, psnr, ssim_score = calculate_metrics(input_path, output_path, max_i=255.0)
 
-            mse, psnr, ssim_score = calculate_metrics(input_full_path, output_full_path, max_i=255.0)
+    return {
+        'filename': input_relative_path,
+        'mse': f"{mse:.4f}" if mse is not None else 'Error',
+        'psnr': f"{psnr:.2f}" if psnr is not None else 'Error',
+        'ssim': f"{ssim_score:.4f}" if ssim_score is not None else 'Error',
+        'status': 'OK' if mse is not None else 'Error'
+    }
 
-            results.append({
-                'filename': input_relative_path,
-                'mse': f"{mse:.4f}" if mse is not None else 'Error',
-                'psnr': f"{psnr:.2f}" if psnr is not None else 'Error',
-                'ssim': f"{ssim_score:.4f}" if ssim_score is not None else 'Error',
-                'status': 'OK' if mse is not None else 'Error'
-            })
-        else:
-            results.append({
-                'filename': input_relative_path,
-                'mse': 'N/A', 'psnr': 'N/A', 'ssim': 'N/A',
-                'status': f'Missing Optimized File ({os.path.basename(map_key)}{optimized_suffix}*)'
-            })
 
+def print_results(results: list):
     print("\n--- Image Quality Comparison Results (MSE/PSNR/SSIM) ---")
 
     FN_WIDTH = 45
@@ -140,6 +147,37 @@ def compare_folders(input_dir: str, output_dir: str, optimized_suffix: str):
         )
         print(line)
 
+
+def compare_folders(input_dir: str, output_dir: str, optimized_suffix: str, manifest: dict = None):
+    if manifest is not None:
+        input_images, output_images = _collect_from_manifest(manifest, output_dir, optimized_suffix,
+                                                             IMAGE_EXTENSIONS)
+    else:
+        input_images, output_images = _collect_from_folders(input_dir, output_dir, optimized_suffix,
+                                                            IMAGE_EXTENSIONS)
+
+    results = []
+
+    if not input_images:
+        print(f"\nNo image files found in the '{input_dir}' directory.")
+        return
+
+    for map_key, input_relative_path in sorted(input_images.items()):
+
+        input_full_path = os.path.join(input_dir, input_relative_path)
+
+        if map_key in output_images:
+            output_full_path = os.path.join(output_dir, output_images[map_key])
+            results.append(compare_pair(input_full_path, output_full_path, input_relative_path))
+        else:
+            results.append({
+                'filename': input_relative_path,
+                'mse': 'N/A', 'psnr': 'N/A', 'ssim': 'N/A',
+                'status': f'Missing Optimized File ({os.path.basename(map_key)}{optimized_suffix}*)'
+            })
+
+    print_results(results)
+
 # --- Test ---
 # INPUT_DIR = 'input/image/I-3'
 # OUTPUT_DIR = 'output/image/MOZJPEG_90/I-3'
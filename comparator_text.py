@@ -0,0 +1,115 @@
+import hashlib
+import os
+import threading
+import compressor_zlib
+import metrics
+import random_access
+import run_journal
+import solid_archive
+
+TEXT_EXTENSIONS = compressor_zlib.TEXT_EXTENSIONS
+TEXT_BACKENDS = ("auto", "zlib", "bz2", "lz4")  # Journal keys the text stages record their outputs under
+
+_solid_lock = threading.Lock()
+_solid_digests = {}
+
+
+def is_verifiable(entry: dict, output_path: str, manifest: dict = None) -> bool:
+    # Everything a text stage writes in this run except the .idx sidecars of seekable outputs; unchanged outputs
+    # were checked when they were written.
+    return (entry['ext'] in TEXT_EXTENSIONS and not output_path.endswith(random_access.INDEX_EXTENSION)
+            and (manifest is None or run_journal.written_this_run(manifest, output_path)))
+
+
+def _hash_uncompressed(output_path: str) -> tuple:
+    """(sha256, size) of the data output_path decodes to, hashed chunk by chunk as the decoder yields it."""
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in random_access.iter_uncompressed(output_path):
+        digest.update(chunk)
+        size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def _member_digest(archive_path: str, name: str):
+    """sha256 of one member, or None when it is missing from the archive.
+
+    Every member of an archive is announced with the archive's path, so the first
+    check decodes it once for all of them. Each archive has its own lock, so checks
+    of other archives go on meanwhile, and its hashes are dropped once every member
+    has taken its own.
+    """
+    stat = os.stat(archive_path)
+    key = (archive_path, stat.st_size, stat.st_mtime_ns)
+    with _solid_lock:
+        cached = _solid_digests.setdefault(key, {'lock': threading.Lock(), 'digests': None})
+
+    with cached['lock']:
+        if cached['digests'] is None:
+            try:
+                cached['digests'] = solid_archive.hash_members(archive_path)
+            except Exception:
+                with _solid_lock:
+                    _solid_digests.pop(key, None)
+                raise
+        digest = cached['digests'].pop(name, None)
+        if not cached['digests']:
+            with _solid_lock:
+                _solid_digests.pop(key, None)
+    return digest
+
+
+def compare_pair(input_path: str, output_path: str, input_relative_path: str, manifest: dict = None) -> dict:
+    """Decode output_path in memory and check it hashes to the same sha256 as input_path; nothing is written to disk.
+
+    Only outputs written in this run get here, so the expected hash is the one
+    the journal recorded for this output: the compressing worker took it from
+    the same read that fed the compressor, before the output was announced.
+    Without a journal the input is read again to hash it.
+    """
+    result = {'filename': input_relative_path, 'output': os.path.basename(output_path), 'size': 0,
+              'source': 'journal', 'status': 'OK'}
+
+    expected = run_journal.recorded_checksum(manifest, input_relative_path, output_path, TEXT_BACKENDS) if manifest else None
+    try:
+        if expected is None:
+            expected = run_journal.hash_file(input_path)
+            result['source'] = 'input'
+
+        if solid_archive.is_solid_archive(os.path.basename(output_path)):
+            actual = _member_digest(output_path, os.path.basename(input_path))
+            result['size'] = os.path.getsize(input_path)
+            if actual is None:
+                result['status'] = 'Missing from archive'
+        elif os.path.splitext(output_path)[1].lower() in random_access.FORMATS:
+            actual, result['size'] = _hash_uncompressed(output_path)
+        else:
+            # Incompressible inputs are stored as they are.
+            actual, result['size'] = run_journal.hash_file(output_path), os.path.getsize(output_path)
+    except Exception as e:
+        actual = None
+        result['status'] = f"Error: {e}"
+
+    if actual is not None and actual != expected:
+        result['status'] = 'Checksum mismatch'
+    metrics.record_counts("verify", **{'processed' if result['status'] == 'OK' else 'error': 1})
+    return result
+
+
+def print_results(results: list):
+    failed = [r for r in results if r['status'] != 'OK']
+    decoded_size = sum(r['size'] for r in results)
+    from_journal = sum(1 for r in results if r['source'] == 'journal')
+
+    print("\n--- Text Round-Trip Verification (decoded in memory) ---")
+    print(f"Outputs Checked: {len(results)} | Decoded: {decoded_size:,} bytes ({decoded_size / (1024 * 1024):.2f} MB) | "
+          f"Failed: {len(failed)}")
+    print(f"Expected Hash From: journal {from_journal} | re-read input {len(results) - from_journal}")
+    if failed:
+        print("-" * 70)
+        for r in failed:
+            print(f"  [CORRUPT]: {r['filename']} -> {r['output']} ({r['status']})")
+
+
+# --- Test ---
+#print_results([compare_pair("input_test/notes/readme.txt", "output_processed/notes/readme.txt.zlib", "notes/readme.txt")])
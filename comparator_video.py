@@ -159,53 +159,59 @@ def get_video_files(directory: str) -> Dict[str, Tuple[str, str]]:
     return video_files
 
 
-def batch_compare_videos(original_dir: str, compressed_dir: str):
-    original_map = get_video_files(original_dir)
-    compressed_map = get_video_files(compressed_dir)
+def get_video_files_from_manifest(manifest: dict, compressed_dir: str) -> Tuple[
+    Dict[str, Tuple[str, str]], Dict[str, Tuple[str, str]]]:
+    original_map = {}
+    compressed_map = {}
 
-    common_keys = original_map.keys() & compressed_map.keys()
+    for entry in manifest['entries']:
+        filename = entry['name']
+        if filename.startswith('.'): continue
 
-    comparison_results: List[Dict] = []
+        if not filename.lower().endswith(VIDEO_EXTS): continue
 
-    if not common_keys:
-        print("No matching video files found in both directories (including subfolders).")
-        return
+        stem, _ = os.path.splitext(filename)
 
-    print(f"--- Starting Recursive Batch Comparison ({len(common_keys)} pairs) ---")
-    print(f"Original Root Dir: {original_dir}")
-    print(f"Compressed Root Dir: {compressed_dir}")
-    print("-" * 70)
+        map_key = os.path.normpath(os.path.join(entry['relative_dir'], stem))
 
-    for map_key in sorted(list(common_keys)):
-        original_rel_filename, original_path = original_map[map_key]
-        compressed_rel_filename, compressed_path = compressed_map[map_key]
+        original_map[map_key] = (os.path.normpath(os.path.join(entry['relative_dir'], filename)), entry['path'])
 
-        print(f"\n-> Comparing {original_rel_filename}")
-
-        metrics = run_quality_check(original_path, compressed_path)
-
-        result_row = {
-            'Path/Filename': original_rel_filename,
-            'MSE_Avg': 'N/A',
-            'PSNR_Avg_dB': 'N/A',
-            'SSIM_Avg': 'N/A',
-            'Status': 'FAILED'
-        }
-
-        if metrics:
-            result_row.update({
-                'MSE_Avg': f"{metrics['MSE_Avg']:.4f}",
-                'PSNR_Avg_dB': f"{metrics['PSNR_Avg_dB']:.4f}",
-                'SSIM_Avg': f"{metrics['SSIM_Avg']:.4f}",
-                'Status': 'OK'
-            })
-            print(
-                f"   RESULTS: MSE: {result_row['MSE_Avg']}, PSNR (dB): {result_row['PSNR_Avg_dB']}, SSIM: {result_row['SSIM_Avg']}")
-        else:
-            print("   STATUS: Failed to retrieve metrics. Check FFmpeg output for stream errors.")
+        for output_path in entry['outputs']:
+            if output_path.lower().endswith(VIDEO_EXTS):
+                compressed_map[map_key] = (os.path.normpath(os.path.relpath(output_path, compressed_dir)), output_path)
+
+    return original_map, compressed_map
+
+
+def compare_pair(original_path: str, compressed_path: str, original_rel_filename: str) -> Dict[str, str]:
+    print(f"\n-> Comparing {original_rel_filename}")
+
+    metrics = run_quality_check(original_path, compressed_path)
+
+    result_row = {
+        'Path/Filename': original_rel_filename,
+        'MSE_Avg': 'N/A',
+        'PSNR_Avg_dB': 'N/A',
+        'SSIM_Avg': 'N/A',
+        'Status': 'FAILED'
+    }
+
+    if metrics:
+        result_row.update({
+            'MSE_Avg': f"{metrics['MSE_Avg']:.4f}",
+            'PSNR_Avg_dB': f"{metrics['PSNR_Avg_dB']:.4f}",
+            'SSIM_Avg': f"{metrics['SSIM_Avg']:.4f}",
+            'Status': 'OK'
+        })
+        print(
+            f"   RESULTS: MSE: {result_row['MSE_Avg']}, PSNR (dB): {result_row['PSNR_Avg_dB']}, SSIM: {result_row['SSIM_Avg']}")
+    else:
+        print("   STATUS: Failed to retrieve metrics. Check FFmpeg output for stream errors.")
+
+    return result_row
 
-        comparison_results.append(result_row)
 
+def print_results(comparison_results: List[Dict]):
     print("\n\n--- Video Quality Comparison Results  (MSE/PSNR/SSIM) ---")
     if not comparison_results:
         print("No comparisons were completed.")
@@ -244,6 +250,35 @@ def batch_compare_videos(original_dir: str, compressed_dir: str):
 
     print("\n--- Batch Comparison Complete ---")
 
+
+def batch_compare_videos(original_dir: str, compressed_dir: str, manifest: Optional[dict] = None):
+    if manifest is not None:
+        original_map, compressed_map = get_video_files_from_manifest(manifest, compressed_dir)
+    else:
+        original_map = get_video_files(original_dir)
+        compressed_map = get_video_files(compressed_dir)
+
+    common_keys = original_map.keys() & compressed_map.keys()
+
+    comparison_results: List[Dict] = []
+
+    if not common_keys:
+        print("No matching video files found in both directories (including subfolders).")
+        return
+
+    print(f"--- Starting Recursive Batch Comparison ({len(common_keys)} pairs) ---")
+    print(f"Original Root Dir: {original_dir}")
+    print(f"Compressed Root Dir: {compressed_dir}")
+    print("-" * 70)
+
+    for map_key in sorted(list(common_keys)):
+        original_rel_filename, original_path = original_map[map_key]
+        compressed_rel_filename, compressed_path = compressed_map[map_key]
+
+        comparison_results.append(compare_pair(original_path, compressed_path, original_rel_filename))
+
+    print_results(comparison_results)
+
 # --- Test ---
 # ORIGINAL_DIR = 'input/video/V-3'
 # COMPRESSED_DIR = 'output/video/AV1/V-3'
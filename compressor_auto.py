@@ -0,0 +1,297 @@
+import bz2
+import hashlib
+import itertools
+import zlib
+import lz4.frame
+import os
+import time
+import compressor_bz2
+import compressor_lz4
+import compressor_zlib
+import entropy_check
+import file_manifest
+import metrics
+import random_access
+import run_journal
+import solid_archive
+import worker_pool
+
+TEXT_EXTENSIONS = compressor_zlib.TEXT_EXTENSIONS
+
+# Backend name -> (module used for the real compression, in-memory compressor for trials, levels to try)
+BACKENDS = {
+    'lz4': (compressor_lz4, lambda data, level: lz4.frame.compress(data, compression_level=level), (1, 4, 9)),
+    'zlib': (compressor_zlib, lambda data, level: zlib.compress(data, level), (1, 6, 9)),
+    'bz2': (compressor_bz2, lambda data, level: bz2.compress(data, level), (1, 9)),
+}
+
+# Files at least this large are compressed one at a time with every job as threads, on the chosen backend's block path
+# (seekable outputs take that path even with one job, the block format is what makes them seekable)
+PARALLEL_MIN_SIZE = min(module.PARALLEL_MIN_SIZE for module, _, _ in BACKENDS.values())
+
+OBJECTIVES = ('size', 'speed')
+SAMPLE_BLOCKS = 4
+SAMPLE_BLOCK_SIZE = 64 * 1024
+
+
+def _read_sample(input_path: str, file_size: int) -> bytes:
+    """Read SAMPLE_BLOCKS evenly spaced blocks, or the whole file when it is small enough."""
+    with open(input_path, 'rb') as f:
+        if file_size <= SAMPLE_BLOCKS * SAMPLE_BLOCK_SIZE:
+            return f.read()
+
+        stride = (file_size - SAMPLE_BLOCK_SIZE) // (SAMPLE_BLOCKS - 1)
+        blocks = []
+        for i in range(SAMPLE_BLOCKS):
+            f.seek(i * stride)
+            blocks.append(f.read(SAMPLE_BLOCK_SIZE))
+        return b"".join(blocks)
+
+
+def trial_compress(sample: bytes) -> list:
+    """Compress the sample with every backend and level; returns one dict per trial."""
+    trials = []
+    sample_mb = len(sample) / (1024 * 1024)
+
+    for backend, (_, compress_sample, levels) in BACKENDS.items():
+        for level in levels:
+            start_time = time.perf_counter()
+            compressed_size = len(compress_sample(sample, level))
+            duration = time.perf_counter() - start_time
+
+            trials.append({
+                'backend': backend,
+                'level': level,
+                'ratio': compressed_size / len(sample) if sample else 1.0,
+                'speed_mbps': sample_mb / duration if duration > 0 else float('inf'),
+            })
+    return trials
+
+
+def choose_backend(trials: list, objective='size', min_speed_mbps=0) -> dict:
+    """Pick the winning trial.
+
+    'size' takes the smallest output among trials at least min_speed_mbps fast,
+    falling back to the fastest trial when none is. 'speed' takes the fastest.
+    """
+    if objective not in OBJECTIVES:
+        raise ValueError(f"Unknown objective '{objective}'. Supported: {', '.join(OBJECTIVES)}.")
+
+    fastest = max(trials, key=lambda trial: trial['speed_mbps'])
+    if objective == 'speed':
+        return fastest
+
+    fast_enough = [trial for trial in trials if trial['speed_mbps'] >= min_speed_mbps]
+    if not fast_enough:
+        return fastest
+    return min(fast_enough, key=lambda trial: (trial['ratio'], -trial['speed_mbps']))
+
+
+def _select_and_compress_file(input_path, output_base, objective, min_speed_mbps, chunk_size, store_incompressible=True,
+                              threads=1, seekable=False):
+    """Worker task: returns (choice, original_size, compressed_size, sha256 of the input from the compressing read).
+
+    The sha256 is None when the file could not be compressed; empty files succeed like any other.
+    With threads or seekable, files at least the chosen backend's PARALLEL_MIN_SIZE go to its compress_file_parallel,
+    which writes the .idx sidecar too when seekable.
+    """
+    digest = hashlib.sha256()
+    try:
+        if store_incompressible and entropy_check.is_incompressible(input_path):
+            # Not worth a trial round, let alone a compressor.
+            original_size, stored_size = entropy_check.store_file(input_path, output_base, digest)
+            return ({'backend': 'store', 'level': 0, 'output_path': output_base}, original_size, stored_size,
+                    entropy_check.written_checksum(digest, stored_size))
+
+        file_size = os.path.getsize(input_path)
+        sample = _read_sample(input_path, file_size)
+        choice = choose_backend(trial_compress(sample), objective, min_speed_mbps)
+    except Exception as e:
+        print(f"Error sampling {input_path}: {e}")
+        return None, 0, 0, None
+
+    module = BACKENDS[choice['backend']][0]
+    output_path = output_base + module.COMPRESSED_EXTENSION
+    if (threads != 1 or seekable) and file_size >= module.PARALLEL_MIN_SIZE:
+        original_size, compressed_size = module.compress_file_parallel(input_path, output_path, choice['level'], chunk_size,
+                                                                      threads=threads, index=seekable, digest=digest)
+    else:
+        original_size, compressed_size = module.compress_file(input_path, output_path, choice['level'], chunk_size, digest=digest)
+    return ({'backend': choice['backend'], 'level': choice['level'], 'output_path': output_path}, original_size, compressed_size,
+            entropy_check.written_checksum(digest, compressed_size))
+
+
+def _choose_solid_backend(members: list, objective: str, min_speed_mbps: float) -> tuple:
+    # The archive is one stream, so sample across the members the way it will see them.
+    sample = []
+    sample_size = 0
+    for entry in members:
+        if sample_size >= SAMPLE_BLOCKS * SAMPLE_BLOCK_SIZE:
+            break
+        with open(entry['path'], 'rb') as f:
+            sample.append(f.read(SAMPLE_BLOCK_SIZE))
+        sample_size += len(sample[-1])
+
+    choice = choose_backend(trial_compress(b"".join(sample)), objective, min_speed_mbps)
+    return choice['backend'], choice['level']
+
+
+def compress_folder_auto(input_dir, output_dir, objective='size', min_speed_mbps=0, chunk_size=None, manifest=None, jobs=1,
+                         store_incompressible=True, seekable=False, solid=False):
+    run_journal.start_backend(manifest, "auto")
+    if not os.path.isdir(input_dir):
+        print(f"Error: Input directory not found at {input_dir}")
+        return
+
+    total_original_size = 0
+    total_compressed_size = 0
+    total_files_processed = 0
+    total_files_skipped = 0
+    total_files_unchanged = 0
+    backend_counts = {}
+
+    start_time = time.time()
+
+    print("-" * 85)
+    print(f"Starting Automatic TEXT Compression of Folder: {input_dir}")
+    print(f"Objective: {objective} | Speed Floor: {min_speed_mbps} MB/s | Backends: {', '.join(BACKENDS)}")
+    print("-" * 85)
+    metrics.console("File Path                             | Backend  | Original Size | Compressed Size | Ratio")
+    print("-" * 85)
+
+    manifest = file_manifest.resolve_manifest(input_dir, output_dir, manifest)
+    params = {'objective': objective, 'min_speed_mbps': min_speed_mbps, 'store_incompressible': store_incompressible}
+    if seekable:
+        params['seekable'] = True
+    solid_folders = solid_archive.plan_solid_folders(manifest['entries'], TEXT_EXTENSIONS, solid)
+    solid_paths = {entry['path'] for members in solid_folders.values() for entry in members}
+    parallel_tasks = []
+    tasks = []
+
+    for entry in manifest['entries']:
+        if entry['ext'] not in TEXT_EXTENSIONS:
+            total_files_skipped += 1
+            continue
+        if entry['path'] in solid_paths:
+            continue
+
+        target_dir = file_manifest.ensure_output_dir(manifest, output_dir, entry)
+        output_base = os.path.join(target_dir, entry['name'])
+
+        # The output extension depends on the backend chosen last time.
+        previous_output = run_journal.recorded_output(manifest, entry, "auto")
+        if previous_output and run_journal.is_up_to_date(manifest, entry, "auto", params, previous_output):
+            file_manifest.record_output(manifest, entry, previous_output)
+            total_files_unchanged += 1
+            continue
+
+        if (jobs != 1 or seekable) and entry['size'] >= PARALLEL_MIN_SIZE:
+            # One at a time, each spread over every job as threads, instead of tying up a single worker.
+            parallel_tasks.append(worker_pool.make_task(
+                entry['size'],
+                (entry, previous_output),
+                (entry['path'], output_base, objective, min_speed_mbps, chunk_size, store_incompressible, jobs, seekable)
+            ))
+            continue
+
+        tasks.append(worker_pool.make_task(
+            entry['size'],
+            (entry, previous_output),
+            (entry['path'], output_base, objective, min_speed_mbps, chunk_size, store_incompressible)
+        ))
+
+    results = itertools.chain(
+        worker_pool.run_tasks(_select_and_compress_file, parallel_tasks, 1, stage="auto"),
+        worker_pool.run_tasks(_select_and_compress_file, tasks, jobs, stage="auto"),
+    )
+
+    for (entry, previous_output), (choice, original_size, compressed_size, sha256) in results:
+        if sha256 is not None:
+            output_path = choice['output_path']
+            if previous_output and os.path.normpath(previous_output) != os.path.normpath(output_path):
+                # A different backend this time; the old output goes, and its sidecar with it.
+                for stale_path in (previous_output, previous_output + random_access.INDEX_EXTENSION):
+                    if os.path.isfile(stale_path):
+                        os.remove(stale_path)
+
+            run_journal.record_completed(manifest, entry, "auto", params, output_path, sha256)
+            file_manifest.record_output(manifest, entry, output_path)
+            if seekable and os.path.isfile(output_path + random_access.INDEX_EXTENSION):
+                file_manifest.record_output(manifest, entry, output_path + random_access.INDEX_EXTENSION)
+            metrics.record_file("auto", original_size, compressed_size,
+                                status="stored" if choice['backend'] == 'store' else "processed")
+            total_original_size += original_size
+            total_compressed_size += compressed_size
+            total_files_processed += 1
+
+            backend_label = f"{choice['backend']}-{choice['level']}"
+            backend_counts[backend_label] = backend_counts.get(backend_label, 0) + 1
+
+            compression_ratio = 1.0
+            if compressed_size > 0:
+                compression_ratio = original_size / compressed_size
+
+            file_info = os.path.join(entry['relative_dir'], entry['name'])
+
+            metrics.console(f"{file_info:40.40} | {backend_label:8} | {original_size:13,} B | {compressed_size:15,} B | {compression_ratio:5.2f}:1")
+        else:
+            metrics.record_counts("auto", error=1)
+
+    solid_totals = solid_archive.compress_solid_folders(
+        manifest, output_dir, "auto", params, solid_folders, jobs=jobs,
+        choose=lambda members: _choose_solid_backend(members, objective, min_speed_mbps))
+    total_original_size += solid_totals['original']
+    total_compressed_size += solid_totals['compressed']
+    total_files_processed += solid_totals['processed']
+    total_files_unchanged += solid_totals['unchanged']
+    if solid_totals['processed']:
+        backend_counts['solid'] = backend_counts.get('solid', 0) + solid_totals['processed']
+
+    end_time = time.time()
+    duration = end_time - start_time
+
+    run_journal.finish_backend(manifest, "auto")
+    metrics.record_counts("auto", skipped=total_files_skipped, unchanged=total_files_unchanged)
+    metrics.add_gauge('stage_seconds', duration, stage="auto")
+
+    if total_files_processed == 0 and total_files_unchanged > 0:
+        print(f"All {total_files_unchanged} eligible files are unchanged since the last run.")
+        return
+
+    if total_files_processed == 0:
+        print("No eligible text files found to compress.")
+        return
+
+    total_size_mb = total_original_size / (1024 * 1024)
+    speed_mbps = total_size_mb / duration if duration > 0 else float('inf')
+
+    savings = total_original_size - total_compressed_size
+    savings_percent_total = (savings / total_original_size) * 100 if total_original_size > 0 else 0
+
+    print("\n" + "=" * 85)
+    print("           FOLDER COMPRESSION COMPLETE")
+    print("=" * 85)
+    print(f"Total Files Processed: {total_files_processed} | Skipped: {total_files_skipped} | Unchanged: {total_files_unchanged}")
+    print(f"Backends Chosen: {', '.join(f'{label} x{count}' for label, count in sorted(backend_counts.items()))}")
+    print(f"Total Time Taken: {duration:.4f} seconds")
+    print("-" * 85)
+    print(f"Original Total Size: {total_original_size:,} bytes ({total_size_mb:.2f} MB)")
+    print(f"Compressed Total Size: {total_compressed_size:,} bytes")
+    print(f"Total Reduction: **{savings_percent_total:.2f}%** ({savings / (1024 * 1024):.2f} MB)")
+    print(f"Average Speed: **{speed_mbps:.2f} MB/s**")
+    print("=" * 85 + "\n")
+
+
+def decompress_folder_auto(input_dir, output_dir, chunk_size=65536, jobs=1):
+    # Each backend only picks up files with its own extension; stored files only need copying once.
+    for i, (module, _, _) in enumerate(BACKENDS.values()):
+        module.decompress_folder_streaming(input_dir, output_dir, chunk_size, copy_stored=(i == 0), jobs=jobs)
+
+
+# --- Test ---
+#INPUT_DIR = "input/text/T-1"
+#OUTPUT_COMPRESSED_DIR = "output/text/AUTO/T-1"
+#OUTPUT_RESTORED_DIR = "restored/text/AUTO/T-1"
+
+#compress_folder_auto(INPUT_DIR, OUTPUT_COMPRESSED_DIR, objective='size', min_speed_mbps=20)
+#decompress_folder_auto(OUTPUT_COMPRESSED_DIR, OUTPUT_RESTORED_DIR)
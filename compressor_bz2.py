@@ -1,31 +1,98 @@
 import bz2
+import functools
+import itertools
 import os
+import re
 import time
+from concurrent.futures import ThreadPoolExecutor
+import entropy_check
+import file_manifest
+import folder_restore
+import host_profile
+import metrics
+import random_access
+import run_journal
+import solid_archive
+import stream_pipeline
+import worker_pool
 
 TEXT_EXTENSIONS = (
     '.txt', '.csv', '.md', '.log', '.json', '.xml', '.py', '.html',
     '.css', '.js', '.ts', '.jsx', '.yaml', '.yml', '.cpp', '.json5', '.toml'
 )
 COMPRESSED_EXTENSION = ".bz2"
+PARALLEL_MIN_SIZE = 8 * 1024 * 1024  # Files at least this large are compressed as independent streams on every core
+# A stream header followed by the first block's magic; streams start on a byte boundary, blocks inside them do not.
+STREAM_START = re.compile(rb"BZh[1-9]\x31\x41\x59\x26\x53\x59")
+MAX_SEGMENT_SIZE = 64 * 1024 * 1024  # Longer stretches without a stream start are decoded as a single stream
 
 
-def _stream_bz2_compress_file(input_path, output_path, compressor, chunk_size=65536):
+def _stream_bz2_compress_file(input_path, output_path, compressor, chunk_size=65536, digest=None):
     try:
-        with open(input_path, 'rb') as f_in, open(output_path, 'wb') as f_out:
-            while True:
-                chunk = f_in.read(chunk_size)
+        with open(input_path, 'rb') as f_in, stream_pipeline.open_output(output_path) as f_out:
+            stream_pipeline.pipe_file(f_in, f_out, compressor.compress, compressor.flush, chunk_size, digest)
+
+            original_size = f_in.tell()
+            compressed_size = f_out.tell()
+
+        return original_size, compressed_size
+
+    except Exception as e:
+        print(f" Error compressing {input_path}: {e}")
+        return 0, 0
+
+
+def compress_file(input_path, output_path, level=None, chunk_size=None, digest=None):
+    level, chunk_size = host_profile.tuned('bz2', level, chunk_size)
+    compressor = bz2.BZ2Compressor(level)
+    return _stream_bz2_compress_file(input_path, output_path, compressor, chunk_size, digest)
 
-                if not chunk:
-                    break
 
-                compressed_chunk = compressor.compress(chunk)
-                f_out.write(compressed_chunk)
+def _compress_stream(block: bytes, level: int) -> bytes:
+    return bz2.compress(block, level)
 
-            remaining_data = compressor.flush()
-            f_out.write(remaining_data)
 
-        original_size = os.path.getsize(input_path)
-        compressed_size = os.path.getsize(output_path)
+def compress_file_parallel(input_path, output_path, level=None, chunk_size=None, threads=None, index=False, digest=None):
+    """pbzip2-style compression: each level * 100 kB block becomes its own bz2 stream, compressed on `threads` threads.
+
+    The streams are concatenated in order, which is a valid multi-stream .bz2
+    that bzip2, bz2.open and decompress_file_parallel all read. With index,
+    stream starts go into a random_access sidecar. chunk_size is unused; it
+    is accepted so this can stand in for compress_file, as is digest (updated
+    with every block read).
+    """
+    level, chunk_size = host_profile.tuned('bz2', level, chunk_size)
+    threads = worker_pool.resolve_jobs(threads)
+    block_size = level * 100 * 1000  # One bzip2 block per stream
+    access_index = random_access.new_index('bz2')
+    try:
+        with open(input_path, 'rb') as f_in, stream_pipeline.open_output(output_path) as f_out, \
+                ThreadPoolExecutor(max_workers=threads) as executor:
+            pending = []
+            offset = 0
+            lines = 0
+            blocks = stream_pipeline.input_blocks(f_in, block_size)
+            block = next(blocks, b"")  # An empty file still gets one (empty) stream
+            while block is not None:
+                if digest is not None:
+                    digest.update(block)
+                pending.append((executor.submit(_compress_stream, block, level), offset, lines))
+                offset += len(block)
+                if index:
+                    lines += stream_pipeline.count_newlines(block)
+                block = next(blocks, None)
+
+                # Keep a couple of blocks per thread in flight and write the finished ones in order.
+                while pending and (len(pending) > 2 * threads or block is None):
+                    future, stream_offset, stream_lines = pending.pop(0)
+                    random_access.add_point(access_index, stream_offset, f_out.tell(), stream_lines)
+                    f_out.write(future.result())
+
+            original_size = f_in.tell()
+            compressed_size = f_out.tell()
+
+        if index:
+            random_access.write_index(output_path, access_index, original_size, lines)
         return original_size, compressed_size
 
     except Exception as e:
@@ -33,19 +100,81 @@ def _stream_bz2_compress_file(input_path, output_path, compressor, chunk_size=65
         return 0, 0
 
 
+def _split_streams(f_in, chunk_size):
+    """Yield the compressed file in pieces that each start at a stream header (the last one may hold several streams)."""
+    buffer = bytearray()
+    start = 0  # Where the piece not yielded yet begins; the buffer is only compacted once that passes its middle
+    search_from = 1
+    while True:
+        chunk = f_in.read(max(chunk_size, 1024 * 1024))
+        if not chunk:
+            break
+        buffer += chunk
+
+        for match in STREAM_START.finditer(buffer, search_from):
+            yield buffer[start:match.start()]
+            start = match.start()
+        search_from = max(start + 1, len(buffer) - 9)  # A header split across two reads is found on the next pass
+
+        if len(buffer) - start > MAX_SEGMENT_SIZE:
+            raise ValueError("no stream boundary found, not a multi-stream file")
+        if start > len(buffer) // 2:
+            del buffer[:start]
+            search_from -= start
+            start = 0
+
+    if len(buffer) > start:
+        yield buffer[start:]
+
+
+def decompress_file_parallel(input_path, output_path, chunk_size=65536, threads=None):
+    """Decode a multi-stream .bz2 on `threads` threads by cutting it at stream headers.
+
+    A header pattern can in principle also occur inside compressed data, so a
+    piece that does not decode on its own, or a file with very long streams,
+    makes the whole file fall back to _stream_bz2_decompress_file.
+    """
+    threads = worker_pool.resolve_jobs(threads)
+    try:
+        with open(input_path, 'rb') as f_in, open(output_path, 'wb') as f_out, \
+                ThreadPoolExecutor(max_workers=threads) as executor:
+            pending = []
+            for segment in itertools.chain(_split_streams(f_in, chunk_size), [None]):
+                if segment is not None:
+                    pending.append(executor.submit(bz2.decompress, segment))
+                while pending and (len(pending) > 2 * threads or segment is None):
+                    f_out.write(pending.pop(0).result())
+
+        compressed_size = os.path.getsize(input_path)
+        restored_size = os.path.getsize(output_path)
+        return compressed_size, restored_size
+
+    except (ValueError, OSError, EOFError):
+        return _stream_bz2_decompress_file(input_path, output_path, bz2.BZ2Decompressor(), chunk_size)
+
+
 def _stream_bz2_decompress_file(input_path, output_path, decompressor, chunk_size=65536):
     try:
         with open(input_path, 'rb') as f_in, open(output_path, 'wb') as f_out:
+            in_stream = False
             while True:
                 chunk = f_in.read(chunk_size)
 
                 if not chunk:
                     break
 
-                decompressed_chunk = decompressor.decompress(chunk)
-                f_out.write(decompressed_chunk)
+                # Multi-stream files: a new decompressor picks up where the previous stream ended.
+                while chunk:
+                    f_out.write(decompressor.decompress(chunk))
+                    chunk = b""
+                    in_stream = not decompressor.eof
+                    if decompressor.eof:
+                        chunk = decompressor.unused_data
+                        decompressor = bz2.BZ2Decompressor()
 
-            f_out.write(decompressor.unused_data)
+            if in_stream:
+                # The stream's CRC was never reached, so nothing vouches for what was written.
+                raise EOFError("compressed data ends before the end of the stream")
 
         compressed_size = os.path.getsize(input_path)
         restored_size = os.path.getsize(output_path)
@@ -56,63 +185,120 @@ def _stream_bz2_decompress_file(input_path, output_path, decompressor, chunk_siz
         return 0, 0
 
 
-def compress_folder_streaming(input_dir, output_dir, level=9, chunk_size=65536):
+def _restore_file(input_path, output_path, chunk_size=65536, threads=1):
+    # folder_restore only passes threads to files large enough to be worth splitting.
+    if threads != 1:
+        return decompress_file_parallel(input_path, output_path, chunk_size, threads)
+    return _stream_bz2_decompress_file(input_path, output_path, bz2.BZ2Decompressor(), chunk_size)
+
+
+def compress_folder_streaming(input_dir, output_dir, level=None, chunk_size=None, manifest=None, jobs=1, store_incompressible=True, seekable=False, solid=False):
+    run_journal.start_backend(manifest, "bz2")
     if not os.path.isdir(input_dir):
         print(f" Error: Input directory not found at {input_dir}")
         return
 
+    level, chunk_size = host_profile.tuned('bz2', level, chunk_size)
+
     total_original_size = 0
     total_compressed_size = 0
     total_files_processed = 0
     total_files_skipped = 0
+    total_files_unchanged = 0
+    total_files_stored = 0
 
     start_time = time.time()
 
-    print("-" * 75)
-    print(f"Starting BZ2 TEXT Compression of Folder: {input_dir}")
-    print(f"Compression Level: {level} (1=Fastest, 9=Best Compression)")
-    print("-" * 75)
-    print("File Path                             | Original Size | Compressed Size | Ratio")
-    print("-" * 75)
-
-    for root, _, files in os.walk(input_dir):
-        relative_dir = os.path.relpath(root, input_dir)
-
-        target_dir = os.path.join(output_dir, relative_dir)
-        os.makedirs(target_dir, exist_ok=True)
-
-        for filename in files:
-            _, ext = os.path.splitext(filename)
-            if ext.lower() not in TEXT_EXTENSIONS:
-                total_files_skipped += 1
-                continue
-
-            input_path = os.path.join(root, filename)
-
-            output_filename = filename + COMPRESSED_EXTENSION
-            output_path = os.path.join(target_dir, output_filename)
-
-            compressor = bz2.BZ2Compressor(level)
-
-            original_size, compressed_size = _stream_bz2_compress_file(
-                input_path,
-                output_path,
-                compressor,
-                chunk_size
-            )
-
-            if original_size > 0:
-                total_original_size += original_size
-                total_compressed_size += compressed_size
-                total_files_processed += 1
-
-                compression_ratio = 1.0
-                if compressed_size > 0:
-                    compression_ratio = original_size / compressed_size
-
-                file_info = os.path.join(relative_dir, filename)
-
-                print(f"{file_info:40.40} | {original_size:13,} B | {compressed_size:15,} B | {compression_ratio:5.2f}:1")
+    if not file_manifest.continues_batch(manifest):
+        print("-" * 75)
+        print(f"Starting BZ2 TEXT Compression of Folder: {input_dir}")
+        print(f"Compression Level: {level} (1=Fastest, 9=Best Compression)")
+        print("-" * 75)
+        metrics.console("File Path                             | Original Size | Compressed Size | Ratio")
+        print("-" * 75)
+
+    manifest = file_manifest.resolve_manifest(input_dir, output_dir, manifest)
+    params = {'level': level, 'store_incompressible': store_incompressible}
+    if seekable:
+        params['seekable'] = True
+    # Small files of the folders picked for solid mode are packed together after the per-file pass.
+    solid_folders = solid_archive.plan_solid_folders(manifest['entries'], TEXT_EXTENSIONS, solid)
+    solid_paths = {entry['path'] for members in solid_folders.values() for entry in members}
+    parallel_tasks = []
+    tasks = []
+
+    for entry in manifest['entries']:
+        if entry['ext'] not in TEXT_EXTENSIONS:
+            total_files_skipped += 1
+            continue
+        if entry['path'] in solid_paths:
+            continue
+
+        target_dir = file_manifest.ensure_output_dir(manifest, output_dir, entry)
+        output_path = os.path.join(target_dir, entry['name'] + COMPRESSED_EXTENSION)
+        stored_path = os.path.join(target_dir, entry['name'])
+
+        # Incompressible files are stored under their own name, so check whichever output was written last time.
+        previous_output = run_journal.recorded_output(manifest, entry, "bz2") or output_path
+        if run_journal.is_up_to_date(manifest, entry, "bz2", params, previous_output):
+            file_manifest.record_output(manifest, entry, previous_output)
+            total_files_unchanged += 1
+            continue
+
+        if (jobs != 1 or seekable) and entry['size'] >= PARALLEL_MIN_SIZE:
+            # One at a time, each spread over every job as threads, instead of tying up a single worker.
+            # The block format is also what makes a seekable output, so it is used even with one job then.
+            parallel_tasks.append(worker_pool.make_task(
+                entry['size'],
+                (entry, previous_output),
+                (functools.partial(compress_file_parallel, threads=jobs, index=seekable), entry['path'], output_path, stored_path,
+                 level, chunk_size, store_incompressible)
+            ))
+            continue
+
+        tasks.append(worker_pool.make_task(
+            entry['size'],
+            (entry, previous_output),
+            (compress_file, entry['path'], output_path, stored_path, level, chunk_size, store_incompressible)
+        ))
+
+    results = itertools.chain(
+        worker_pool.run_tasks(entropy_check.compress_or_store, parallel_tasks, 1, stage="bz2"),
+        worker_pool.run_tasks(entropy_check.compress_or_store, tasks, jobs, stage="bz2"),
+    )
+
+    for (entry, previous_output), (original_size, compressed_size, output_path, sha256) in results:
+        if sha256 is not None:
+            if os.path.normpath(previous_output) != os.path.normpath(output_path) and os.path.isfile(previous_output):
+                os.remove(previous_output)
+            if not output_path.endswith(COMPRESSED_EXTENSION):
+                total_files_stored += 1
+
+            run_journal.record_completed(manifest, entry, "bz2", params, output_path, sha256)
+            file_manifest.record_output(manifest, entry, output_path)
+            if seekable and os.path.isfile(output_path + random_access.INDEX_EXTENSION):
+                file_manifest.record_output(manifest, entry, output_path + random_access.INDEX_EXTENSION)
+            metrics.record_file("bz2", original_size, compressed_size,
+                                status="processed" if output_path.endswith(COMPRESSED_EXTENSION) else "stored")
+            total_original_size += original_size
+            total_compressed_size += compressed_size
+            total_files_processed += 1
+
+            compression_ratio = 1.0
+            if compressed_size > 0:
+                compression_ratio = original_size / compressed_size
+
+            file_info = os.path.join(entry['relative_dir'], entry['name'])
+
+            metrics.console(f"{file_info:40.40} | {original_size:13,} B | {compressed_size:15,} B | {compression_ratio:5.2f}:1")
+        else:
+            metrics.record_counts("bz2", error=1)
+
+    solid_totals = solid_archive.compress_solid_folders(manifest, output_dir, "bz2", params, solid_folders, level, jobs)
+    total_original_size += solid_totals['original']
+    total_compressed_size += solid_totals['compressed']
+    total_files_processed += solid_totals['processed']
+    total_files_unchanged += solid_totals['unchanged']
 
 
     total_files = total_files_processed
@@ -120,6 +306,14 @@ def compress_folder_streaming(input_dir, output_dir, level=9, chunk_size=65536):
     end_time = time.time()
     duration = end_time - start_time
 
+    run_journal.finish_backend(manifest, "bz2")
+    metrics.record_counts("bz2", skipped=total_files_skipped, unchanged=total_files_unchanged)
+    metrics.add_gauge('stage_seconds', duration, stage="bz2")
+
+    if total_files_processed == 0 and total_files_unchanged > 0:
+        print(f"All {total_files_unchanged} eligible files are unchanged since the last run.")
+        return
+
     if total_files == 0:
         print("No eligible text files found to compress.")
         return
@@ -128,12 +322,12 @@ def compress_folder_streaming(input_dir, output_dir, level=9, chunk_size=65536):
     speed_mbps = total_size_mb / duration if duration > 0 else 0
 
     savings = total_original_size - total_compressed_size
-    savings_percent = (savings / total_original_size) * 100
+    savings_percent = (savings / total_original_size) * 100 if total_original_size > 0 else 0
 
     print("\n" + "=" * 75)
     print("           FOLDER COMPRESSION COMPLETE")
     print("=" * 75)
-    print(f"Total Files Processed: {total_files} | Skipped: {total_files_skipped}")
+    print(f"Total Files Processed: {total_files} | Skipped: {total_files_skipped} | Unchanged: {total_files_unchanged} | Stored: {total_files_stored}")
     print(f"Total Time Taken: {duration:.4f} seconds")
     print("-" * 75)
     print(f"Original Total Size: {total_original_size:,} bytes ({total_size_mb:.2f} MB)")
@@ -143,14 +337,11 @@ def compress_folder_streaming(input_dir, output_dir, level=9, chunk_size=65536):
     print("=" * 75 + "\n")
 
 
-def decompress_folder_streaming(input_dir, output_dir, chunk_size=65536):
+def decompress_folder_streaming(input_dir, output_dir, chunk_size=65536, copy_stored=True, jobs=1):
     if not os.path.isdir(input_dir):
         print(f" Error: Input directory not found at {input_dir}")
         return
 
-    total_compressed_size = 0
-    total_restored_size = 0
-    total_files = 0
     start_time = time.time()
 
     print("-" * 60)
@@ -158,41 +349,22 @@ def decompress_folder_streaming(input_dir, output_dir, chunk_size=65536):
     print(f"Output Directory: {output_dir}")
     print("-" * 60)
 
-    for root, _, files in os.walk(input_dir):
-        relative_dir = os.path.relpath(root, input_dir)
-
-        target_dir = os.path.join(output_dir, relative_dir)
-        os.makedirs(target_dir, exist_ok=True)
-
-        for filename in files:
-            if not filename.endswith(COMPRESSED_EXTENSION):
-                continue
-
-            input_path = os.path.join(root, filename)
+    totals = folder_restore.restore_folder(input_dir, output_dir, COMPRESSED_EXTENSION,
+                                           functools.partial(_restore_file, chunk_size=chunk_size),
+                                           jobs=jobs, parallel_min_size=PARALLEL_MIN_SIZE // 4, stage="bz2")
+    total_compressed_size = totals['compressed_size']
+    total_restored_size = totals['restored_size']
+    total_files = totals['files']
 
-            restored_filename = filename[:-len(COMPRESSED_EXTENSION)]
-            output_path = os.path.join(target_dir, restored_filename)
-
-            print(f"  Decompressing: {os.path.join(relative_dir, filename)}...")
-
-            decompressor = bz2.BZ2Decompressor()
-
-            compressed_size, restored_size = _stream_bz2_decompress_file(
-                input_path,
-                output_path,
-                decompressor,
-                chunk_size
-            )
-
-            if restored_size > 0:
-                total_compressed_size += compressed_size
-                total_restored_size += restored_size
-                total_files += 1
+    if copy_stored:
+        total_files_stored = entropy_check.copy_stored_files(input_dir, output_dir, TEXT_EXTENSIONS)
+        if total_files_stored:
+            print(f"  Copied {total_files_stored} stored (uncompressed) files.")
 
     end_time = time.time()
     duration = end_time - start_time
 
-    if total_files == 0:
+    if total_files == 0 and not totals['failed']:
         print(f"No {COMPRESSED_EXTENSION} files found to decompress.")
         return
 
@@ -208,6 +380,8 @@ def decompress_folder_streaming(input_dir, output_dir, chunk_size=65536):
     print(f"Input Total Size (Compressed): {total_compressed_size:,} bytes")
     print(f"Output Total Size (Restored): {total_restored_size:,} bytes ({total_size_mb:.2f} MB)")
     print(f"Average Decompression Speed: **{speed_mbps:.2f} MB/s**")
+    print("-" * 60)
+    folder_restore.print_verification(totals)
     print("=" * 60 + "\n")
 
 
@@ -1,6 +1,9 @@
 import subprocess
 import os
 import time
+import file_manifest
+import metrics
+import run_journal
 
 
 def check_ffmpeg():
@@ -28,10 +31,10 @@ def _execute_ffmpeg_command(command, input_path, output_path, original_size, sta
 
         savings_percent = (1 - (optimized_size / original_size)) * 100 if original_size > 0 else 0
 
-        print(f"  > Original Size: {original_size / (1024 * 1024):.2f} MB")
-        print(f"  > Output Size: {optimized_size / (1024 * 1024):.2f} MB")
-        print(f"  > Time Taken:  {duration:.2f} seconds")
-        print(f"  > Reduction:   **{savings_percent:.2f}%**")
+        metrics.console(f"  > Original Size: {original_size / (1024 * 1024):.2f} MB")
+        metrics.console(f"  > Output Size: {optimized_size / (1024 * 1024):.2f} MB")
+        metrics.console(f"  > Time Taken:  {duration:.2f} seconds")
+        metrics.console(f"  > Reduction:   **{savings_percent:.2f}%**")
 
         return original_size, optimized_size, duration
 
@@ -68,7 +71,7 @@ def _process_single_file(input_path, output_path, codec, crf):
             '-c:a', 'copy',
             '-y', output_path
         ]
-        print(f"  > Codec: H.264 (libx264) | CRF: {crf}")
+        metrics.console(f"  > Codec: H.264 (libx264) | CRF: {crf}")
     elif codec == 'hevc':
         command = [
             'ffmpeg', '-i', input_path,
@@ -77,7 +80,7 @@ def _process_single_file(input_path, output_path, codec, crf):
             '-c:a', 'copy',
             '-y', output_path
         ]
-        print(f"  > Codec: HEVC (libx265) | CRF: {crf}")
+        metrics.console(f"  > Codec: HEVC (libx265) | CRF: {crf}")
     elif codec == 'av1':
         command = [
             'ffmpeg', '-i', input_path,
@@ -87,7 +90,7 @@ def _process_single_file(input_path, output_path, codec, crf):
             '-c:a', 'copy',
             '-y', output_path
         ]
-        print(f"  > Codec: AV1 (libaom-av1) | CRF: {crf} | Speed: 8")
+        metrics.console(f"  > Codec: AV1 (libaom-av1) | CRF: {crf} | Speed: 8")
     else:
         print(f"Error: Unsupported codec '{codec}'. Supported: 'h264', 'hevc', and 'av1'.")
         return 0, 0, 0
@@ -95,14 +98,16 @@ def _process_single_file(input_path, output_path, codec, crf):
     return _execute_ffmpeg_command(command, input_path, output_path, original_size, start_time)
 
 
-def process_video_folder(input_dir, output_dir, codec='av1', crf=30):
-    print("=" * 70)
-    print("Starting Video Batch Compression")
-    print("-" * 70)
-    print(f"Input Directory: {input_dir}")
-    print(f"Output Directory: {output_dir}")
-    print(f"Target Codec: {codec.upper()} | Target CRF: {crf}")
-    print("=" * 70)
+def process_video_folder(input_dir, output_dir, codec='av1', crf=30, manifest=None):
+    run_journal.start_backend(manifest, "ffmpeg")
+    if not file_manifest.continues_batch(manifest):
+        print("=" * 70)
+        print("Starting Video Batch Compression")
+        print("-" * 70)
+        print(f"Input Directory: {input_dir}")
+        print(f"Output Directory: {output_dir}")
+        print(f"Target Codec: {codec.upper()} | Target CRF: {crf}")
+        print("=" * 70)
 
     if not check_ffmpeg():
         return
@@ -123,47 +128,66 @@ def process_video_folder(input_dir, output_dir, codec='av1', crf=30):
     total_time_spent = 0
     total_files_processed = 0
     total_files_skipped = 0
+    total_files_unchanged = 0
 
     start_time_batch = time.time()
 
     ELIGIBLE_EXTENSIONS = ('.mp4', '.mkv', '.avi', '.mov', '.webm', '.flv', '.ts', '.wmv')
 
-    for root, _, files in os.walk(input_dir):
-        relative_dir = os.path.relpath(root, input_dir)
+    manifest = file_manifest.resolve_manifest(input_dir, output_dir, manifest)
+    params = {'codec': codec, 'crf': crf}
 
-        target_dir = os.path.join(output_dir, relative_dir)
+    for entry in manifest['entries']:
+        if entry['ext'] not in ELIGIBLE_EXTENSIONS:
+            total_files_skipped += 1
+            continue
 
-        os.makedirs(target_dir, exist_ok=True)
+        relative_dir = entry['relative_dir']
+        filename = entry['name']
+        input_path = entry['path']
+        target_dir = file_manifest.ensure_output_dir(manifest, output_dir, entry)
 
-        for filename in files:
-            input_path = os.path.join(root, filename)
+        base, _ = os.path.splitext(filename)
+        output_path = os.path.join(target_dir, base + output_ext)
 
-            _, ext = os.path.splitext(filename)
-            if ext.lower() not in ELIGIBLE_EXTENSIONS:
-                total_files_skipped += 1
-                continue
+        if run_journal.is_up_to_date(manifest, entry, "ffmpeg", params, output_path):
+            file_manifest.record_output(manifest, entry, output_path)
+            total_files_unchanged += 1
+            continue
 
-            print(f"\n--- Processing: {os.path.join(relative_dir, filename)} ---")
+        metrics.console(f"\n--- Processing: {os.path.join(relative_dir, filename)} ---")
 
-            base, _ = os.path.splitext(filename)
-            output_path = os.path.join(target_dir, base + output_ext)
-
-            original_size, compressed_size, duration = _process_single_file(
-                input_path,
-                output_path,
-                codec,
-                crf
-            )
+        (original_size, compressed_size, duration), sha256 = run_journal.with_input_checksum(
+            _process_single_file,
+            input_path,
+            output_path,
+            codec,
+            crf
+        )
 
-            if original_size > 0:
-                total_original_size += original_size
-                total_compressed_size += compressed_size
-                total_time_spent += duration
-                total_files_processed += 1
+        if original_size > 0:
+            file_manifest.record_output(manifest, entry, output_path)
+            run_journal.record_completed(manifest, entry, "ffmpeg", params, output_path, sha256)
+            metrics.record_file("ffmpeg", original_size, compressed_size)
+            metrics.observe('file_seconds', duration, stage="ffmpeg")
+            total_original_size += original_size
+            total_compressed_size += compressed_size
+            total_time_spent += duration
+            total_files_processed += 1
+        else:
+            metrics.record_counts("ffmpeg", error=1)
 
     total_elapsed_time = time.time() - start_time_batch
 
+    run_journal.finish_backend(manifest, "ffmpeg")
+    metrics.record_counts("ffmpeg", skipped=total_files_skipped, unchanged=total_files_unchanged)
+    metrics.add_gauge('stage_seconds', total_elapsed_time, stage="ffmpeg")
+
     print("\n" + "=" * 70)
+    if total_files_processed == 0 and total_files_unchanged > 0:
+        print(f"All {total_files_unchanged} eligible files are unchanged since the last run.")
+        return
+
     if total_files_processed == 0:
         print("        Batch Video Compression Failed or no Eligible Files Processed")
         print("=" * 70)
@@ -174,7 +198,7 @@ def process_video_folder(input_dir, output_dir, codec='av1', crf=30):
 
     print("        Batch Video Compression Complete")
     print("=" * 70)
-    print(f"Total Files Processed: {total_files_processed} | Skipped: {total_files_skipped}")
+    print(f"Total Files Processed: {total_files_processed} | Skipped: {total_files_skipped} | Unchanged: {total_files_unchanged}")
     print(f"Total Time Taken: {total_elapsed_time:.4f} seconds")
     print("-" * 70)
     print(f"Original Total Size: {total_original_size / (1024 * 1024):.2f} MB")
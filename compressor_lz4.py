@@ -1,28 +1,103 @@
+import functools
+import itertools
 import lz4.frame
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor
+import entropy_check
+import file_manifest
+import folder_restore
+import host_profile
+import metrics
+import random_access
+import run_journal
+import solid_archive
+import stream_pipeline
+import worker_pool
 
 TEXT_EXTENSIONS = (
     '.txt', '.csv', '.md', '.log', '.json', '.xml', '.py', '.html',
     '.css', '.js', '.ts', '.jsx', '.yaml', '.yml', '.cpp', '.json5', '.toml'
 )
 COMPRESSED_EXTENSION = ".lz4"
+PARALLEL_MIN_SIZE = 32 * 1024 * 1024  # Files at least this large are compressed as independent frames on every core
+FRAME_SIZE = 8 * 1024 * 1024  # Input bytes per frame; frames are what the threads compress and decompress
+BLOCK_SIZE = lz4.frame.BLOCKSIZE_MAX4MB  # Block size inside each frame (BLOCKSIZE_MAX64KB / 256KB / 1MB / 4MB)
+MAX_FRAME_SIZE = 64 * 1024 * 1024  # Larger frames (single-frame files) are decoded as a stream instead
 
+FRAME_MAGIC = 0x184D2204
+SKIPPABLE_FRAME_MAGIC = 0x184D2A50  # Low 4 bits are free
 
-def _stream_lz4_compress_file(input_path, output_path, chunk_size=65536, compression_level=4):
+
+def _stream_lz4_compress_file(input_path, output_path, chunk_size=65536, compression_level=4, digest=None):
     try:
-        with open(input_path, 'rb') as f_in:
-            with lz4.frame.open(output_path, 'wb', compression_level=compression_level) as f_out:
-                while True:
-                    chunk = f_in.read(chunk_size)
+        # The content checksum lets every decoder, not only folder_restore, detect a damaged file.
+        compressor = lz4.frame.LZ4FrameCompressor(compression_level=compression_level, content_checksum=True)
+        with open(input_path, 'rb') as f_in, stream_pipeline.open_output(output_path) as f_out:
+            f_out.write(compressor.begin())
+            stream_pipeline.pipe_file(f_in, f_out, compressor.compress, compressor.flush, chunk_size, digest)
 
-                    if not chunk:
-                        break
+            original_size = f_in.tell()
+            compressed_size = f_out.tell()
+
+        return original_size, compressed_size
+
+    except Exception as e:
+        print(f" Error compressing {input_path}: {e}")
+        return 0, 0
+
+
+def compress_file(input_path, output_path, level=None, chunk_size=None, digest=None):
+    level, chunk_size = host_profile.tuned('lz4', level, chunk_size)
+    return _stream_lz4_compress_file(input_path, output_path, chunk_size=chunk_size, compression_level=level, digest=digest)
 
-                    f_out.write(chunk)
 
-        original_size = os.path.getsize(input_path)
-        compressed_size = os.path.getsize(output_path)
+def _compress_frame(data: bytes, level: int) -> bytes:
+    return lz4.frame.compress(data, compression_level=level, block_size=BLOCK_SIZE, block_linked=False,
+                              block_checksum=True, content_checksum=True)
+
+
+def compress_file_parallel(input_path, output_path, level=None, chunk_size=None, threads=None, index=False, digest=None):
+    """Compress FRAME_SIZE pieces into independent, checksummed LZ4 frames on `threads` threads.
+
+    Blocks are not linked and every frame carries block and content
+    checksums. The frames are concatenated in order, which lz4.frame.open
+    and the lz4 command line tool read as one file. With index, frame starts
+    go into a random_access sidecar. chunk_size is unused; it is accepted so
+    this can stand in for compress_file, as is digest (updated with every
+    frame's input).
+    """
+    level, chunk_size = host_profile.tuned('lz4', level, chunk_size)
+    threads = worker_pool.resolve_jobs(threads)
+    access_index = random_access.new_index('lz4')
+    try:
+        with open(input_path, 'rb') as f_in, stream_pipeline.open_output(output_path) as f_out, \
+                ThreadPoolExecutor(max_workers=threads) as executor:
+            pending = []
+            offset = 0
+            lines = 0
+            blocks = stream_pipeline.input_blocks(f_in, FRAME_SIZE)
+            data = next(blocks, b"")  # An empty file still gets one (empty) frame
+            while data is not None:
+                if digest is not None:
+                    digest.update(data)
+                pending.append((executor.submit(_compress_frame, data, level), offset, lines))
+                offset += len(data)
+                if index:
+                    lines += stream_pipeline.count_newlines(data)
+                data = next(blocks, None)
+
+                # Keep a couple of frames per thread in flight and write the finished ones in order.
+                while pending and (len(pending) > 2 * threads or data is None):
+                    future, frame_offset, frame_lines = pending.pop(0)
+                    random_access.add_point(access_index, frame_offset, f_out.tell(), frame_lines)
+                    f_out.write(future.result())
+
+            original_size = f_in.tell()
+            compressed_size = f_out.tell()
+
+        if index:
+            random_access.write_index(output_path, access_index, original_size, lines)
         return original_size, compressed_size
 
     except Exception as e:
@@ -30,6 +105,73 @@ def _stream_lz4_compress_file(input_path, output_path, chunk_size=65536, compres
         return 0, 0
 
 
+def _read_frame(f_in):
+    """Bytes of the next frame (b"" for a skippable frame), or None at the end of the file."""
+    magic = f_in.read(4)
+    if not magic:
+        return None
+    if len(magic) < 4:
+        raise ValueError("truncated frame header")
+
+    magic_number = int.from_bytes(magic, 'little')
+    if magic_number & 0xFFFFFFF0 == SKIPPABLE_FRAME_MAGIC:
+        f_in.seek(int.from_bytes(f_in.read(4), 'little'), os.SEEK_CUR)
+        return b""
+    if magic_number != FRAME_MAGIC:
+        raise ValueError("not an LZ4 frame")
+
+    descriptor = f_in.read(2)
+    flags = descriptor[0]
+    # Optional content size and dictionary id, then the header checksum byte.
+    parts = [magic, descriptor, f_in.read((8 if flags & 0x08 else 0) + (4 if flags & 0x01 else 0) + 1)]
+    block_checksum_size = 4 if flags & 0x10 else 0
+    frame_size = 0
+
+    while True:
+        block_header = f_in.read(4)
+        parts.append(block_header)
+        block_size = int.from_bytes(block_header, 'little') & 0x7FFFFFFF  # High bit marks an uncompressed block
+        if block_size == 0:
+            break
+        frame_size += block_size
+        if frame_size > MAX_FRAME_SIZE:
+            raise ValueError("frame too large to decode in memory")
+        parts.append(f_in.read(block_size + block_checksum_size))
+
+    if flags & 0x04:
+        parts.append(f_in.read(4))  # Content checksum
+    return b"".join(parts)
+
+
+def decompress_file_parallel(input_path, output_path, chunk_size=65536, threads=None):
+    """Decode a file of concatenated LZ4 frames, one frame per thread, writing them back in order.
+
+    Each frame's checksums are verified by lz4.frame.decompress. A file with
+    frames over MAX_FRAME_SIZE (such as a single-frame file) is decoded by
+    _stream_lz4_decompress_file instead.
+    """
+    threads = worker_pool.resolve_jobs(threads)
+    try:
+        with open(input_path, 'rb') as f_in, open(output_path, 'wb') as f_out, \
+                ThreadPoolExecutor(max_workers=threads) as executor:
+            pending = []
+            while True:
+                frame = _read_frame(f_in)
+                if frame:
+                    pending.append(executor.submit(lz4.frame.decompress, frame))
+                while pending and (len(pending) > 2 * threads or frame is None):
+                    f_out.write(pending.pop(0).result())
+                if frame is None:
+                    break
+
+        compressed_size = os.path.getsize(input_path)
+        restored_size = os.path.getsize(output_path)
+        return compressed_size, restored_size
+
+    except Exception:
+        return _stream_lz4_decompress_file(input_path, output_path, chunk_size)
+
+
 def _stream_lz4_decompress_file(input_path, output_path, chunk_size=65536):
     try:
         with lz4.frame.open(input_path, 'rb') as f_in:
@@ -51,61 +193,120 @@ def _stream_lz4_decompress_file(input_path, output_path, chunk_size=65536):
         return 0, 0
 
 
-def compress_folder_streaming(input_dir, output_dir, level=4, chunk_size=65536):
+def _restore_file(input_path, output_path, chunk_size=65536, threads=1):
+    # folder_restore only passes threads to files large enough to be worth splitting.
+    if threads != 1:
+        return decompress_file_parallel(input_path, output_path, chunk_size, threads)
+    return _stream_lz4_decompress_file(input_path, output_path, chunk_size)
+
+
+def compress_folder_streaming(input_dir, output_dir, level=None, chunk_size=None, manifest=None, jobs=1, store_incompressible=True, seekable=False, solid=False):
+    run_journal.start_backend(manifest, "lz4")
     if not os.path.isdir(input_dir):
         print(f"Error: Input directory not found at {input_dir}")
         return
 
+    level, chunk_size = host_profile.tuned('lz4', level, chunk_size)
+
     total_original_size = 0
     total_compressed_size = 0
     total_files_processed = 0
     total_files_skipped = 0
+    total_files_unchanged = 0
+    total_files_stored = 0
 
     start_time = time.time()
 
-    print("-" * 75)
-    print(f"Starting LZ4 TEXT Compression of Folder: {input_dir}")
-    print(f"Compression Level: {level}")
-    print("-" * 75)
-    print("File Path                             | Original Size | Compressed Size | Ratio")
-    print("-" * 75)
-
-    for root, _, files in os.walk(input_dir):
-        relative_dir = os.path.relpath(root, input_dir)
-
-        target_dir = os.path.join(output_dir, relative_dir)
-        os.makedirs(target_dir, exist_ok=True)
-
-        for filename in files:
-            _, ext = os.path.splitext(filename)
-            if ext.lower() not in TEXT_EXTENSIONS:
-                total_files_skipped += 1
-                continue
-
-            input_path = os.path.join(root, filename)
-
-            output_filename = filename + COMPRESSED_EXTENSION
-            output_path = os.path.join(target_dir, output_filename)
-
-            original_size, compressed_size = _stream_lz4_compress_file(
-                input_path,
-                output_path,
-                chunk_size=chunk_size,
-                compression_level=level
-            )
-
-            if original_size > 0:
-                total_original_size += original_size
-                total_compressed_size += compressed_size
-                total_files_processed += 1
-
-                compression_ratio = 1.0
-                if compressed_size > 0:
-                    compression_ratio = original_size / compressed_size
-
-                file_info = os.path.join(relative_dir, filename)
-
-                print(f"{file_info:40.40} | {original_size:13,} B | {compressed_size:15,} B | {compression_ratio:5.2f}:1")
+    if not file_manifest.continues_batch(manifest):
+        print("-" * 75)
+        print(f"Starting LZ4 TEXT Compression of Folder: {input_dir}")
+        print(f"Compression Level: {level}")
+        print("-" * 75)
+        metrics.console("File Path                             | Original Size | Compressed Size | Ratio")
+        print("-" * 75)
+
+    manifest = file_manifest.resolve_manifest(input_dir, output_dir, manifest)
+    params = {'level': level, 'store_incompressible': store_incompressible}
+    if seekable:
+        params['seekable'] = True
+    # Small files of the folders picked for solid mode are packed together after the per-file pass.
+    solid_folders = solid_archive.plan_solid_folders(manifest['entries'], TEXT_EXTENSIONS, solid)
+    solid_paths = {entry['path'] for members in solid_folders.values() for entry in members}
+    parallel_tasks = []
+    tasks = []
+
+    for entry in manifest['entries']:
+        if entry['ext'] not in TEXT_EXTENSIONS:
+            total_files_skipped += 1
+            continue
+        if entry['path'] in solid_paths:
+            continue
+
+        target_dir = file_manifest.ensure_output_dir(manifest, output_dir, entry)
+        output_path = os.path.join(target_dir, entry['name'] + COMPRESSED_EXTENSION)
+        stored_path = os.path.join(target_dir, entry['name'])
+
+        # Incompressible files are stored under their own name, so check whichever output was written last time.
+        previous_output = run_journal.recorded_output(manifest, entry, "lz4") or output_path
+        if run_journal.is_up_to_date(manifest, entry, "lz4", params, previous_output):
+            file_manifest.record_output(manifest, entry, previous_output)
+            total_files_unchanged += 1
+            continue
+
+        if (jobs != 1 or seekable) and entry['size'] >= PARALLEL_MIN_SIZE:
+            # One at a time, each spread over every job as threads, instead of tying up a single worker.
+            # The block format is also what makes a seekable output, so it is used even with one job then.
+            parallel_tasks.append(worker_pool.make_task(
+                entry['size'],
+                (entry, previous_output),
+                (functools.partial(compress_file_parallel, threads=jobs, index=seekable), entry['path'], output_path, stored_path,
+                 level, chunk_size, store_incompressible)
+            ))
+            continue
+
+        tasks.append(worker_pool.make_task(
+            entry['size'],
+            (entry, previous_output),
+            (compress_file, entry['path'], output_path, stored_path, level, chunk_size, store_incompressible)
+        ))
+
+    results = itertools.chain(
+        worker_pool.run_tasks(entropy_check.compress_or_store, parallel_tasks, 1, stage="lz4"),
+        worker_pool.run_tasks(entropy_check.compress_or_store, tasks, jobs, stage="lz4"),
+    )
+
+    for (entry, previous_output), (original_size, compressed_size, output_path, sha256) in results:
+        if sha256 is not None:
+            if os.path.normpath(previous_output) != os.path.normpath(output_path) and os.path.isfile(previous_output):
+                os.remove(previous_output)
+            if not output_path.endswith(COMPRESSED_EXTENSION):
+                total_files_stored += 1
+
+            run_journal.record_completed(manifest, entry, "lz4", params, output_path, sha256)
+            file_manifest.record_output(manifest, entry, output_path)
+            if seekable and os.path.isfile(output_path + random_access.INDEX_EXTENSION):
+                file_manifest.record_output(manifest, entry, output_path + random_access.INDEX_EXTENSION)
+            metrics.record_file("lz4", original_size, compressed_size,
+                                status="processed" if output_path.endswith(COMPRESSED_EXTENSION) else "stored")
+            total_original_size += original_size
+            total_compressed_size += compressed_size
+            total_files_processed += 1
+
+            compression_ratio = 1.0
+            if compressed_size > 0:
+                compression_ratio = original_size / compressed_size
+
+            file_info = os.path.join(entry['relative_dir'], entry['name'])
+
+            metrics.console(f"{file_info:40.40} | {original_size:13,} B | {compressed_size:15,} B | {compression_ratio:5.2f}:1")
+        else:
+            metrics.record_counts("lz4", error=1)
+
+    solid_totals = solid_archive.compress_solid_folders(manifest, output_dir, "lz4", params, solid_folders, level, jobs)
+    total_original_size += solid_totals['original']
+    total_compressed_size += solid_totals['compressed']
+    total_files_processed += solid_totals['processed']
+    total_files_unchanged += solid_totals['unchanged']
 
 
     total_files = total_files_processed
@@ -113,6 +314,14 @@ def compress_folder_streaming(input_dir, output_dir, level=4, chunk_size=65536):
     end_time = time.time()
     duration = end_time - start_time
 
+    run_journal.finish_backend(manifest, "lz4")
+    metrics.record_counts("lz4", skipped=total_files_skipped, unchanged=total_files_unchanged)
+    metrics.add_gauge('stage_seconds', duration, stage="lz4")
+
+    if total_files_processed == 0 and total_files_unchanged > 0:
+        print(f"All {total_files_unchanged} eligible files are unchanged since the last run.")
+        return
+
     if total_files == 0:
         print("No eligible text files found to compress.")
         return
@@ -130,7 +339,7 @@ def compress_folder_streaming(input_dir, output_dir, level=4, chunk_size=65536):
     print("\n" + "=" * 75)
     print("           FOLDER COMPRESSION COMPLETE")
     print("=" * 75)
-    print(f"Total Files Processed: {total_files} | Skipped: {total_files_skipped}")
+    print(f"Total Files Processed: {total_files} | Skipped: {total_files_skipped} | Unchanged: {total_files_unchanged} | Stored: {total_files_stored}")
     print(f"Total Time Taken: {duration:.4f} seconds")
     print("-" * 75)
     print(f"Original Total Size: {total_original_size:,} bytes ({total_size_mb:.2f} MB)")
@@ -141,14 +350,11 @@ def compress_folder_streaming(input_dir, output_dir, level=4, chunk_size=65536):
     print("=" * 75 + "\n")
 
 
-def decompress_folder_streaming(input_dir, output_dir, chunk_size=65536):
+def decompress_folder_streaming(input_dir, output_dir, chunk_size=65536, copy_stored=True, jobs=1):
     if not os.path.isdir(input_dir):
         print(f" Error: Input directory not found at {input_dir}")
         return
 
-    total_compressed_size = 0
-    total_restored_size = 0
-    total_files = 0
     start_time = time.time()
 
     print("-" * 60)
@@ -156,38 +362,22 @@ def decompress_folder_streaming(input_dir, output_dir, chunk_size=65536):
     print(f"Output Directory: {output_dir}")
     print("-" * 60)
 
-    for root, _, files in os.walk(input_dir):
-        relative_dir = os.path.relpath(root, input_dir)
-
-        target_dir = os.path.join(output_dir, relative_dir)
-        os.makedirs(target_dir, exist_ok=True)
-
-        for filename in files:
-            if not filename.endswith(COMPRESSED_EXTENSION):
-                continue
+    totals = folder_restore.restore_folder(input_dir, output_dir, COMPRESSED_EXTENSION,
+                                           functools.partial(_restore_file, chunk_size=chunk_size),
+                                           jobs=jobs, parallel_min_size=FRAME_SIZE, stage="lz4")
+    total_compressed_size = totals['compressed_size']
+    total_restored_size = totals['restored_size']
+    total_files = totals['files']
 
-            input_path = os.path.join(root, filename)
-
-            restored_filename = filename[:-len(COMPRESSED_EXTENSION)]
-            output_path = os.path.join(target_dir, restored_filename)
-
-            print(f"  [DECOMPRESS]: {os.path.join(relative_dir, filename)}...")
-
-            compressed_size, restored_size = _stream_lz4_decompress_file(
-                input_path,
-                output_path,
-                chunk_size
-            )
-
-            if restored_size > 0:
-                total_compressed_size += compressed_size
-                total_restored_size += restored_size
-                total_files += 1
+    if copy_stored:
+        total_files_stored = entropy_check.copy_stored_files(input_dir, output_dir, TEXT_EXTENSIONS)
+        if total_files_stored:
+            print(f"  Copied {total_files_stored} stored (uncompressed) files.")
 
     end_time = time.time()
     duration = end_time - start_time
 
-    if total_files == 0:
+    if total_files == 0 and not totals['failed']:
         print(f"No {COMPRESSED_EXTENSION} files found to decompress.")
         return
 
@@ -203,6 +393,8 @@ def decompress_folder_streaming(input_dir, output_dir, chunk_size=65536):
     print(f"Input Total Size (Compressed): {total_compressed_size:,} bytes")
     print(f"Output Total Size (Restored): {total_restored_size:,} bytes ({total_size_mb:.2f} MB)")
     print(f"Average Decompression Speed: **{speed_mbps:.2f} MB/s**")
+    print("-" * 60)
+    folder_restore.print_verification(totals)
     print("=" * 60 + "\n")
 
 
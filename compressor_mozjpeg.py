@@ -2,8 +2,13 @@
 import mozjpeg_lossless_optimization
 from io import BytesIO
 from PIL import Image
+import functools
 import os
 import time
+import file_manifest
+import metrics
+import run_journal
+import worker_pool
 
 IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.tiff')
 OUTPUT_EXTENSION = ".jpg"
@@ -36,7 +41,7 @@ def _optimize_single_image(input_path, output_path, quality):
         savings = original_size - optimized_size
         savings_percent = (savings / original_size) * 100 if original_size > 0 else 0
 
-        print(
+        metrics.console(
             f"  > Optimized {os.path.basename(input_path)}: {original_size / 1024:.1f}KB -> {optimized_size / 1024:.1f}KB ({savings_percent:.1f}% saved) in {duration:.3f}s")
 
         return original_size, optimized_size, duration
@@ -48,7 +53,8 @@ def _optimize_single_image(input_path, output_path, quality):
         return 0, 0, 0
 
 
-def optimize_folder_batch(input_dir, output_dir, quality=90):
+def optimize_folder_batch(input_dir, output_dir, quality=90, manifest=None, jobs=1):
+    run_journal.start_backend(manifest, "mozjpeg")
     if not os.path.isdir(input_dir):
         print(f"Error: Input directory not found at {input_dir}")
         return
@@ -58,50 +64,71 @@ def optimize_folder_batch(input_dir, output_dir, quality=90):
     total_duration = 0
     total_files_processed = 0
     total_files_skipped = 0
+    total_files_unchanged = 0
 
     start_time = time.time()
 
-    print("-" * 60)
-    print(f"Starting MozJPEG Optimization of Folder: {input_dir}")
-    print(f"Initial JPEG Quality Target: {quality}")
-    print("-" * 60)
-
-    for root, _, files in os.walk(input_dir):
-        relative_dir = os.path.relpath(root, input_dir)
-
-        target_dir = os.path.join(output_dir, relative_dir)
-        os.makedirs(target_dir, exist_ok=True)
-
-        for filename in files:
-            input_path = os.path.join(root, filename)
-
-            _, ext = os.path.splitext(filename)
-            if ext.lower() not in IMAGE_EXTENSIONS:
-                total_files_skipped += 1
-                continue
-
-            base, _ = os.path.splitext(filename)
-            output_filename = base + "_optimized" + OUTPUT_EXTENSION
-            output_path = os.path.join(target_dir, output_filename)
-
-            print(f"  [PROCESS]: {os.path.join(relative_dir, filename)}...")
-
-            original_size, optimized_size, duration = _optimize_single_image(
-                input_path,
-                output_path,
-                quality
-            )
-
-            if original_size > 0:
-                total_original_size += original_size
-                total_optimized_size += optimized_size
-                total_duration += duration
-                total_files_processed += 1
+    if not file_manifest.continues_batch(manifest):
+        print("-" * 60)
+        print(f"Starting MozJPEG Optimization of Folder: {input_dir}")
+        print(f"Initial JPEG Quality Target: {quality}")
+        print("-" * 60)
+
+    manifest = file_manifest.resolve_manifest(input_dir, output_dir, manifest)
+    params = {'quality': quality}
+    tasks = []
+
+    for entry in manifest['entries']:
+        if entry['ext'] not in IMAGE_EXTENSIONS:
+            total_files_skipped += 1
+            continue
+
+        relative_dir = entry['relative_dir']
+        filename = entry['name']
+        target_dir = file_manifest.ensure_output_dir(manifest, output_dir, entry)
+
+        base, _ = os.path.splitext(filename)
+        output_filename = base + "_optimized" + OUTPUT_EXTENSION
+        output_path = os.path.join(target_dir, output_filename)
+
+        if run_journal.is_up_to_date(manifest, entry, "mozjpeg", params, output_path):
+            file_manifest.record_output(manifest, entry, output_path)
+            total_files_unchanged += 1
+            continue
+
+        tasks.append(worker_pool.make_task(
+            entry['size'],
+            (entry, output_path),
+            (entry['path'], output_path, quality),
+            label=f"  [PROCESS]: {os.path.join(relative_dir, filename)}..."
+        ))
+
+    results = worker_pool.run_tasks(functools.partial(run_journal.with_input_checksum, _optimize_single_image), tasks, jobs, stage="mozjpeg")
+
+    for (entry, output_path), ((original_size, optimized_size, duration), sha256) in results:
+        if original_size > 0:
+            file_manifest.record_output(manifest, entry, output_path)
+            run_journal.record_completed(manifest, entry, "mozjpeg", params, output_path, sha256)
+            metrics.record_file("mozjpeg", original_size, optimized_size)
+            total_original_size += original_size
+            total_optimized_size += optimized_size
+            total_duration += duration
+            total_files_processed += 1
+        else:
+            metrics.record_counts("mozjpeg", error=1)
 
     total_files = total_files_processed
     end_time = time.time()
     total_elapsed_time = end_time - start_time
 
+    run_journal.finish_backend(manifest, "mozjpeg")
+    metrics.record_counts("mozjpeg", skipped=total_files_skipped, unchanged=total_files_unchanged)
+    metrics.add_gauge('stage_seconds', total_elapsed_time, stage="mozjpeg")
+
+    if total_files_processed == 0 and total_files_unchanged > 0:
+        print(f"All {total_files_unchanged} eligible files are unchanged since the last run.")
+        return
+
     if total_files == 0:
         print("\nNo eligible image files found to optimize.")
         return
@@ -115,7 +142,7 @@ def optimize_folder_batch(input_dir, output_dir, quality=90):
     print("\n" + "=" * 60)
     print("        FOLDER OPTIMIZATION COMPLETE")
     print("=" * 60)
-    print(f"Total Files Processed: {total_files} | Skipped: {total_files_skipped}")
+    print(f"Total Files Processed: {total_files} | Skipped: {total_files_skipped} | Unchanged: {total_files_unchanged}")
     print(f"Total Time Taken: {total_elapsed_time:.4f} seconds")
     print("-" * 60)
     print(f"Original Total Size: {total_original_size / 1024 / 1024:.2f} MB")
@@ -2,8 +2,13 @@
 import oxipng
 from PIL import Image
 import numpy as np
+import functools
 import os
 import time
+import file_manifest
+import metrics
+import run_journal
+import worker_pool
 
 
 def _process_image_for_oxipng(input_path, output_path, level=6):
@@ -15,7 +20,7 @@ def _process_image_for_oxipng(input_path, output_path, level=6):
             filename = os.path.basename(input_path)
 
             if filename.lower().endswith(('.jpg', '.jpeg', '.bmp', '.webp')):
-                print(f"  > Converting {filename} to PNG format before optimization...")
+                metrics.console(f"  > Converting {filename} to PNG format before optimization...")
 
             prepared_image = image.convert("RGBA")
 
@@ -38,9 +43,9 @@ def _process_image_for_oxipng(input_path, output_path, level=6):
         savings = original_size - optimized_size
         savings_percent = (savings / original_size) * 100 if original_size > 0 else 0
 
-        print(
+        metrics.console(
             f"  > Final Size: {original_size / 1024:.1f}KB (Original) -> {optimized_size / 1024:.1f}KB (Optimized PNG)")
-        print(f"  > Savings: {savings_percent:.1f}% in {duration:.3f}s")
+        metrics.console(f"  > Savings: {savings_percent:.1f}% in {duration:.3f}s")
 
         return original_size, optimized_size, duration
 
@@ -51,7 +56,8 @@ def _process_image_for_oxipng(input_path, output_path, level=6):
         return 0, 0, 0
 
 
-def optimize_folder_with_oxipng(input_dir, output_dir, level=6, png_only=False):
+def optimize_folder_with_oxipng(input_dir, output_dir, level=6, png_only=False, manifest=None, jobs=1):
+    run_journal.start_backend(manifest, "oxipng")
     if not os.path.isdir(input_dir):
         print(f"Error: Input directory not found at {input_dir}")
         return
@@ -61,6 +67,7 @@ def optimize_folder_with_oxipng(input_dir, output_dir, level=6, png_only=False):
     total_duration = 0
     total_files_processed = 0
     total_files_skipped = 0
+    total_files_unchanged = 0
 
     start_time = time.time()
 
@@ -69,46 +76,67 @@ def optimize_folder_with_oxipng(input_dir, output_dir, level=6, png_only=False):
     else:
         ELIGIBLE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.webp')
 
-    print("-" * 70)
-    print(f"Starting OxiPNG Folder Optimization (Level: {level})")
-    print(f"Mode: {'PNG Files Only' if png_only else 'All Supported Images (Converting to PNG)'}")
-    print("-" * 70)
-
-    for root, _, files in os.walk(input_dir):
-        relative_dir = os.path.relpath(root, input_dir)
-
-        target_dir = os.path.join(output_dir, relative_dir)
-        os.makedirs(target_dir, exist_ok=True)
-
-        for filename in files:
-            input_path = os.path.join(root, filename)
-
-            _, ext = os.path.splitext(filename)
-            if ext.lower() not in ELIGIBLE_EXTENSIONS:
-                total_files_skipped += 1
-                continue
+    if not file_manifest.continues_batch(manifest):
+        print("-" * 70)
+        print(f"Starting OxiPNG Folder Optimization (Level: {level})")
+        print(f"Mode: {'PNG Files Only' if png_only else 'All Supported Images (Converting to PNG)'}")
+        print("-" * 70)
+
+    manifest = file_manifest.resolve_manifest(input_dir, output_dir, manifest)
+    params = {'level': level}
+    tasks = []
+
+    for entry in manifest['entries']:
+        if entry['ext'] not in ELIGIBLE_EXTENSIONS:
+            total_files_skipped += 1
+            continue
+
+        relative_dir = entry['relative_dir']
+        filename = entry['name']
+        target_dir = file_manifest.ensure_output_dir(manifest, output_dir, entry)
+
+        base, _ = os.path.splitext(filename)
+        output_filename = base + "_optimized.png"
+        output_path = os.path.join(target_dir, output_filename)  # Use target_dir
+
+        if run_journal.is_up_to_date(manifest, entry, "oxipng", params, output_path):
+            file_manifest.record_output(manifest, entry, output_path)
+            total_files_unchanged += 1
+            continue
+
+        tasks.append(worker_pool.make_task(
+            entry['size'],
+            (entry, output_path),
+            (entry['path'], output_path, level),
+            label=f"\n--- Processing {os.path.join(relative_dir, filename)} ---"
+        ))
+
+    results = worker_pool.run_tasks(functools.partial(run_journal.with_input_checksum, _process_image_for_oxipng), tasks, jobs, stage="oxipng")
+
+    for (entry, output_path), ((original_size, optimized_size, duration), sha256) in results:
+        if original_size > 0 and optimized_size > 0:
+            file_manifest.record_output(manifest, entry, output_path)
+            run_journal.record_completed(manifest, entry, "oxipng", params, output_path, sha256)
+            metrics.record_file("oxipng", original_size, optimized_size)
+            total_original_size += original_size
+            total_optimized_size += optimized_size
+            total_duration += duration
+            total_files_processed += 1
+        else:
+            metrics.record_counts("oxipng", error=1)
 
-            print(f"\n--- Processing {os.path.join(relative_dir, filename)} ---")
-
-            base, _ = os.path.splitext(filename)
-            output_filename = base + "_optimized.png"
-            output_path = os.path.join(target_dir, output_filename)  # Use target_dir
-
-            original_size, optimized_size, duration = _process_image_for_oxipng(
-                input_path,
-                output_path,
-                level
-            )
+    total_elapsed_time = time.time() - start_time
 
-            if original_size > 0 and optimized_size > 0:
-                total_original_size += original_size
-                total_optimized_size += optimized_size
-                total_duration += duration
-                total_files_processed += 1
+    run_journal.finish_backend(manifest, "oxipng")
+    metrics.record_counts("oxipng", skipped=total_files_skipped, unchanged=total_files_unchanged)
+    metrics.add_gauge('stage_seconds', total_elapsed_time, stage="oxipng")
 
-    total_elapsed_time = time.time() - start_time
     total_files = total_files_processed
 
+    if total_files_processed == 0 and total_files_unchanged > 0:
+        print(f"All {total_files_unchanged} eligible files are unchanged since the last run.")
+        return
+
     if total_files == 0:
         print("\nNo eligible image files were found or successfully processed.")
         return
@@ -122,7 +150,7 @@ def optimize_folder_with_oxipng(input_dir, output_dir, level=6, png_only=False):
     print("\n" + "=" * 70)
     print("        FOLDER OPTIMIZATION COMPLETE")
     print("=" * 70)
-    print(f"Files Processed: {total_files} | Files Skipped: {total_files_skipped}")
+    print(f"Files Processed: {total_files} | Files Skipped: {total_files_skipped} | Unchanged: {total_files_unchanged}")
     print(f"Total Time Taken: {total_elapsed_time:.4f} seconds")
     print("-" * 70)
     print(f"Original Total Size (Source Files): {total_original_size / 1024 / 1024:.2f} MB")
@@ -1,8 +1,13 @@
 # Requires 'pip install pydub' and having 'ffmpeg' installed and in your system PATH.
 from pydub import AudioSegment
 from pydub.utils import which
+import functools
 import os
 import time
+import file_manifest
+import metrics
+import run_journal
+import worker_pool
 
 
 def _compress_single_file_flac(input_path, output_path, compression_level):
@@ -30,11 +35,11 @@ def _compress_single_file_flac(input_path, output_path, compression_level):
 
         savings_percent = (1 - (compressed_size / original_size)) * 100 if original_size > 0 else 0
 
-        print(f"  > Track Duration: {track_duration_s:.2f} seconds")
-        print(f"  > Original Size: {original_size / (1024 * 1024):.2f} MB")
-        print(f"  > FLAC Size:     {compressed_size / (1024 * 1024):.2f} MB")
-        print(f"  > Savings:       **{savings_percent:.1f}%**")
-        print(f"  > Time Taken:    {processing_time:.3f} seconds")
+        metrics.console(f"  > Track Duration: {track_duration_s:.2f} seconds")
+        metrics.console(f"  > Original Size: {original_size / (1024 * 1024):.2f} MB")
+        metrics.console(f"  > FLAC Size:     {compressed_size / (1024 * 1024):.2f} MB")
+        metrics.console(f"  > Savings:       **{savings_percent:.1f}%**")
+        metrics.console(f"  > Time Taken:    {processing_time:.3f} seconds")
 
         return original_size, compressed_size, track_duration_s
 
@@ -45,8 +50,9 @@ def _compress_single_file_flac(input_path, output_path, compression_level):
         return 0, 0, 0
 
 
-def compress_folder_to_flac(input_dir, output_dir, compression_level=5):
+def compress_folder_to_flac(input_dir, output_dir, compression_level=5, manifest=None, jobs=1):
 
+    run_journal.start_backend(manifest, "flac")
     AudioSegment.converter = which("ffmpeg")
     if AudioSegment.converter is None:
         print("\nFATAL ERROR: FFmpeg not found.")
@@ -62,51 +68,72 @@ def compress_folder_to_flac(input_dir, output_dir, compression_level=5):
     total_track_duration = 0
     total_files_processed = 0
     total_files_skipped = 0
+    total_files_unchanged = 0
 
     start_time_batch = time.time()
 
     ELIGIBLE_EXTENSIONS = ('.wav', '.flac', '.ogg', '.aiff', '.mp3', '.m4a', '.wma')
 
-    print("=" * 70)
-    print(f"Starting Audio Batch Compression (Target Format: FLAC Level {compression_level})")
-    print("Output format: FLAC | Preserving directory structure.")
-    print("=" * 70)
-
-    for root, _, files in os.walk(input_dir):
-        relative_dir = os.path.relpath(root, input_dir)
-
-        target_dir = os.path.join(output_dir, relative_dir)
-        os.makedirs(target_dir, exist_ok=True)
-
-        for filename in files:
-            input_path = os.path.join(root, filename)
-
-            _, ext = os.path.splitext(filename)
-            if ext.lower() not in ELIGIBLE_EXTENSIONS:
-                total_files_skipped += 1
-                continue
-
-            print(f"\n--- Processing: {os.path.join(relative_dir, filename)} ---")
-
-            base, _ = os.path.splitext(filename)
-            output_filename = base + ".flac"
-            output_path = os.path.join(target_dir, output_filename)
-
-            original_size, compressed_size, track_duration_s = _compress_single_file_flac(
-                input_path,
-                output_path,
-                compression_level
-            )
+    if not file_manifest.continues_batch(manifest):
+        print("=" * 70)
+        print(f"Starting Audio Batch Compression (Target Format: FLAC Level {compression_level})")
+        print("Output format: FLAC | Preserving directory structure.")
+        print("=" * 70)
 
-            if original_size > 0:
-                total_original_size += original_size
-                total_compressed_size += compressed_size
-                total_track_duration += track_duration_s
-                total_files_processed += 1
+    manifest = file_manifest.resolve_manifest(input_dir, output_dir, manifest)
+    params = {'compression_level': compression_level}
+    tasks = []
+
+    for entry in manifest['entries']:
+        if entry['ext'] not in ELIGIBLE_EXTENSIONS:
+            total_files_skipped += 1
+            continue
+
+        relative_dir = entry['relative_dir']
+        filename = entry['name']
+        target_dir = file_manifest.ensure_output_dir(manifest, output_dir, entry)
+
+        base, _ = os.path.splitext(filename)
+        output_filename = base + ".flac"
+        output_path = os.path.join(target_dir, output_filename)
+
+        if run_journal.is_up_to_date(manifest, entry, "flac", params, output_path):
+            file_manifest.record_output(manifest, entry, output_path)
+            total_files_unchanged += 1
+            continue
+
+        tasks.append(worker_pool.make_task(
+            entry['size'],
+            (entry, output_path),
+            (entry['path'], output_path, compression_level),
+            label=f"\n--- Processing: {os.path.join(relative_dir, filename)} ---"
+        ))
+
+    results = worker_pool.run_tasks(functools.partial(run_journal.with_input_checksum, _compress_single_file_flac), tasks, jobs, stage="flac")
+
+    for (entry, output_path), ((original_size, compressed_size, track_duration_s), sha256) in results:
+        if original_size > 0:
+            file_manifest.record_output(manifest, entry, output_path)
+            run_journal.record_completed(manifest, entry, "flac", params, output_path, sha256)
+            metrics.record_file("flac", original_size, compressed_size)
+            total_original_size += original_size
+            total_compressed_size += compressed_size
+            total_track_duration += track_duration_s
+            total_files_processed += 1
+        else:
+            metrics.record_counts("flac", error=1)
 
     total_elapsed_time = time.time() - start_time_batch
 
+    run_journal.finish_backend(manifest, "flac")
+    metrics.record_counts("flac", skipped=total_files_skipped, unchanged=total_files_unchanged)
+    metrics.add_gauge('stage_seconds', total_elapsed_time, stage="flac")
+
     print("\n" + "=" * 70)
+    if total_files_processed == 0 and total_files_unchanged > 0:
+        print(f"All {total_files_unchanged} eligible files are unchanged since the last run.")
+        return
+
     if total_files_processed == 0:
         print("        BATCH COMPRESSION FAILED OR NO FILES PROCESSED")
         print("=" * 70)
@@ -117,7 +144,7 @@ def compress_folder_to_flac(input_dir, output_dir, compression_level=5):
 
     print("        BATCH COMPRESSION COMPLETE")
     print("=" * 70)
-    print(f"Total Files Processed: {total_files_processed} | Skipped: {total_files_skipped}")
+    print(f"Total Files Processed: {total_files_processed} | Skipped: {total_files_skipped} | Unchanged: {total_files_unchanged}")
     print(f"Total Time Taken: {total_elapsed_time:.4f} seconds")
     print(f"Total Track Duration: {total_track_duration:.2f} seconds")
     print("-" * 70)
@@ -1,8 +1,13 @@
 # Requires 'pip install pydub' and having 'ffmpeg' installed and in your system PATH.
 from pydub import AudioSegment
 from pydub.utils import which
+import functools
 import os
 import time
+import file_manifest
+import metrics
+import run_journal
+import worker_pool
 
 
 def _compress_single_file(input_path, output_path, bitrate):
@@ -24,9 +29,9 @@ def _compress_single_file(input_path, output_path, bitrate):
 
         savings_percent = (1 - (compressed_size / original_size)) * 100 if original_size > 0 else 0
 
-        print(f"  > Original: {original_size / (1024 * 1024):.2f} MB")
-        print(f"  > MP3 Size: {compressed_size / (1024 * 1024):.2f} MB")
-        print(f"  > Savings:  **{savings_percent:.1f}%** in {duration:.3f}s")
+        metrics.console(f"  > Original: {original_size / (1024 * 1024):.2f} MB")
+        metrics.console(f"  > MP3 Size: {compressed_size / (1024 * 1024):.2f} MB")
+        metrics.console(f"  > Savings:  **{savings_percent:.1f}%** in {duration:.3f}s")
 
         return original_size, compressed_size, duration
 
@@ -37,7 +42,8 @@ def _compress_single_file(input_path, output_path, bitrate):
         return 0, 0, 0
 
 
-def compress_folder_to_mp3(input_dir, output_dir, bitrate="192k"):
+def compress_folder_to_mp3(input_dir, output_dir, bitrate="192k", manifest=None, jobs=1):
+    run_journal.start_backend(manifest, "mp3")
     AudioSegment.converter = which("ffmpeg")
     if AudioSegment.converter is None:
         print("\nFATAL ERROR: FFmpeg not found.")
@@ -53,52 +59,73 @@ def compress_folder_to_mp3(input_dir, output_dir, bitrate="192k"):
     total_duration = 0
     total_files_processed = 0
     total_files_skipped = 0
+    total_files_unchanged = 0
 
     start_time = time.time()
 
     # Supported input formats for pydub
     ELIGIBLE_EXTENSIONS = ('.wav', '.flac', '.ogg', '.aiff', '.mp3', '.m4a', '.wma')
 
-    print("=" * 70)
-    print(f"Starting Audio Batch Compression (Target Bitrate: {bitrate})")
-    print("Output format: MP3 | Preserving directory structure.")
-    print("=" * 70)
-
-    for root, _, files in os.walk(input_dir):
-        relative_dir = os.path.relpath(root, input_dir)
-
-        target_dir = os.path.join(output_dir, relative_dir)
-        os.makedirs(target_dir, exist_ok=True)
-
-        for filename in files:
-            input_path = os.path.join(root, filename)
-
-            _, ext = os.path.splitext(filename)
-            if ext.lower() not in ELIGIBLE_EXTENSIONS:
-                total_files_skipped += 1
-                continue
-
-            print(f"\n--- Processing: {os.path.join(relative_dir, filename)} ---")
-
-            base, _ = os.path.splitext(filename)
-            output_filename = base + ".mp3"
-            output_path = os.path.join(target_dir, output_filename)  # Use target_dir to preserve structure
-
-            original_size, compressed_size, duration = _compress_single_file(
-                input_path,
-                output_path,
-                bitrate
-            )
+    if not file_manifest.continues_batch(manifest):
+        print("=" * 70)
+        print(f"Starting Audio Batch Compression (Target Bitrate: {bitrate})")
+        print("Output format: MP3 | Preserving directory structure.")
+        print("=" * 70)
 
-            if original_size > 0:
-                total_original_size += original_size
-                total_compressed_size += compressed_size
-                total_duration += duration
-                total_files_processed += 1
+    manifest = file_manifest.resolve_manifest(input_dir, output_dir, manifest)
+    params = {'bitrate': bitrate}
+    tasks = []
+
+    for entry in manifest['entries']:
+        if entry['ext'] not in ELIGIBLE_EXTENSIONS:
+            total_files_skipped += 1
+            continue
+
+        relative_dir = entry['relative_dir']
+        filename = entry['name']
+        target_dir = file_manifest.ensure_output_dir(manifest, output_dir, entry)
+
+        base, _ = os.path.splitext(filename)
+        output_filename = base + ".mp3"
+        output_path = os.path.join(target_dir, output_filename)  # Use target_dir to preserve structure
+
+        if run_journal.is_up_to_date(manifest, entry, "mp3", params, output_path):
+            file_manifest.record_output(manifest, entry, output_path)
+            total_files_unchanged += 1
+            continue
+
+        tasks.append(worker_pool.make_task(
+            entry['size'],
+            (entry, output_path),
+            (entry['path'], output_path, bitrate),
+            label=f"\n--- Processing: {os.path.join(relative_dir, filename)} ---"
+        ))
+
+    results = worker_pool.run_tasks(functools.partial(run_journal.with_input_checksum, _compress_single_file), tasks, jobs, stage="mp3")
+
+    for (entry, output_path), ((original_size, compressed_size, duration), sha256) in results:
+        if original_size > 0:
+            file_manifest.record_output(manifest, entry, output_path)
+            run_journal.record_completed(manifest, entry, "mp3", params, output_path, sha256)
+            metrics.record_file("mp3", original_size, compressed_size)
+            total_original_size += original_size
+            total_compressed_size += compressed_size
+            total_duration += duration
+            total_files_processed += 1
+        else:
+            metrics.record_counts("mp3", error=1)
 
     total_elapsed_time = time.time() - start_time
 
+    run_journal.finish_backend(manifest, "mp3")
+    metrics.record_counts("mp3", skipped=total_files_skipped, unchanged=total_files_unchanged)
+    metrics.add_gauge('stage_seconds', total_elapsed_time, stage="mp3")
+
     print("\n" + "=" * 70)
+    if total_files_processed == 0 and total_files_unchanged > 0:
+        print(f"All {total_files_unchanged} eligible files are unchanged since the last run.")
+        return
+
     if total_files_processed == 0:
         print("        BATCH COMPRESSION FAILED OR NO FILES PROCESSED")
         print("=" * 70)
@@ -109,7 +136,7 @@ def compress_folder_to_mp3(input_dir, output_dir, bitrate="192k"):
 
     print("        BATCH COMPRESSION COMPLETE")
     print("=" * 70)
-    print(f"Total Files Processed: {total_files_processed} | Skipped: {total_files_skipped}")
+    print(f"Total Files Processed: {total_files_processed} | Skipped: {total_files_skipped} | Unchanged: {total_files_unchanged}")
     print(f"Total Time Taken: {total_elapsed_time:.4f} seconds")
     print("-" * 70)
     print(f"Original Total Size: {total_original_size / (1024 * 1024):.2f} MB")
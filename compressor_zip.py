@@ -1,7 +1,218 @@
 import zipfile
+import contextlib
 import os
 import time
 import shutil
+import struct
+import threading
+import types
+import zlib
+import file_manifest
+import worker_pool
+
+# Outputs of the stages (and common containers) that deflate cannot shrink any further.
+STORED_EXTENSIONS = (
+    '.lz4', '.zlib', '.bz2', '.gz', '.xz', '.zst', '.zip', '.7z',
+    '.jpg', '.jpeg', '.png', '.webp', '.mp3', '.flac', '.ogg', '.m4a',
+    '.mp4', '.mkv', '.webm', '.mov'
+)
+TRIAL_SIZE = 64 * 1024
+COPY_CHUNK_SIZE = 1024 * 1024
+MIN_DEFLATE_GAIN = 0.02  # Members whose trial shrinks by less than this are stored
+INLINE_MEMBER_SIZE = 4 * 1024 * 1024  # Deflated members up to this size come back from the workers in memory, larger ones in a spool file
+ZIP64_LIMIT = 0xFFFFFFFF  # Sizes and offsets from this up go in the Zip64 extra field (the 32-bit field holds 0xFFFFFFFF)
+ZIP64_COUNT_LIMIT = 0xFFFF  # Member counts from this up go in the Zip64 end of central directory record
+
+
+def _new_method_stats() -> dict:
+    return {'stored_files': 0, 'stored_bytes': 0, 'deflated_files': 0, 'saved_seconds': 0.0, 'trial_seconds': 0.0}
+
+
+def _choose_compress_type(file_path: str, file_size: int, stats: dict) -> int:
+    """ZIP_STORED for known-compressed formats or when deflating a leading sample gains nothing.
+
+    The sample's deflate speed also gives the estimate of time saved on stored members.
+    """
+    with open(file_path, 'rb') as f:
+        sample = f.read(TRIAL_SIZE)
+
+    start_time = time.perf_counter()
+    compressed_size = len(zlib.compress(sample))
+    trial_duration = time.perf_counter() - start_time
+    stats['trial_seconds'] += trial_duration
+
+    known_compressed = os.path.splitext(file_path)[1].lower() in STORED_EXTENSIONS
+    no_gain = not sample or compressed_size > len(sample) * (1 - MIN_DEFLATE_GAIN)
+
+    if known_compressed or no_gain:
+        stats['stored_files'] += 1
+        stats['stored_bytes'] += file_size
+        if sample:
+            stats['saved_seconds'] += trial_duration * file_size / len(sample)
+        return zipfile.ZIP_STORED
+
+    stats['deflated_files'] += 1
+    return zipfile.ZIP_DEFLATED
+
+
+def _merge_method_stats(total: dict, stats: dict):
+    for key, value in stats.items():
+        total[key] += value
+
+
+def _pick_member_method(file_path: str) -> dict:
+    """Run the method trial for one member into its own stats, so the caller can merge them under its lock."""
+    stats = _new_method_stats()
+    compress_type = _choose_compress_type(file_path, os.path.getsize(file_path), stats)
+    return {'compress_type': compress_type, 'stats': stats}
+
+
+def _write_member(zipf: zipfile.ZipFile, file_path: str, archive_name: str, compress_type: int):
+    """Stream file_path into the archive in one pass; zipfile fills in the CRC, sizes and Zip64 records."""
+    zinfo = zipfile.ZipInfo.from_file(file_path, archive_name)
+    zinfo.compress_type = compress_type
+    with open(file_path, 'rb') as f_in, zipf.open(zinfo, 'w') as f_out:
+        shutil.copyfileobj(f_in, f_out, COPY_CHUNK_SIZE)
+
+
+def _deflate_member(file_path: str, spool_path: str) -> dict:
+    """Pick the method for one member and prepare its data in a worker process: raw deflate, CRC-32 and sizes.
+
+    Deflated data comes back in memory, or in spool_path above INLINE_MEMBER_SIZE;
+    stored members are only checksummed here and copied from file_path when written.
+    """
+    stats = _new_method_stats()
+    file_size = os.path.getsize(file_path)
+    compress_type = _choose_compress_type(file_path, file_size, stats)
+    member = {'compress_type': compress_type, 'stats': stats, 'crc': 0, 'file_size': 0, 'compress_size': 0,
+              'data': None, 'spool_path': None}
+
+    compressor = None
+    chunks = []
+    spool = None
+    if compress_type == zipfile.ZIP_DEFLATED:
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+        if file_size > INLINE_MEMBER_SIZE:
+            spool = open(spool_path, 'wb')
+            member['spool_path'] = spool_path
+
+    try:
+        with open(file_path, 'rb') as f_in:
+            while True:
+                chunk = f_in.read(COPY_CHUNK_SIZE)
+                if not chunk:
+                    break
+                member['crc'] = zlib.crc32(chunk, member['crc'])
+                member['file_size'] += len(chunk)
+                if compressor:
+                    chunks.append(compressor.compress(chunk))
+                    if spool:
+                        spool.write(b''.join(chunks))
+                        chunks = []
+        if compressor:
+            chunks.append(compressor.flush())
+            if spool:
+                spool.write(b''.join(chunks))
+                chunks = []
+    finally:
+        if spool:
+            spool.close()
+
+    if compressor is None:
+        member['compress_size'] = member['file_size']
+    elif spool:
+        member['compress_size'] = os.path.getsize(spool_path)
+    else:
+        member['data'] = b''.join(chunks)
+        member['compress_size'] = len(member['data'])
+    return member
+
+
+def _append_member(f_out, file_path: str, archive_name: str, member: dict) -> dict:
+    """Write the local header and data of a member _deflate_member prepared; returns what its central directory entry needs.
+
+    The CRC and sizes are known up front, so the local header carries them and no data descriptor follows.
+    """
+    zinfo = zipfile.ZipInfo.from_file(file_path, archive_name)
+    try:
+        name = zinfo.filename.encode('ascii')
+        flags = 0
+    except UnicodeEncodeError:
+        name = zinfo.filename.encode('utf-8')
+        flags = 0x800
+
+    year, month, day, hour, minute, second = zinfo.date_time
+    entry = {
+        'name': name,
+        'flags': flags,
+        'compress_type': member['compress_type'],
+        'dos_time': hour << 11 | minute << 5 | second // 2,
+        'dos_date': (year - 1980) << 9 | month << 5 | day,
+        'crc': member['crc'],
+        'file_size': member['file_size'],
+        'compress_size': member['compress_size'],
+        'offset': f_out.tell(),
+        'create_system': zinfo.create_system,
+        'external_attr': zinfo.external_attr,
+    }
+
+    extra = b''
+    file_size, compress_size = entry['file_size'], entry['compress_size']
+    if file_size >= ZIP64_LIMIT or compress_size >= ZIP64_LIMIT:
+        extra = struct.pack('<HHQQ', 1, 16, file_size, compress_size)
+        file_size = compress_size = 0xFFFFFFFF
+    f_out.write(struct.pack('<IHHHHHIIIHH', 0x04034b50, 45 if extra else 20, flags, entry['compress_type'],
+                            entry['dos_time'], entry['dos_date'], entry['crc'], compress_size, file_size,
+                            len(name), len(extra)))
+    f_out.write(name + extra)
+
+    if member['data'] is not None:
+        f_out.write(member['data'])
+    else:
+        with open(member['spool_path'] or file_path, 'rb') as f_in:
+            shutil.copyfileobj(f_in, f_out, COPY_CHUNK_SIZE)
+        if member['spool_path']:
+            os.remove(member['spool_path'])
+    return entry
+
+
+def _write_central_directory(f_out, entries: list):
+    """Central directory and end records for entries, with the Zip64 ones wherever a field overflows."""
+    start = f_out.tell()
+    for entry in entries:
+        extra_values = []
+        fields = []
+        for key in ('file_size', 'compress_size', 'offset'):
+            if entry[key] >= ZIP64_LIMIT:
+                extra_values.append(entry[key])
+                fields.append(0xFFFFFFFF)
+            else:
+                fields.append(entry[key])
+        extra = struct.pack(f'<HH{len(extra_values)}Q', 1, 8 * len(extra_values), *extra_values) if extra_values else b''
+        version = 45 if extra else 20
+        file_size, compress_size, offset = fields
+        f_out.write(struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50, entry['create_system'] << 8 | version, version,
+                                entry['flags'], entry['compress_type'], entry['dos_time'], entry['dos_date'],
+                                entry['crc'], compress_size, file_size, len(entry['name']), len(extra), 0, 0, 0,
+                                entry['external_attr'], offset))
+        f_out.write(entry['name'] + extra)
+
+    end = f_out.tell()
+    count, size = len(entries), end - start
+    if count >= ZIP64_COUNT_LIMIT or size >= ZIP64_LIMIT or start >= ZIP64_LIMIT:
+        f_out.write(struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, 45, 45, 0, 0, count, count, size, start))
+        f_out.write(struct.pack('<IIQI', 0x07064b50, 0, end, 1))
+        count = 0xFFFF if count >= ZIP64_COUNT_LIMIT else count
+        size = 0xFFFFFFFF if size >= ZIP64_LIMIT else size
+        start = 0xFFFFFFFF if start >= ZIP64_LIMIT else start
+    f_out.write(struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, count, count, size, start, 0))
+
+
+def _print_method_report(stats: dict):
+    print(f"Members Stored: {stats['stored_files']} ({stats['stored_bytes'] / (1024 * 1024):.2f} MB) | "
+          f"Members Deflated: {stats['deflated_files']}")
+    print(f"Deflate Time Saved (est.): {stats['saved_seconds']:.2f} seconds "
+          f"(trial overhead: {stats['trial_seconds']:.2f} seconds)")
 
 
 def _get_dir_size(start_path: str) -> int:
@@ -39,12 +250,15 @@ def _get_size_and_type(path: str) -> tuple[int, str]:
     return 0, "Other"
 
 
-def compare_file_system_sizes(path1: str, path2: str):
+def compare_file_system_sizes(path1: str, path2: str, manifest: dict = None):
     print("=" * 60)
     print(f"Comparing Sizes:\n1. '{path1}'\n2. '{path2}'")
     print("=" * 60)
 
-    size1_bytes, type1 = _get_size_and_type(path1)
+    if manifest is not None and os.path.normpath(path1) == os.path.normpath(manifest['input_dir']):
+        size1_bytes, type1 = file_manifest.total_input_size(manifest), "Folder"
+    else:
+        size1_bytes, type1 = _get_size_and_type(path1)
     size1_mb = size1_bytes / (1024 * 1024)
 
     size2_bytes, type2 = _get_size_and_type(path2)
@@ -87,30 +301,62 @@ def delete_directory_contents(target_dir: str):
             print(f"\nERROR: Could not delete directory '{target_dir}'. Details: {e}")
 
 
-def compress_directory_to_zip(source_dir: str, output_zip_path: str):
+def compress_directory_to_zip(source_dir: str, output_zip_path: str, delete_source: bool = True, exclude: tuple = (),
+                              jobs=1):
+    """Zip source_dir, picking the method and deflating each member on `jobs` worker processes.
+
+    The headers and central directory are written here around the prepared data
+    (ZipFile can only deflate members itself). Members are written in sorted path
+    order whatever order the workers finish in, so the same folder always gives
+    the same archive.
+    """
     if not os.path.isdir(source_dir):
         print(f"Error: Source directory not found at '{source_dir}'")
         return
 
     start_time = time.time()
     total_files = 0
+    method_stats = _new_method_stats()
     compression_successful = False
+    jobs = worker_pool.resolve_jobs(jobs)
 
-    print(f"Starting compression of '{source_dir}' to '{output_zip_path}'...")
+    print(f"Starting compression of '{source_dir}' to '{output_zip_path}' (jobs: {jobs})...")
 
-    try:
-        with zipfile.ZipFile(output_zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            source_parent = os.path.abspath(os.path.join(source_dir, os.pardir))
-
-            for root, dirs, files in os.walk(source_dir):
-                archive_base = os.path.relpath(root, source_parent)
+    source_parent = os.path.abspath(os.path.join(source_dir, os.pardir))
+    members = []
+    for root, dirs, files in os.walk(source_dir):
+        dirs.sort()
+        archive_base = os.path.relpath(root, source_parent)
 
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    archive_name = os.path.join(archive_base, file)
+        for file in sorted(files):
+            if file in exclude:
+                continue
+            members.append((os.path.join(root, file), os.path.join(archive_base, file)))
 
-                    zipf.write(file_path, archive_name)
+    spool_paths = [f"{output_zip_path}.{index}.part" for index in range(len(members))]
+    try:
+        with open(output_zip_path, 'wb') as f_out:
+            tasks = [
+                worker_pool.make_task(os.path.getsize(file_path), index, (file_path, spool_paths[index]))
+                for index, (file_path, _) in enumerate(members)
+            ]
+            entries = []
+            finished = {}
+            next_index = 0
+
+            for index, member in worker_pool.run_tasks(_deflate_member, tasks, jobs, stage="zip"):
+                finished[index] = member
+                while next_index in finished:
+                    member = finished.pop(next_index)
+                    file_path, archive_name = members[next_index]
+                    entries.append(_append_member(f_out, file_path, archive_name, member))
+                    _merge_method_stats(method_stats, member['stats'])
                     total_files += 1
+                    next_index += 1
+
+            if total_files != len(members):
+                raise RuntimeError(f"only {total_files} of {len(members)} members could be compressed")
+            _write_central_directory(f_out, entries)
 
         end_time = time.time()
         duration = end_time - start_time
@@ -125,16 +371,153 @@ def compress_directory_to_zip(source_dir: str, output_zip_path: str):
         print(f"Files Compressed: {total_files}")
         print(f"Output Size: {zip_size_kb:.2f} KB")
         print(f"Time Taken: {duration:.2f} seconds")
+        _print_method_report(method_stats)
 
     except Exception as e:
         print(f"An unexpected error occurred during zipping: {e}")
         print("Source directory retained.")
         return
+    finally:
+        for spool_path in spool_paths:
+            if os.path.exists(spool_path):
+                os.remove(spool_path)
 
-    if compression_successful:
+    if compression_successful and delete_source:
         print("\n--- Attempting Source Deletion ---")
         delete_directory_contents(source_dir)
 
+
+def open_archive_sink(output_zip_path: str, source_dir: str) -> dict:
+    """Open output_zip_path for archive_output, which moves finished outputs from source_dir into it.
+
+    Outputs written in worker processes are spooled: written to source_dir by
+    their stage and read back once, so the folder never holds more than the
+    outputs in flight. Those written in this process can skip the spool through
+    stream_output. Members get the same names compress_directory_to_zip would
+    give them.
+    """
+    print(f"Moving outputs into '{output_zip_path}' as they are written (spool folder: '{source_dir}')...")
+    return {
+        'zip': zipfile.ZipFile(output_zip_path, 'w', zipfile.ZIP_DEFLATED, allowZip64=True),
+        'path': output_zip_path,
+        'source_dir': source_dir,
+        'source_parent': os.path.abspath(os.path.join(source_dir, os.pardir)),
+        'lock': threading.Lock(),
+        'files': 0,
+        'streamed': set(),
+        'streamed_files': 0,
+        'failed': 0,
+        'method_stats': _new_method_stats(),
+        'start_time': time.time(),
+    }
+
+
+def stream_output(sink: dict, output_path: str):
+    """Context manager writing output_path straight into the archive, or None when it has to be spooled.
+
+    Only outputs in a compressed format are streamed (they are stored, so no
+    method trial is needed), and only while no other member is being written:
+    the archive takes one member at a time, and a producer should not wait for
+    another one's whole compression. archive_output skips them once recorded.
+    """
+    if os.path.splitext(output_path)[1].lower() not in STORED_EXTENSIONS:
+        return None
+    if not sink['lock'].acquire(blocking=False):
+        return None
+    return _streamed_member(sink, output_path)
+
+
+@contextlib.contextmanager
+def _streamed_member(sink: dict, output_path: str):
+    zipf = sink['zip']
+    zinfo = zipfile.ZipInfo(os.path.relpath(os.path.abspath(output_path), sink['source_parent']), time.localtime()[:6])
+    zinfo.compress_type = zipfile.ZIP_STORED
+    zinfo.external_attr = 0o644 << 16
+    try:
+        # The size is not known up front, so the member always gets its Zip64 fields.
+        f_member = zipf.open(zinfo, 'w', force_zip64=True)
+        try:
+            written = [0]
+
+            def write(data):
+                f_member.write(data)
+                written[0] += len(data)
+
+            yield types.SimpleNamespace(write=write, tell=lambda: written[0])
+        except BaseException:
+            f_member.close()
+            _drop_last_member(zipf, zinfo)
+            raise
+        f_member.close()
+        sink['streamed'].add(os.path.abspath(output_path))
+        sink['files'] += 1
+        sink['streamed_files'] += 1
+        sink['method_stats']['stored_files'] += 1
+        sink['method_stats']['stored_bytes'] += written[0]
+    finally:
+        sink['lock'].release()
+
+
+def _drop_last_member(zipf: zipfile.ZipFile, zinfo: zipfile.ZipInfo):
+    # zipfile cannot delete members, but a failed stream is the last thing in the file, so it is cut off again.
+    if zipf.filelist and zipf.filelist[-1] is zinfo:
+        zipf.filelist.pop()
+        zipf.NameToInfo.pop(zinfo.filename, None)
+    zipf.start_dir = zinfo.header_offset
+    zipf.fp.seek(zinfo.header_offset)
+    zipf.fp.truncate()
+
+
+def archive_output(sink: dict, output_path: str):
+    if os.path.abspath(output_path) in sink['streamed']:
+        sink['streamed'].discard(os.path.abspath(output_path))
+        return
+
+    archive_name = os.path.relpath(os.path.abspath(output_path), sink['source_parent'])
+
+    try:
+        member = _pick_member_method(output_path)
+
+        with sink['lock']:
+            _write_member(sink['zip'], output_path, archive_name, member['compress_type'])
+            _merge_method_stats(sink['method_stats'], member['stats'])
+            sink['files'] += 1
+
+        os.remove(output_path)
+
+    except Exception as e:
+        print(f"Error: Could not add {output_path} to the archive: {e}")
+        with sink['lock']:
+            sink['failed'] += 1
+
+
+def close_archive_sink(sink: dict):
+    try:
+        sink['zip'].close()
+    except Exception as e:
+        print(f"An unexpected error occurred while finishing the archive: {e}")
+        print("Spool directory retained.")
+        return
+
+    duration = time.time() - sink['start_time']
+    zip_size_kb = os.path.getsize(sink['path']) / 1024
+
+    print("\n--- ZIP Compression Report ---")
+    print(f"Compression successful: {sink['path']}")
+    print(f"Source Directory: {sink['source_dir']} (moved in as the stages ran)")
+    print(f"Files Compressed: {sink['files']} ({sink['streamed_files']} streamed in without the spool folder)")
+    print(f"Output Size: {zip_size_kb:.2f} KB")
+    print(f"Time Taken: {duration:.2f} seconds (while the stages ran)")
+    _print_method_report(sink['method_stats'])
+
+    if sink['failed']:
+        print(f"\n{sink['failed']} outputs could not be archived. Spool directory retained: '{sink['source_dir']}'")
+        return
+
+    print("\n--- Removing Spool Directory ---")
+    delete_directory_contents(sink['source_dir'])
+
+
 # --- Test ---
 # SOURCE_FOLDER = "./input/test_files_to_delete"
 # OUTPUT_ZIP_FILE = "my_compressed_archive.zip"
@@ -1,31 +1,202 @@
+import functools
+import glob
+import itertools
 import zlib
 import os
+import struct
 import time
+from concurrent.futures import ThreadPoolExecutor
+import dictionary_trainer
+import entropy_check
+import file_manifest
+import folder_restore
+import host_profile
+import metrics
+import random_access
+import run_journal
+import solid_archive
+import stream_pipeline
+import worker_pool
 
 TEXT_EXTENSIONS = (
     '.txt', '.csv', '.md', '.log', '.json', '.xml', '.py', '.html',
     '.css', '.js', '.ts', '.jsx', '.yaml', '.yml', '.cpp', '.json5', '.toml'
 )
 COMPRESSED_EXTENSION = ".zlib"
+PARALLEL_MIN_SIZE = 64 * 1024 * 1024  # Files at least this large are split into blocks compressed on every core
+BLOCK_SIZE = 1024 * 1024
+DICTIONARY_SIZE = 32 * 1024  # Deflate window; each block is primed with this much of the previous block
+SMALL_FILE_SIZE = 64 * 1024  # Files below this size are compressed with the shared preset dictionary
+DICTIONARY_MIN_FILES = 32  # Fewer small files than this are not worth training a dictionary for
+SMALL_FILE_BATCH = 256  # Small files are handed to the workers this many at a time
+DICTIONARY_PREFIX = "zlib_dictionary_"  # Stored once in the output root as zlib_dictionary_<adler32>.zdict
+DICTIONARY_EXTENSION = ".zdict"
 
 
-def _stream_compress_file(input_path, output_path, compressor, chunk_size=65536):
+def _stream_compress_file(input_path, output_path, compressor, chunk_size=65536, digest=None):
     try:
-        with open(input_path, 'rb') as f_in, open(output_path, 'wb') as f_out:
-            while True:
-                chunk = f_in.read(chunk_size)
+        with open(input_path, 'rb') as f_in, stream_pipeline.open_output(output_path) as f_out:
+            stream_pipeline.pipe_file(f_in, f_out, compressor.compress, compressor.flush, chunk_size, digest)
 
-                if not chunk:
-                    break
+            original_size = f_in.tell()
+            compressed_size = f_out.tell()
 
-                compressed_chunk = compressor.compress(chunk)
-                f_out.write(compressed_chunk)
+        return original_size, compressed_size
+
+    except Exception as e:
+        print(f"Error compressing {input_path}: {e}")
+        return 0, 0
+
+
+def compress_file(input_path, output_path, level=None, chunk_size=None, zdict=None, digest=None):
+    level, chunk_size = host_profile.tuned('zlib', level, chunk_size)
+    if zdict:
+        compressor = zlib.compressobj(level=level, zdict=zdict)
+    else:
+        compressor = zlib.compressobj(level=level)
+    return _stream_compress_file(input_path, output_path, compressor, chunk_size, digest)
+
+
+def _compress_small_files(files, level, chunk_size, store_incompressible, zdict):
+    """Worker task for a batch of small files sharing one preset dictionary."""
+    compress_function = functools.partial(compress_file, zdict=zdict)
+    return [entropy_check.compress_or_store(compress_function, input_path, output_path, stored_path, level,
+                                            chunk_size, store_incompressible)
+            for input_path, output_path, stored_path in files]
 
-            remaining_data = compressor.flush()
-            f_out.write(remaining_data)
 
-        original_size = os.path.getsize(input_path)
-        compressed_size = os.path.getsize(output_path)
+def dictionary_id(zdict: bytes) -> str:
+    # zlib writes the Adler-32 of the preset dictionary into every stream header that uses it.
+    return f"{zlib.adler32(zdict):08x}"
+
+
+def _open_dictionary(output_dir: str, small_paths: list, dictionary_path: str = None):
+    """Reuse dictionary_path or the dictionary already in output_dir (unchanged outputs depend on it), or train and store a new one."""
+    if dictionary_path:
+        with open(dictionary_path, 'rb') as f:
+            return f.read(), dictionary_path, False
+
+    existing = sorted(glob.glob(os.path.join(glob.escape(output_dir), DICTIONARY_PREFIX + "*" + DICTIONARY_EXTENSION)),
+                      key=os.path.getmtime)
+    if existing:
+        with open(existing[-1], 'rb') as f:
+            zdict = f.read()
+        return zdict, existing[-1], False
+
+    if len(small_paths) < DICTIONARY_MIN_FILES:
+        return None, None, False
+
+    start_time = time.time()
+    zdict = dictionary_trainer.train_dictionary(dictionary_trainer.read_samples(sorted(small_paths)), DICTIONARY_SIZE)
+    if not zdict:
+        return None, None, False
+
+    os.makedirs(output_dir, exist_ok=True)
+    dictionary_path = os.path.join(output_dir, DICTIONARY_PREFIX + dictionary_id(zdict) + DICTIONARY_EXTENSION)
+    with open(dictionary_path, 'wb') as f:
+        f.write(zdict)
+    print(f"Trained a {len(zdict):,} byte dictionary from {len(small_paths)} small files "
+          f"in {time.time() - start_time:.2f} seconds ({os.path.basename(dictionary_path)})")
+    return zdict, dictionary_path, True
+
+
+def _load_dictionaries(input_dir: str) -> dict:
+    dictionaries = {}
+    for dictionary_path in glob.glob(os.path.join(glob.escape(input_dir), DICTIONARY_PREFIX + "*" + DICTIONARY_EXTENSION)):
+        with open(dictionary_path, 'rb') as f:
+            zdict = f.read()
+        dictionaries[dictionary_id(zdict)] = zdict
+    return dictionaries
+
+
+def stream_dictionary_id(input_path: str):
+    """Id of the preset dictionary a .zlib file was written with, or None."""
+    with open(input_path, 'rb') as f:
+        header = f.read(6)
+    if len(header) == 6 and header[1] & 0x20:  # FDICT
+        return header[2:6].hex()
+    return None
+
+
+def _decompressor_for(input_path: str, dictionaries: dict):
+    needed = stream_dictionary_id(input_path)
+    if needed is None:
+        return zlib.decompressobj()
+    if needed not in dictionaries:
+        raise ValueError(f"{DICTIONARY_PREFIX}{needed}{DICTIONARY_EXTENSION} is missing")
+    return zlib.decompressobj(zdict=dictionaries[needed])
+
+
+def _zlib_header(level: int) -> bytes:
+    compression_info = 0x78  # Deflate with a 32 KiB window
+    if level == zlib.Z_DEFAULT_COMPRESSION:
+        level = 6
+    flags = (0 if level < 2 else 1 if level < 6 else 2 if level == 6 else 3) << 6
+    flags += (31 - (compression_info * 256 + flags) % 31) % 31
+    return bytes((compression_info, flags))
+
+
+def _compress_block(block: bytes, dictionary: bytes, level: int, last: bool) -> bytes:
+    # Raw deflate (no header); a sync flush ends the block on a byte boundary so the next one can follow it directly.
+    if dictionary:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=dictionary)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(block) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+def compress_file_parallel(input_path, output_path, level=None, chunk_size=None, threads=None, index=False, digest=None):
+    """pigz-style compression: BLOCK_SIZE blocks deflated on `threads` threads and written as one zlib stream.
+
+    Every block is primed with the last 32 KiB of the block before it, so the
+    ratio stays close to a single compressobj, and the output is a plain zlib
+    stream that _stream_decompress_file (or zlib.decompress) reads unchanged.
+    With index, block starts (and their 32 KiB windows) go into a
+    random_access sidecar. chunk_size is unused; it is accepted so this can
+    stand in for compress_file, as is digest (updated with every block read).
+    """
+    level, chunk_size = host_profile.tuned('zlib', level, chunk_size)
+    threads = worker_pool.resolve_jobs(threads)
+    access_index = random_access.new_index('zlib')
+    try:
+        with open(input_path, 'rb') as f_in, stream_pipeline.open_output(output_path) as f_out, \
+                ThreadPoolExecutor(max_workers=threads) as executor:
+            f_out.write(_zlib_header(level))
+            checksum = zlib.adler32(b"")
+            pending = []
+            dictionary = b""
+            offset = 0
+            lines = 0
+            blocks = stream_pipeline.input_blocks(f_in, BLOCK_SIZE)
+            block = next(blocks, b"")
+
+            while True:
+                next_block = next(blocks, b"")
+                last = not next_block
+                checksum = zlib.adler32(block, checksum)
+                if digest is not None:
+                    digest.update(block)
+                pending.append((executor.submit(_compress_block, block, dictionary, level, last), offset, lines, dictionary))
+                dictionary = block[-DICTIONARY_SIZE:]
+                offset += len(block)
+                if index:
+                    lines += stream_pipeline.count_newlines(block)
+
+                # Keep a couple of blocks per thread in flight and write the finished ones in order.
+                while pending and (len(pending) > 2 * threads or last):
+                    future, block_offset, block_lines, window = pending.pop(0)
+                    random_access.add_point(access_index, block_offset, f_out.tell(), block_lines, window)
+                    f_out.write(future.result())
+                if last:
+                    break
+                block = next_block
+
+            f_out.write(struct.pack(">I", checksum))
+            original_size = f_in.tell()
+            compressed_size = f_out.tell()
+
+        if index:
+            random_access.write_index(output_path, access_index, original_size, lines)
         return original_size, compressed_size
 
     except Exception as e:
@@ -47,6 +218,9 @@ def _stream_decompress_file(input_path, output_path, decompressor, chunk_size=65
 
             remaining_data = decompressor.flush()
             f_out.write(remaining_data)
+            if not decompressor.eof:
+                # The Adler-32 trailer was never reached, so nothing vouches for what was written.
+                raise EOFError("compressed data ends before the end of the stream")
 
         compressed_size = os.path.getsize(input_path)
         restored_size = os.path.getsize(output_path)
@@ -57,67 +231,168 @@ def _stream_decompress_file(input_path, output_path, decompressor, chunk_size=65
         return 0, 0
 
 
-def compress_folder_streaming(input_dir, output_dir, level=zlib.Z_BEST_COMPRESSION, chunk_size=65536):
+def _restore_file(input_path, output_path, dictionaries, chunk_size=65536, threads=1):
+    # threads is accepted for folder_restore; a zlib stream can only be inflated from the start.
+    try:
+        decompressor = _decompressor_for(input_path, dictionaries)
+    except (OSError, ValueError) as e:
+        print(f"Error decompressing {input_path}: {e}")
+        return 0, 0
+    return _stream_decompress_file(input_path, output_path, decompressor, chunk_size)
+
+
+def compress_folder_streaming(input_dir, output_dir, level=None, chunk_size=None, manifest=None, jobs=1, store_incompressible=True, seekable=False, solid=False):
+    run_journal.start_backend(manifest, "zlib")
     if not os.path.isdir(input_dir):
         print(f"Error: Input directory not found at {input_dir}")
         return
 
+    level, chunk_size = host_profile.tuned('zlib', level, chunk_size)
+
     total_original_size = 0
     total_compressed_size = 0
     total_files_processed = 0
     total_files_skipped = 0
+    total_files_unchanged = 0
+    total_files_stored = 0
 
     start_time = time.time()
 
-    print("-" * 75)
-    print(f"Starting Zlib TEXT Compression of Folder: {input_dir}")
-    print(f"Output Directory: {output_dir}")
-    print("-" * 75)
-    print("File Path                             | Original Size | Compressed Size | Ratio")
-    print("-" * 75)
-
-    for root, _, files in os.walk(input_dir):
-        relative_dir = os.path.relpath(root, input_dir)
-
-        target_dir = os.path.join(output_dir, relative_dir)
-        os.makedirs(target_dir, exist_ok=True)
-
-        for filename in files:
-            _, ext = os.path.splitext(filename)
-            if ext.lower() not in TEXT_EXTENSIONS:
-                total_files_skipped += 1
-                continue
-
-            input_path = os.path.join(root, filename)
-
-            output_filename = filename + COMPRESSED_EXTENSION
-            output_path = os.path.join(target_dir, output_filename)
-
-            compressor = zlib.compressobj(level=level)
-
-            original_size, compressed_size = _stream_compress_file(
-                input_path,
-                output_path,
-                compressor,
-                chunk_size
-            )
-
-            if original_size > 0:
-                total_original_size += original_size
-                total_compressed_size += compressed_size
-                total_files_processed += 1
-
-                compression_ratio = 1.0
-                if compressed_size > 0:
-                    compression_ratio = original_size / compressed_size
-
-                file_info = os.path.join(relative_dir, filename)
-
-                print(f"{file_info:40.40} | {original_size:13,} B | {compressed_size:15,} B | {compression_ratio:5.2f}:1")
+    if not file_manifest.continues_batch(manifest):
+        print("-" * 75)
+        print(f"Starting Zlib TEXT Compression of Folder: {input_dir}")
+        print(f"Output Directory: {output_dir}")
+        print("-" * 75)
+        metrics.console("File Path                             | Original Size | Compressed Size | Ratio")
+        print("-" * 75)
+
+    manifest = file_manifest.resolve_manifest(input_dir, output_dir, manifest)
+    params = {'level': level, 'store_incompressible': store_incompressible}
+    if seekable:
+        params['seekable'] = True
+    # Small files of the folders picked for solid mode are packed together after the per-file pass.
+    solid_folders = solid_archive.plan_solid_folders(manifest['entries'], TEXT_EXTENSIONS, solid)
+    solid_paths = {entry['path'] for members in solid_folders.values() for entry in members}
+    parallel_tasks = []
+    tasks = []
+    small_files = []
+
+    small_paths = [entry['path'] for entry in manifest['entries']
+                   if entry['ext'] in TEXT_EXTENSIONS and entry['size'] < SMALL_FILE_SIZE and entry['path'] not in solid_paths]
+    # Batches of a time-budgeted run all use the dictionary the first one trained.
+    batch_state = manifest.get('batch_state', {})
+    zdict, dictionary_path, trained = _open_dictionary(output_dir, small_paths, batch_state.get('zlib_dictionary'))
+    if dictionary_path:
+        batch_state['zlib_dictionary'] = dictionary_path
+    small_params = {**params, 'dictionary': dictionary_id(zdict)} if zdict else params
+
+    for entry in manifest['entries']:
+        if entry['ext'] not in TEXT_EXTENSIONS:
+            total_files_skipped += 1
+            continue
+        if entry['path'] in solid_paths:
+            continue
+
+        target_dir = file_manifest.ensure_output_dir(manifest, output_dir, entry)
+        output_path = os.path.join(target_dir, entry['name'] + COMPRESSED_EXTENSION)
+        stored_path = os.path.join(target_dir, entry['name'])
+
+        # Incompressible files are stored under their own name, so check whichever output was written last time.
+        previous_output = run_journal.recorded_output(manifest, entry, "zlib") or output_path
+        entry_params = small_params if entry['size'] < SMALL_FILE_SIZE else params
+        if run_journal.is_up_to_date(manifest, entry, "zlib", entry_params, previous_output):
+            file_manifest.record_output(manifest, entry, previous_output)
+            total_files_unchanged += 1
+            continue
+
+        if (jobs != 1 or seekable) and entry['size'] >= PARALLEL_MIN_SIZE:
+            # One at a time, each spread over every job as threads, instead of tying up a single worker.
+            # The block format is also what makes a seekable output, so it is used even with one job then.
+            parallel_tasks.append(worker_pool.make_task(
+                entry['size'],
+                (entry, previous_output),
+                (functools.partial(compress_file_parallel, threads=jobs, index=seekable), entry['path'], output_path, stored_path,
+                 level, chunk_size, store_incompressible)
+            ))
+            continue
+
+        if zdict and entry['size'] < SMALL_FILE_SIZE:
+            small_files.append(((entry, previous_output), (entry['path'], output_path, stored_path)))
+            continue
+
+        tasks.append(worker_pool.make_task(
+            entry['size'],
+            (entry, previous_output),
+            (compress_file, entry['path'], output_path, stored_path, level, chunk_size, store_incompressible)
+        ))
+
+    # Thousands of tiny files would spend more time being handed to workers than being compressed.
+    batch_tasks = []
+    for i in range(0, len(small_files), SMALL_FILE_BATCH):
+        batch = small_files[i:i + SMALL_FILE_BATCH]
+        batch_tasks.append(worker_pool.make_task(
+            sum(context[0]['size'] for context, _ in batch),
+            [context for context, _ in batch],
+            ([paths for _, paths in batch], level, chunk_size, store_incompressible, zdict)
+        ))
+
+    results = itertools.chain(
+        worker_pool.run_tasks(entropy_check.compress_or_store, parallel_tasks, 1, stage="zlib"),
+        worker_pool.run_tasks(entropy_check.compress_or_store, tasks, jobs, stage="zlib"),
+        (pair for contexts, batch_results in worker_pool.run_tasks(_compress_small_files, batch_tasks, jobs, stage="zlib")
+         for pair in zip(contexts, batch_results)),
+    )
+
+    for (entry, previous_output), (original_size, compressed_size, output_path, sha256) in results:
+        if sha256 is not None:
+            if os.path.normpath(previous_output) != os.path.normpath(output_path) and os.path.isfile(previous_output):
+                os.remove(previous_output)
+            if not output_path.endswith(COMPRESSED_EXTENSION):
+                total_files_stored += 1
+
+            run_journal.record_completed(manifest, entry, "zlib", small_params if entry['size'] < SMALL_FILE_SIZE else params,
+                                         output_path, sha256)
+            file_manifest.record_output(manifest, entry, output_path,
+                                        depends_on=(dictionary_path,) if zdict and entry['size'] < SMALL_FILE_SIZE else ())
+            if seekable and os.path.isfile(output_path + random_access.INDEX_EXTENSION):
+                file_manifest.record_output(manifest, entry, output_path + random_access.INDEX_EXTENSION)
+            metrics.record_file("zlib", original_size, compressed_size,
+                                status="processed" if output_path.endswith(COMPRESSED_EXTENSION) else "stored")
+            total_original_size += original_size
+            total_compressed_size += compressed_size
+            total_files_processed += 1
+
+            compression_ratio = 1.0
+            if compressed_size > 0:
+                compression_ratio = original_size / compressed_size
+
+            file_info = os.path.join(entry['relative_dir'], entry['name'])
+
+            metrics.console(f"{file_info:40.40} | {original_size:13,} B | {compressed_size:15,} B | {compression_ratio:5.2f}:1")
+        else:
+            metrics.record_counts("zlib", error=1)
+
+    if trained:
+        # Recorded after the outputs compressed with it, so it stays put while any of them is still being read.
+        file_manifest.record_shared_output(manifest, dictionary_path)
+
+    solid_totals = solid_archive.compress_solid_folders(manifest, output_dir, "zlib", params, solid_folders, level, jobs)
+    total_original_size += solid_totals['original']
+    total_compressed_size += solid_totals['compressed']
+    total_files_processed += solid_totals['processed']
+    total_files_unchanged += solid_totals['unchanged']
 
     end_time = time.time()
     duration = end_time - start_time
 
+    run_journal.finish_backend(manifest, "zlib")
+    metrics.record_counts("zlib", skipped=total_files_skipped, unchanged=total_files_unchanged)
+    metrics.add_gauge('stage_seconds', duration, stage="zlib")
+
+    if total_files_processed == 0 and total_files_unchanged > 0:
+        print(f"All {total_files_unchanged} eligible files are unchanged since the last run.")
+        return
+
     if total_files_processed == 0:
         print("No eligible text files found to compress.")
         return
@@ -126,12 +401,12 @@ def compress_folder_streaming(input_dir, output_dir, level=zlib.Z_BEST_COMPRESSI
     speed_mbps = total_size_mb / duration if duration > 0 else float('inf')
 
     savings = total_original_size - total_compressed_size
-    savings_percent_total = (savings / total_original_size) * 100
+    savings_percent_total = (savings / total_original_size) * 100 if total_original_size > 0 else 0
 
     print("\n" + "=" * 75)
     print("           FOLDER COMPRESSION COMPLETE")
     print("=" * 75)
-    print(f"Total Files Processed: {total_files_processed} | Skipped: {total_files_skipped}")
+    print(f"Total Files Processed: {total_files_processed} | Skipped: {total_files_skipped} | Unchanged: {total_files_unchanged} | Stored: {total_files_stored}")
     print(f"Total Time Taken: {duration:.4f} seconds")
     print("-" * 75)
     print(f"Original Total Size: {total_original_size:,} bytes ({total_size_mb:.2f} MB)")
@@ -141,14 +416,11 @@ def compress_folder_streaming(input_dir, output_dir, level=zlib.Z_BEST_COMPRESSI
     print("=" * 75 + "\n")
 
 
-def decompress_folder_streaming(input_dir, output_dir, chunk_size=65536):
+def decompress_folder_streaming(input_dir, output_dir, chunk_size=65536, copy_stored=True, jobs=1):
     if not os.path.isdir(input_dir):
         print(f"Error: Input directory not found at {input_dir}")
         return
 
-    total_compressed_size = 0
-    total_restored_size = 0
-    total_files = 0
     start_time = time.time()
 
     print("-" * 60)
@@ -156,41 +428,22 @@ def decompress_folder_streaming(input_dir, output_dir, chunk_size=65536):
     print(f"Output Directory: {output_dir}")
     print("-" * 60)
 
-    for root, _, files in os.walk(input_dir):
-        relative_dir = os.path.relpath(root, input_dir)
-
-        target_dir = os.path.join(output_dir, relative_dir)
-        os.makedirs(target_dir, exist_ok=True)
+    totals = folder_restore.restore_folder(input_dir, output_dir, COMPRESSED_EXTENSION,
+                                           functools.partial(_restore_file, dictionaries=_load_dictionaries(input_dir), chunk_size=chunk_size),
+                                           jobs=jobs, parallel_min_size=None, stage="zlib")
+    total_compressed_size = totals['compressed_size']
+    total_restored_size = totals['restored_size']
+    total_files = totals['files']
 
-        for filename in files:
-            if not filename.endswith(COMPRESSED_EXTENSION):
-                continue
-
-            input_path = os.path.join(root, filename)
-
-            restored_filename = filename[:-len(COMPRESSED_EXTENSION)]
-            output_path = os.path.join(target_dir, restored_filename)
-
-            print(f"  [DECOMPRESS]: {os.path.join(relative_dir, filename)}...")
-
-            decompressor = zlib.decompressobj()
-
-            compressed_size, restored_size = _stream_decompress_file(
-                input_path,
-                output_path,
-                decompressor,
-                chunk_size
-            )
-
-            if restored_size > 0:
-                total_compressed_size += compressed_size
-                total_restored_size += restored_size
-                total_files += 1
+    if copy_stored:
+        total_files_stored = entropy_check.copy_stored_files(input_dir, output_dir, TEXT_EXTENSIONS)
+        if total_files_stored:
+            print(f"  Copied {total_files_stored} stored (uncompressed) files.")
 
     end_time = time.time()
     duration = end_time - start_time
 
-    if total_files == 0:
+    if total_files == 0 and not totals['failed']:
         print("No .zlib files found to decompress.")
         return
 
@@ -206,6 +459,8 @@ def decompress_folder_streaming(input_dir, output_dir, chunk_size=65536):
     print(f"Input Total Size (Compressed): {total_compressed_size:,} bytes")
     print(f"Output Total Size (Restored): {total_restored_size:,} bytes ({total_size_mb:.2f} MB)")
     print(f"Average Decompression Speed: **{speed_mbps:.2f} MB/s**")
+    print("-" * 60)
+    folder_restore.print_verification(totals)
     print("=" * 60 + "\n")
 
 
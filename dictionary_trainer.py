@@ -0,0 +1,76 @@
+import heapq
+from collections import Counter
+
+SAMPLE_FILES = 2000 # At most this many files are sampled for training...
+SAMPLE_BYTES_PER_FILE = 512 # ...and only this much of each (the start of small files is the most repetitive part)
+SEGMENT_SIZE = 64
+DMER_SIZE = 8
+
+
+def read_samples(paths: list) -> list:
+    """Read the start of up to SAMPLE_FILES files, evenly spread over paths (keep paths sorted for a stable result)."""
+    step = max(1, len(paths) // SAMPLE_FILES)
+    samples = []
+    for path in paths[::step][:SAMPLE_FILES]:
+        try:
+            with open(path, 'rb') as f:
+                samples.append(f.read(SAMPLE_BYTES_PER_FILE))
+        except OSError as e:
+            print(f" Error sampling {path}: {e}")
+    return samples
+
+
+def _dmers(segment: bytes) -> set:
+    return {segment[i:i + DMER_SIZE] for i in range(len(segment) - DMER_SIZE + 1)}
+
+
+def train_dictionary(samples: list, size: int) -> bytes:
+    """Build a preset dictionary of at most `size` bytes from sample contents.
+
+    A simplified version of zstd's COVER trainer: every SEGMENT_SIZE slice of
+    the samples is scored by how many other samples share its 8-byte
+    substrings, the best slices are picked greedily (substrings already
+    covered stop counting), and the most valuable slice goes last, where
+    deflate reaches it with the shortest distances.
+    """
+    frequency = Counter()
+    for sample in samples:
+        frequency.update(_dmers(sample))
+
+    candidates = []
+    for sample in samples:
+        for start in range(0, max(1, len(sample) - SEGMENT_SIZE + 1), SEGMENT_SIZE // 2):
+            candidates.append(sample[start:start + SEGMENT_SIZE])
+
+    def score(segment):
+        # Substrings found in a single sample would only help that one file.
+        return sum(frequency[dmer] for dmer in _dmers(segment) if frequency[dmer] > 1)
+
+    heap = [(-score(segment), i) for i, segment in enumerate(candidates)]
+    heapq.heapify(heap)
+
+    chosen = []
+    total_size = 0
+    while heap and total_size < size:
+        negative_score, i = heapq.heappop(heap)
+        current_score = score(candidates[i])
+        if current_score == 0:
+            break
+        if current_score != -negative_score:
+            # Picked segments zeroed some of its substrings; re-queue with the score it has now.
+            heapq.heappush(heap, (-current_score, i))
+            continue
+
+        chosen.append(candidates[i])
+        total_size += len(candidates[i])
+        for dmer in _dmers(candidates[i]):
+            frequency[dmer] = 0
+
+    return b"".join(reversed(chosen))[-size:]
+
+
+# --- Test ---
+#import glob
+#PATHS = sorted(glob.glob("input/text/**/*.json", recursive=True))
+
+#print(len(train_dictionary(read_samples(PATHS), 32 * 1024)))
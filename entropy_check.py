@@ -0,0 +1,109 @@
+import hashlib
+import numpy as np
+import os
+import shutil
+
+SAMPLE_CHUNKS = 8
+SAMPLE_CHUNK_SIZE = 64 * 1024
+MIN_ESTIMATED_SAVINGS = 0.05  # Files expected to shrink by less than this are stored instead of compressed
+
+
+def estimate_entropy(input_path: str, file_size: int = None) -> float:
+    """Order-0 Shannon entropy in bits per byte over evenly spaced sample chunks."""
+    if file_size is None:
+        file_size = os.path.getsize(input_path)
+
+    with open(input_path, 'rb') as f:
+        if file_size <= SAMPLE_CHUNKS * SAMPLE_CHUNK_SIZE:
+            sample = f.read()
+        else:
+            stride = (file_size - SAMPLE_CHUNK_SIZE) // (SAMPLE_CHUNKS - 1)
+            chunks = []
+            for i in range(SAMPLE_CHUNKS):
+                f.seek(i * stride)
+                chunks.append(f.read(SAMPLE_CHUNK_SIZE))
+            sample = b"".join(chunks)
+
+    if not sample:
+        return 0.0
+
+    counts = np.bincount(np.frombuffer(sample, dtype=np.uint8), minlength=256)
+    probabilities = counts[counts > 0] / len(sample)
+    return float(-(probabilities * np.log2(probabilities)).sum())
+
+
+def is_incompressible(input_path: str, file_size: int = None) -> bool:
+    estimated_savings = 1 - estimate_entropy(input_path, file_size) / 8
+    return estimated_savings < MIN_ESTIMATED_SAVINGS
+
+
+def store_file(input_path: str, stored_path: str, digest=None):
+    try:
+        if digest is None:
+            shutil.copyfile(input_path, stored_path)
+        else:
+            # Copied by hand so the same read also feeds the checksum.
+            with open(input_path, 'rb') as f_in, open(stored_path, 'wb') as f_out:
+                while True:
+                    chunk = f_in.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    f_out.write(chunk)
+        size = os.path.getsize(stored_path)
+        return size, size
+
+    except Exception as e:
+        print(f" Error storing {input_path}: {e}")
+        return 0, 0
+
+
+def written_checksum(digest, written_size: int):
+    # Failed writes report 0 bytes written. Empty inputs are never stored and every format writes a header even
+    # for them, so a successful write of an empty file still has a size.
+    return digest.hexdigest() if written_size > 0 else None
+
+
+def compress_or_store(compress_function, input_path, output_path, stored_path, level, chunk_size, store_incompressible=True):
+    """Copy the file to stored_path when it looks incompressible, else compress it to output_path.
+
+    compress_function must take a digest keyword and feed it every block it
+    reads. Returns (original_size, written_size, written_path, sha256), the
+    sha256 being the input's, taken from the read that compressed or copied it,
+    or None when the write failed.
+    """
+    digest = hashlib.sha256()
+    incompressible = False
+    if store_incompressible:
+        try:
+            incompressible = is_incompressible(input_path)
+        except Exception as e:
+            print(f" Error sampling {input_path}: {e}")
+
+    if incompressible:
+        original_size, stored_size = store_file(input_path, stored_path, digest)
+        return original_size, stored_size, stored_path, written_checksum(digest, stored_size)
+
+    original_size, compressed_size = compress_function(input_path, output_path, level, chunk_size, digest=digest)
+    return original_size, compressed_size, output_path, written_checksum(digest, compressed_size)
+
+
+def copy_stored_files(input_dir: str, output_dir: str, stored_extensions: tuple) -> int:
+    """Copy files a compressor stored as-is into the restored folder; returns how many were copied."""
+    copied = 0
+    for root, _, files in os.walk(input_dir):
+        target_dir = os.path.join(output_dir, os.path.relpath(root, input_dir))
+
+        for filename in files:
+            if not filename.lower().endswith(stored_extensions):
+                continue
+            os.makedirs(target_dir, exist_ok=True)
+            shutil.copyfile(os.path.join(root, filename), os.path.join(target_dir, filename))
+            copied += 1
+    return copied
+
+
+# --- Test ---
+#INPUT_FILE = "input/text/T-1/sample.json"
+
+#print(f"{estimate_entropy(INPUT_FILE):.3f} bits/byte | Incompressible: {is_incompressible(INPUT_FILE)}")
@@ -0,0 +1,227 @@
+import os
+import threading
+import time
+
+FILE_TYPES = {
+    'text': ('.txt', '.csv', '.md', '.log', '.json', '.xml', '.py', '.html',
+             '.css', '.js', '.ts', '.jsx', '.yaml', '.yml', '.cpp', '.json5', '.toml'),
+    'image': ('.jpg', '.jpeg', '.png', '.webp', '.tiff', '.bmp', '.gif'),
+    'audio': ('.wav', '.flac', '.ogg', '.aiff', '.mp3', '.m4a', '.wma'),
+    'video': ('.mp4', '.mkv', '.avi', '.mov', '.webm', '.flv', '.wmv', '.m4v'),
+}
+
+
+def _detect_type(ext: str) -> str:
+    for file_type, extensions in FILE_TYPES.items():
+        if ext in extensions:
+            return file_type
+    return "other"
+
+
+def _scan_directory(root: str, relative_dir: str, entries: list):
+    subdirs = []
+    try:
+        with os.scandir(root) as it:
+            for dir_entry in it:
+                if dir_entry.is_dir(follow_symlinks=False):
+                    subdirs.append(dir_entry)
+                    continue
+                if not dir_entry.is_file():
+                    continue
+
+                try:
+                    stat = dir_entry.stat()
+                except OSError as e:
+                    print(f"Warning: Could not stat {dir_entry.path}: {e}")
+                    continue
+
+                ext = os.path.splitext(dir_entry.name)[1].lower()
+                entries.append({
+                    'path': dir_entry.path,
+                    'relative_dir': relative_dir,
+                    'name': dir_entry.name,
+                    'ext': ext,
+                    'size': stat.st_size,
+                    'mtime': stat.st_mtime,
+                    'type': _detect_type(ext),
+                    'outputs': [],
+                })
+    except OSError as e:
+        print(f"Warning: Could not read directory {root}: {e}")
+        return
+
+    for dir_entry in sorted(subdirs, key=lambda d: d.name):
+        if relative_dir == os.curdir:
+            child_relative_dir = dir_entry.name
+        else:
+            child_relative_dir = os.path.join(relative_dir, dir_entry.name)
+        _scan_directory(dir_entry.path, child_relative_dir, entries)
+
+
+def build_manifest(input_dir: str, output_dir: str) -> dict:
+    """Walk input_dir once and return the manifest shared by every stage of a run."""
+    start_time = time.time()
+    entries = []
+
+    if os.path.isdir(input_dir):
+        _scan_directory(input_dir, os.curdir, entries)
+
+    return {
+        'input_dir': input_dir,
+        'output_dir': output_dir,
+        'entries': entries,
+        'created_dirs': set(),
+        'output_watchers': [],
+        'output_sink': None,
+        'output_holds': {},
+        'held_outputs': {},
+        'output_dependencies': {},
+        'holds_lock': threading.Lock(),
+        'scan_time': time.time() - start_time,
+    }
+
+
+def resolve_manifest(input_dir: str, output_dir: str, manifest: dict = None) -> dict:
+    if manifest is not None:
+        return manifest
+    return build_manifest(input_dir, output_dir)
+
+
+def subset_manifest(manifest: dict, entries: list) -> dict:
+    """View of the manifest limited to entries; watchers, sink, holds and journal stay shared with the full one."""
+    subset = dict(manifest)
+    subset['entries'] = entries
+    return subset
+
+
+def batch_manifest(manifest: dict) -> dict:
+    """Manifest for a stage that is called once per batch (see time_budget); subsets of it share two things.
+
+    'batch_state' carries what a backend wants to reuse between its calls, and
+    shared outputs are deferred until end_batches, so one a later batch still
+    needs (such as a dictionary) is not taken by the sink after the first.
+    """
+    batched = dict(manifest)
+    batched['batch_state'] = {}
+    batched['deferred_outputs'] = []
+    return batched
+
+
+def continues_batch(manifest: dict) -> bool:
+    # The batch goes on with the backend and setting of the one before it, so the folder function skips its banner.
+    return bool(manifest and manifest.get('continues_batch'))
+
+
+def end_batches(manifest: dict):
+    for output_path in manifest['deferred_outputs']:
+        _to_sink(manifest, None, output_path)
+    manifest['deferred_outputs'].clear()
+
+
+def ensure_output_dir(manifest: dict, output_dir: str, entry: dict) -> str:
+    target_dir = os.path.join(output_dir, entry['relative_dir'])
+    if target_dir not in manifest['created_dirs']:
+        os.makedirs(target_dir, exist_ok=True)
+        manifest['created_dirs'].add(target_dir)
+    return target_dir
+
+
+def record_output(manifest: dict, entry: dict, output_path: str, to_sink=True, depends_on=()):
+    """Attach output_path to entry; to_sink=False for an output shared by several entries, handed over once by the caller.
+
+    depends_on lists shared outputs needed to read this one (such as its dictionary); they are held as long as it is.
+    """
+    entry['outputs'].append(output_path)
+    for callback in manifest['output_watchers']:
+        callback(entry, output_path)
+
+    if depends_on:
+        with manifest['holds_lock']:
+            if manifest['output_holds'].get(output_path, 0) > 0:
+                manifest['output_dependencies'][output_path] = tuple(depends_on)
+                for dependency in depends_on:
+                    manifest['output_holds'][dependency] = manifest['output_holds'].get(dependency, 0) + 1
+    if to_sink:
+        _to_sink(manifest, entry, output_path)
+
+
+def record_shared_output(manifest: dict, output_path: str):
+    """Output that belongs to no single input (such as a shared dictionary): only the sink sees it, with entry None.
+
+    Record it after every output announced against it, so the holds their watchers took keep it until they are done.
+    """
+    if 'deferred_outputs' in manifest:
+        if output_path not in manifest['deferred_outputs']:
+            manifest['deferred_outputs'].append(output_path)
+        return
+    _to_sink(manifest, None, output_path)
+
+
+def _to_sink(manifest: dict, entry, output_path: str):
+    if manifest['output_sink'] is None:
+        return
+    with manifest['holds_lock']:
+        if manifest['output_holds'].get(output_path, 0) > 0:
+            manifest['held_outputs'][output_path] = entry
+            return
+    manifest['output_sink'](entry, output_path)
+
+
+def set_output_sink(manifest: dict, sink):
+    """Hand every recorded output to sink(entry, output_path) once no watcher holds it any more."""
+    manifest['output_sink'] = sink
+
+
+def hold_output(manifest: dict, output_path: str):
+    # Watchers that still need to read an output hold it so the sink does not take it away first.
+    with manifest['holds_lock']:
+        manifest['output_holds'][output_path] = manifest['output_holds'].get(output_path, 0) + 1
+
+
+def release_output(manifest: dict, output_path: str):
+    with manifest['holds_lock']:
+        remaining = manifest['output_holds'].get(output_path, 0) - 1
+        if remaining > 0:
+            manifest['output_holds'][output_path] = remaining
+            return
+        manifest['output_holds'].pop(output_path, None)
+        dependencies = manifest['output_dependencies'].pop(output_path, ())
+        held = output_path in manifest['held_outputs']
+        entry = manifest['held_outputs'].pop(output_path, None)
+
+    if held and manifest['output_sink'] is not None:
+        manifest['output_sink'](entry, output_path)
+    for dependency in dependencies:
+        release_output(manifest, dependency)
+
+
+def watch_outputs(manifest: dict, callback):
+    manifest['output_watchers'].append(callback)
+
+
+def unwatch_outputs(manifest: dict, callback):
+    if callback in manifest['output_watchers']:
+        manifest['output_watchers'].remove(callback)
+
+
+def total_input_size(manifest: dict) -> int:
+    return sum(entry['size'] for entry in manifest['entries'])
+
+
+def count_by_type(manifest: dict) -> dict:
+    counts = {}
+    for entry in manifest['entries']:
+        counts[entry['type']] = counts.get(entry['type'], 0) + 1
+    return counts
+
+
+def print_manifest_summary(manifest: dict):
+    total_size = total_input_size(manifest)
+    counts = count_by_type(manifest)
+
+    print("-" * 70)
+    print(f"Input Manifest: {manifest['input_dir']}")
+    print(f"Files Found: {len(manifest['entries'])} ({total_size / (1024 * 1024):.2f} MB) "
+          f"in {manifest['scan_time']:.4f} seconds")
+    print(" | ".join(f"{file_type}: {count}" for file_type, count in sorted(counts.items())))
+    print("-" * 70)
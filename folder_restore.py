@@ -0,0 +1,132 @@
+import functools
+import itertools
+import os
+import run_journal
+import solid_archive
+import worker_pool
+
+
+def _folder_key(relative_path: str) -> str:
+    # Journal inputs are normalised paths, so files at the top level have no directory part.
+    return "" if relative_path == os.curdir else os.path.normpath(relative_path)
+
+
+def _restore_one(input_path: str, output_path: str, restore_file, expected: dict) -> dict:
+    """Worker task: restore one compressed file (or unpack a solid archive) and check every file it wrote.
+
+    expected maps restored file names to the sha256 their originals had at
+    compress time; files missing from it only get the decoder's own checks.
+    Files that fail either check are removed, so nothing corrupt is left
+    looking like a good restore.
+    """
+    target_dir = os.path.dirname(output_path)
+    result = {'compressed_size': os.path.getsize(input_path), 'restored_size': 0, 'files': 0,
+              'verified': 0, 'unverified': 0, 'failed': []}
+
+    if solid_archive.is_solid_archive(os.path.basename(input_path)):
+        try:
+            names = [member['name'] for member in solid_archive.read_member_index(input_path)]
+        except Exception as e:
+            result['failed'].append((os.path.basename(input_path), f"unreadable member index: {e}"))
+            return result
+        restored_files, result['restored_size'] = solid_archive.extract_archive(input_path, target_dir)
+        # Members are written in order, so the ones after a damaged spot are the ones missing.
+        result['failed'] = [(name, "archive is damaged before this member") for name in names[restored_files:]]
+        names = names[:restored_files]
+    else:
+        names = [os.path.basename(output_path)]
+        compressed_size, result['restored_size'] = restore_file(input_path, output_path)
+        if compressed_size == 0:
+            result['failed'].append((names[0], "could not be decoded"))
+            names = []
+
+    for name in names:
+        path = os.path.join(target_dir, name)
+        if name not in expected:
+            result['unverified'] += 1
+        elif run_journal.matches_checksum(path, expected[name]):
+            result['verified'] += 1
+        else:
+            result['failed'].append((name, "checksum mismatch"))
+            continue
+        result['files'] += 1
+
+    for name, _ in result['failed']:
+        path = os.path.join(target_dir, name)
+        if os.path.isfile(path):
+            os.remove(path)
+    return result
+
+
+def restore_folder(input_dir: str, output_dir: str, extension: str, restore_file, jobs=1, parallel_min_size=None,
+                   stage=None) -> dict:
+    """Restore every `extension` file under input_dir into output_dir, spread over `jobs` worker processes.
+
+    restore_file(input_path, output_path, threads=1) decodes one file and
+    returns (compressed_size, restored_size), or (0, 0) when it fails; it
+    must be a module-level function or a partial of one. Files of at least
+    parallel_min_size are restored one at a time with threads=jobs instead.
+    Every restored file is checked against the sha256 the run journal in
+    input_dir recorded for its original. A corrupt file is reported and
+    removed without stopping the others; the totals list them under 'failed'.
+    """
+    checksums = {}
+    for key, sha256 in run_journal.load_checksums(input_dir).items():
+        checksums.setdefault(os.path.dirname(key), {})[os.path.basename(key)] = sha256
+
+    tasks = []
+    parallel_tasks = []
+    for root, _, files in os.walk(input_dir):
+        relative_dir = os.path.relpath(root, input_dir)
+        target_dir = os.path.join(output_dir, relative_dir)
+        os.makedirs(target_dir, exist_ok=True)
+        folder_checksums = checksums.get(_folder_key(relative_dir), {})
+
+        for filename in files:
+            if not filename.endswith(extension):
+                continue
+
+            input_path = os.path.join(root, filename)
+            restored_name = filename[:-len(extension)]
+            if solid_archive.is_solid_archive(filename):
+                expected = folder_checksums
+                label = f"  [UNPACK]: {os.path.join(relative_dir, filename)}..."
+            else:
+                expected = {restored_name: folder_checksums[restored_name]} if restored_name in folder_checksums else {}
+                label = f"  [DECOMPRESS]: {os.path.join(relative_dir, filename)}..."
+
+            size = os.path.getsize(input_path)
+            # Large files take every job as threads, one at a time, instead of tying up a single worker.
+            large = jobs != 1 and parallel_min_size is not None and size >= parallel_min_size
+            task = worker_pool.make_task(size, relative_dir, (
+                input_path, os.path.join(target_dir, restored_name),
+                functools.partial(restore_file, threads=jobs) if large else restore_file, expected
+            ), label=label)
+            (parallel_tasks if large else tasks).append(task)
+
+    totals = {'files': 0, 'compressed_size': 0, 'restored_size': 0, 'verified': 0, 'unverified': 0, 'failed': []}
+    results = itertools.chain(
+        worker_pool.run_tasks(_restore_one, parallel_tasks, 1, stage=stage),
+        worker_pool.run_tasks(_restore_one, tasks, jobs, stage=stage),
+    )
+    for relative_dir, result in results:
+        for key in ('files', 'compressed_size', 'restored_size', 'verified', 'unverified'):
+            totals[key] += result[key]
+        totals['failed'].extend((os.path.normpath(os.path.join(relative_dir, name)), reason) for name, reason in result['failed'])
+    return totals
+
+
+def print_verification(totals: dict, width=60):
+    print(f"Verified Against Checksums: {totals['verified']} | Unverified (no checksum): {totals['unverified']} | "
+          f"Failed: {len(totals['failed'])}")
+    if totals['failed']:
+        print("-" * width)
+        for relative_path, reason in totals['failed']:
+            print(f"  [CORRUPT]: {relative_path} ({reason})")
+
+
+# --- Test ---
+#import compressor_zlib
+#totals = restore_folder("output_processed", "restored", compressor_zlib.COMPRESSED_EXTENSION,
+#                        functools.partial(compressor_zlib._restore_file, dictionaries={}), jobs=4)
+#print_verification(totals)
@@ -0,0 +1,160 @@
+import json
+import os
+import platform
+import sys
+import threading
+import time
+
+PROFILE_FILE = "host_profile.json"  # Written by calibrate(); one entry per host name, so a shared folder serves every host
+CHUNK_SIZES = (16 * 1024, 64 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024)
+CALIBRATION_SIZE = 8 * 1024 * 1024  # Sample file written to the calibrated folder (below stream_pipeline.MMAP_MIN_SIZE, where chunk size matters)
+RUNS = 2  # Best of this many runs per setting, so one noisy run does not pick the winner
+LEVEL_SPEED_SHARE = 0.5  # The tuned level is the highest one keeping at least this share of the fastest level's throughput
+
+# Backend -> (module, levels to try, level and chunk size used without a profile)
+BACKENDS = {
+    'zlib': ("compressor_zlib", (1, 6, 9), 9, 65536),
+    'bz2': ("compressor_bz2", (1, 5, 9), 9, 65536),
+    'lz4': ("compressor_lz4", (1, 4, 9, 16), 4, 65536),
+}
+
+_lock = threading.Lock()
+_profile = None
+
+
+def _load_host_entry() -> dict:
+    global _profile
+    with _lock:
+        if _profile is None:
+            _profile = {}
+            if os.path.isfile(PROFILE_FILE):
+                try:
+                    with open(PROFILE_FILE, 'r', encoding='utf-8') as f:
+                        _profile = json.load(f).get('hosts', {}).get(platform.node(), {})
+                except (OSError, ValueError) as e:
+                    print(f"Warning: Could not read {PROFILE_FILE} ({e}); using the built-in chunk sizes and levels.")
+        return _profile
+
+
+def tuned(backend: str, level=None, chunk_size=None) -> tuple:
+    """(level, chunk_size) for backend, with whichever is None taken from this host's profile (or the built-in default).
+
+    The chunk size only matters where files are read in chunks: below
+    stream_pipeline.MMAP_MIN_SIZE (mapped files are sliced in at least
+    MAPPED_CHUNK_SIZE pieces) and never on the block-parallel path, which
+    splits files into BLOCK_SIZE blocks.
+    """
+    _, _, default_level, default_chunk_size = BACKENDS[backend]
+    settings = _load_host_entry().get(backend, {})
+    if level is None:
+        level = settings.get('level', default_level)
+    if chunk_size is None:
+        chunk_size = settings.get('chunk_size', default_chunk_size)
+    return level, chunk_size
+
+
+def calibrated_level(backend: str):
+    """Level calibrate() picked for backend on this host, or None when it has not been calibrated."""
+    return _load_host_entry().get(backend, {}).get('level')
+
+
+def _evict(path: str):
+    # Without this the sample would come from the page cache and the storage itself would never be measured.
+    if hasattr(os, 'posix_fadvise'):
+        with open(path, 'rb') as f:
+            os.fsync(f.fileno())
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def _measure(module, sample_path: str, output_path: str, level, chunk_size) -> tuple:
+    """(MB/s, ratio) of compressing the sample from storage to storage, best of RUNS."""
+    best = 0.0
+    for _ in range(RUNS):
+        _evict(sample_path)
+        start_time = time.perf_counter()
+        original_size, compressed_size = module.compress_file(sample_path, output_path, level, chunk_size)
+        with open(output_path, 'rb+') as f:
+            os.fsync(f.fileno())
+        duration = time.perf_counter() - start_time
+        os.remove(output_path)
+        best = max(best, original_size / (1024 * 1024) / duration)
+    return best, original_size / max(1, compressed_size)
+
+
+def calibrate(target_dir=".", profile_file=PROFILE_FILE) -> dict:
+    """Measure every chunk size and level on target_dir's storage and this host's CPU, and save the winners.
+
+    The chunk size is the fastest one at the backend's built-in level; the
+    level is then the highest whose throughput (read, compress and write,
+    all on target_dir) stays within LEVEL_SPEED_SHARE of the fastest level.
+    On storage slow enough to hide the CPU cost that is the strongest level.
+    The level is used by callers that pass none, and by main.py's planned
+    text stage with HOST_TUNED_LEVELS.
+    """
+    import benchmark
+    import random
+    import stage_registry
+
+    print("=" * 70)
+    print(f"Host Calibration: {platform.node()} ({os.cpu_count()} CPUs) on {os.path.abspath(target_dir)}")
+    print("=" * 70)
+
+    os.makedirs(target_dir, exist_ok=True)
+    sample_path = os.path.join(target_dir, ".calibration_sample.log")
+    output_path = sample_path + ".out"
+    with open(sample_path, 'wb') as f:
+        f.write(benchmark._text_lines(random.Random(benchmark.SEED), 0.5, CALIBRATION_SIZE))
+
+    host = {}
+    try:
+        for backend, (module_name, levels, default_level, _) in BACKENDS.items():
+            module = stage_registry.load_module(module_name)
+
+            speeds = {}
+            for chunk_size in CHUNK_SIZES:
+                speeds[chunk_size], _ = _measure(module, sample_path, output_path, default_level, chunk_size)
+                print(f"{backend:<6} level {default_level:<3} chunk {chunk_size // 1024:>5} KiB {speeds[chunk_size]:>10.2f} MB/s")
+            chunk_size = max(speeds, key=speeds.get)
+
+            results = {}
+            for level in levels:
+                results[level] = _measure(module, sample_path, output_path, level, chunk_size)
+                print(f"{backend:<6} level {level:<3} chunk {chunk_size // 1024:>5} KiB {results[level][0]:>10.2f} MB/s "
+                      f"{results[level][1]:>7.2f}:1")
+            fastest = max(speed for speed, _ in results.values())
+            level = max(level for level, (speed, _) in results.items() if speed >= LEVEL_SPEED_SHARE * fastest)
+
+            host[backend] = {'level': level, 'chunk_size': chunk_size,
+                             'mb_per_s': results[level][0], 'ratio': results[level][1]}
+            print(f"-> {backend}: level {level}, chunk {chunk_size // 1024} KiB")
+    finally:
+        for path in (sample_path, output_path):
+            if os.path.isfile(path):
+                os.remove(path)
+
+    profile = {'hosts': {}}
+    if os.path.isfile(profile_file):
+        with open(profile_file, 'r', encoding='utf-8') as f:
+            profile = json.load(f)
+    profile['hosts'][platform.node()] = {
+        **host,
+        'created': time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        'cpu_count': os.cpu_count(),
+        'storage': os.path.abspath(target_dir),
+    }
+    with open(profile_file, 'w', encoding='utf-8') as f:
+        json.dump(profile, f, indent=2)
+
+    global _profile
+    with _lock:
+        _profile = None
+
+    print("-" * 70)
+    print(f"Profile written to {profile_file}")
+    print("=" * 70 + "\n")
+    return host
+
+
+if __name__ == "__main__":
+    # Calibrate on the storage the compressors will read from and write to, e.g. python host_profile.py /mnt/archive
+    calibrate(sys.argv[1] if len(sys.argv) > 1 else ".")
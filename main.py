@@ -1,16 +1,16 @@
-import compressor_zlib
-import compressor_bz2
-import compressor_lz4
-import compressor_mozjpeg
-import compressor_oxipng
-import compressor_pydub_mp3
-import compressor_pydub_flac
-import compressor_ffmpeg
-import comparator_image
-import comparator_audio
-import comparator_video
 import compressor_zip
+import file_manifest
+import host_profile
+import metrics
+import run_journal
+import stage_registry
+import stage_scheduler
+import stream_pipeline
+import time_budget
+import worker_pool
+import os
 import time
+from stage_registry import lazy_function, lazy_attribute
 
 # Compression Parameters
 INPUT_FOLDER = "input_test"
@@ -18,94 +18,173 @@ OUTPUT_FOLDER = "output_processed"
 COMPRESSION_LEVEL = 3 # Range 1(Min Size Reduction) - 3(Max Size Reduction)
 SPEED_LEVEL = 1 # Range 1(Slower) - 3(Faster)
 AVOID_DATA_LOSS = False # Prefer libraries with the least amount of data loss
+# Which backend and level runs for each file type is the SPEED_LEVEL/COMPRESSION_LEVEL pair's entry in stage_registry.PRESETS
+PLAN_FROM_PROFILE = False # Plan each file type from the cost profile instead (benchmark_results.json from benchmark.py when present,
+                          # estimates otherwise); the picks then differ from the presets, e.g. SPEED_LEVEL 1 with COMPRESSION_LEVEL 2
+                          # gets zlib level 1 and hevc instead of zlib level 9 and h264
+AUTO_TEXT_BACKEND = True # Pick the text library and level per file from trial compressions of sampled blocks
+TEXT_SPEED_FLOORS = {1: 0, 2: 20, 3: 100} # Minimum MB/s a text backend must reach for each SPEED_LEVEL
+HOST_TUNED_LEVELS = False # Compress text at the level host_profile.py calibrated for the planned backend on this host, when it has been
+                          # calibrated, instead of the planner's (not with AUTO_TEXT_BACKEND or TIME_BUDGET)
+SEEKABLE_TEXT_OUTPUTS = False # Write large zlib/bz2/lz4 outputs in blocks with a .idx sidecar so random_access can read any range
+                              # (with AUTO_TEXT_BACKEND too, in whichever of them each file gets)
+SOLID_SMALL_FILES = 'auto' # Pack a folder's small text files into one compressed stream: 'auto' (folders made mostly of them),
+                           # True (every folder), False, or a list of relative folders; solid_archive.py reads single files back
 # Extras
 DO_CHECK_FIDELITY = True # Compare files to get a fidelity estimate
+VERIFY_TEXT_OUTPUTS = True # Decode every text output in memory as it is written and check it against the input's sha256 (nothing is restored to disk)
 ZIP_RESULT = True # Turn the result into a zip file
+ZIP_DIRECT = False # With ZIP_RESULT, move each output into the zip once it is written and checked, so the output folder only holds
+                   # the files in flight instead of the whole result; no INCREMENTAL. Text outputs compressed in this process go straight
+                   # into the zip, the rest (and every one VERIFY_TEXT_OUTPUTS reads back) passes through the folder once
+CPU_BUDGET = 0 # CPUs shared by the stages running at the same time (0 = use every CPU core)
+CONSOLE_TABLE = True # Print a line per file while the stages run (the metrics files are written either way)
+METRICS_JSON_FILE = "metrics.json" # Per-stage summary plus every counter and histogram
+METRICS_PROMETHEUS_FILE = "compression_metrics.prom" # Prometheus textfile collector format
+INCREMENTAL = True # Keep the output folder between runs and only recompress new or changed files
+TIME_BUDGET = 0 # Seconds the compression stages must finish in (0 = no budget); SPEED_LEVEL and AUTO_TEXT_BACKEND are then ignored and
+                # settings are downgraded (e.g. av1 -> h264, bz2 -> zlib) whenever the run falls behind
+
+
+def compressor_stage(name, function, *args, **kwargs):
+    return stage_scheduler.make_stage(name, function, (INPUT_FOLDER, OUTPUT_FOLDER) + args, kwargs)
+
+
+def backend_stage(choice, manifest):
+    backend = stage_registry.BACKENDS[choice['backend']]
+    if choice['stage'] == "text" and AUTO_TEXT_BACKEND:
+        return compressor_stage("text", lazy_function("compressor_auto.compress_folder_auto"),
+                                objective='size', min_speed_mbps=TEXT_SPEED_FLOORS[SPEED_LEVEL],
+                                seekable=SEEKABLE_TEXT_OUTPUTS, solid=SOLID_SMALL_FILES, manifest=manifest)
+
+    kwargs = {backend['parameter']: choice['value'], **backend.get('kwargs', {}), 'manifest': manifest}
+    if choice['stage'] == "text":
+        host_level = host_profile.calibrated_level(choice['backend']) if HOST_TUNED_LEVELS else None
+        if host_level is not None:
+            kwargs[backend['parameter']] = host_level
+            print(f"Text level from the host profile: {choice['backend']} {backend['parameter']}={host_level}")
+        kwargs['seekable'] = SEEKABLE_TEXT_OUTPUTS
+        kwargs['solid'] = SOLID_SMALL_FILES
+    return stage_scheduler.make_stage(choice['stage'], lazy_function(backend['function']),
+                                      (INPUT_FOLDER, OUTPUT_FOLDER), kwargs,
+                                      pass_jobs=backend.get('pass_jobs', True))
+
+
+def fidelity_stages(manifest, stages):
+    stage_names = [stage['name'] for stage in stages]
+    image_stages = [name for name in ("mozjpeg", "oxipng") if name in stage_names]
+    audio_stages = [name for name in ("flac", "mp3") if name in stage_names]
+    video_stages = [name for name in ("video",) if name in stage_names]
+
+    # The comparators (skimage, librosa) are only imported once a followed stage records its first output.
+    follow_stages = [
+        stage_scheduler.make_follow_stage(
+            "image fidelity", manifest, lazy_function("comparator_image.compare_pair"),
+            lazy_function("comparator_image.print_results"),
+            image_stages,
+            lambda entry, output_path: (entry['ext'] in lazy_attribute("comparator_image.IMAGE_EXTENSIONS")
+                                        and "_optimized" in os.path.basename(output_path))),
+        stage_scheduler.make_follow_stage(
+            "audio fidelity", manifest, lazy_function("comparator_audio.compare_pair"),
+            lambda results: lazy_function("comparator_audio.print_results")(results, INPUT_FOLDER, OUTPUT_FOLDER),
+            audio_stages,
+            lambda entry, output_path: (entry['ext'] in lazy_attribute("comparator_audio.AUDIO_EXTS")
+                                        and output_path.lower().endswith(lazy_attribute("comparator_audio.AUDIO_EXTS")))),
+        stage_scheduler.make_follow_stage(
+            "video fidelity", manifest, lazy_function("comparator_video.compare_pair"),
+            lazy_function("comparator_video.print_results"),
+            video_stages,
+            lambda entry, output_path: (entry['ext'] in lazy_attribute("comparator_video.VIDEO_EXTS")
+                                        and output_path.lower().endswith(lazy_attribute("comparator_video.VIDEO_EXTS")))),
+    ]
+    return [stage for stage in follow_stages if stage['follows']]
+
+
+def verify_stages(manifest, stages):
+    text_stages = [stage['name'] for stage in stages if stage['name'] == "text"]
+    if not text_stages:
+        return []
+    # The journal's checksums, and which outputs this run wrote, are looked up through the manifest, so both functions get it.
+    return [stage_scheduler.make_follow_stage(
+        "text verify", manifest,
+        lambda input_path, output_path, input_relative_path: lazy_function("comparator_text.compare_pair")(
+            input_path, output_path, input_relative_path, manifest),
+        lazy_function("comparator_text.print_results"),
+        text_stages,
+        lambda entry, output_path: lazy_function("comparator_text.is_verifiable")(entry, output_path, manifest))]
+
 
 if __name__ == "__main__":
     print("=" * 70)
     print("\n" + "--- AUTOMATIC DATA COMPRESSION TOOL ---")
     print("\n" + "=" * 70)
-    compressor_zip.delete_directory_contents(OUTPUT_FOLDER)
+    metrics.set_console(CONSOLE_TABLE)
+    zip_direct = ZIP_RESULT and ZIP_DIRECT
+    if not INCREMENTAL or zip_direct:
+        compressor_zip.delete_directory_contents(OUTPUT_FOLDER)
     start_main_time = time.time()
-    if AVOID_DATA_LOSS:
-        compressor_mozjpeg.optimize_folder_batch(INPUT_FOLDER, OUTPUT_FOLDER, 100)
-        compressor_oxipng.optimize_folder_with_oxipng(INPUT_FOLDER, OUTPUT_FOLDER, 6, png_only=True)
-        compressor_pydub_flac.compress_folder_to_flac(INPUT_FOLDER, OUTPUT_FOLDER, 8)
-        compressor_ffmpeg.process_video_folder(INPUT_FOLDER, OUTPUT_FOLDER, "av1", 30)
-    if SPEED_LEVEL == 1:
-        if COMPRESSION_LEVEL == 1:
-            compressor_lz4.compress_folder_streaming(INPUT_FOLDER, OUTPUT_FOLDER)
-            if not AVOID_DATA_LOSS:
-                compressor_mozjpeg.optimize_folder_batch(INPUT_FOLDER, OUTPUT_FOLDER, 100)
-                compressor_oxipng.optimize_folder_with_oxipng(INPUT_FOLDER, OUTPUT_FOLDER, 6, png_only=True)
-                compressor_pydub_flac.compress_folder_to_flac(INPUT_FOLDER, OUTPUT_FOLDER, 8)
-                compressor_ffmpeg.process_video_folder(INPUT_FOLDER, OUTPUT_FOLDER, "av1", 30)
-        elif COMPRESSION_LEVEL == 2:
-            compressor_zlib.compress_folder_streaming(INPUT_FOLDER, OUTPUT_FOLDER)
-            if not AVOID_DATA_LOSS:
-                compressor_mozjpeg.optimize_folder_batch(INPUT_FOLDER, OUTPUT_FOLDER, 90)
-                compressor_pydub_mp3.compress_folder_to_mp3(INPUT_FOLDER, OUTPUT_FOLDER, "320k")
-                compressor_ffmpeg.process_video_folder(INPUT_FOLDER, OUTPUT_FOLDER, "h264", 30)
-        elif COMPRESSION_LEVEL == 3:
-            compressor_bz2.compress_folder_streaming(INPUT_FOLDER, OUTPUT_FOLDER)
-            if not AVOID_DATA_LOSS:
-                compressor_mozjpeg.optimize_folder_batch(INPUT_FOLDER, OUTPUT_FOLDER, 80)
-                compressor_pydub_mp3.compress_folder_to_mp3(INPUT_FOLDER, OUTPUT_FOLDER, "192k")
-                compressor_ffmpeg.process_video_folder(INPUT_FOLDER, OUTPUT_FOLDER, "hevc", 30)
-    elif SPEED_LEVEL == 2:
-        if COMPRESSION_LEVEL == 1:
-            compressor_lz4.compress_folder_streaming(INPUT_FOLDER, OUTPUT_FOLDER)
-            if not AVOID_DATA_LOSS:
-                compressor_mozjpeg.optimize_folder_batch(INPUT_FOLDER, OUTPUT_FOLDER, 90)
-                compressor_pydub_flac.compress_folder_to_flac(INPUT_FOLDER, OUTPUT_FOLDER, 4)
-                compressor_ffmpeg.process_video_folder(INPUT_FOLDER, OUTPUT_FOLDER, "h264", 30)
-        elif COMPRESSION_LEVEL == 2:
-            compressor_zlib.compress_folder_streaming(INPUT_FOLDER, OUTPUT_FOLDER)
-            if not AVOID_DATA_LOSS:
-                compressor_mozjpeg.optimize_folder_batch(INPUT_FOLDER, OUTPUT_FOLDER, 80)
-                compressor_pydub_flac.compress_folder_to_flac(INPUT_FOLDER, OUTPUT_FOLDER, 6)
-                compressor_ffmpeg.process_video_folder(INPUT_FOLDER, OUTPUT_FOLDER, "h264", 30)
-        elif COMPRESSION_LEVEL == 3:
-            compressor_zlib.compress_folder_streaming(INPUT_FOLDER, OUTPUT_FOLDER)
-            if not AVOID_DATA_LOSS:
-                compressor_mozjpeg.optimize_folder_batch(INPUT_FOLDER, OUTPUT_FOLDER, 70)
-                compressor_pydub_mp3.compress_folder_to_mp3(INPUT_FOLDER, OUTPUT_FOLDER, "320k")
-                compressor_ffmpeg.process_video_folder(INPUT_FOLDER, OUTPUT_FOLDER, "hevc", 30)
-    elif SPEED_LEVEL == 3:
-        if COMPRESSION_LEVEL == 1:
-            compressor_lz4.compress_folder_streaming(INPUT_FOLDER, OUTPUT_FOLDER)
-            if not AVOID_DATA_LOSS:
-                compressor_mozjpeg.optimize_folder_batch(INPUT_FOLDER, OUTPUT_FOLDER, 80)
-                compressor_pydub_flac.compress_folder_to_flac(INPUT_FOLDER, OUTPUT_FOLDER, 1)
-                compressor_ffmpeg.process_video_folder(INPUT_FOLDER, OUTPUT_FOLDER, "h264", 30)
-        elif COMPRESSION_LEVEL == 2:
-            compressor_lz4.compress_folder_streaming(INPUT_FOLDER, OUTPUT_FOLDER)
-            if not AVOID_DATA_LOSS:
-                compressor_mozjpeg.optimize_folder_batch(INPUT_FOLDER, OUTPUT_FOLDER, 70)
-                compressor_pydub_flac.compress_folder_to_flac(INPUT_FOLDER, OUTPUT_FOLDER, 2)
-                compressor_ffmpeg.process_video_folder(INPUT_FOLDER, OUTPUT_FOLDER, "h264", 30)
-        elif COMPRESSION_LEVEL == 3:
-            compressor_zlib.compress_folder_streaming(INPUT_FOLDER, OUTPUT_FOLDER)
-            if not AVOID_DATA_LOSS:
-                compressor_mozjpeg.optimize_folder_batch(INPUT_FOLDER, OUTPUT_FOLDER, 60)
-                compressor_pydub_flac.compress_folder_to_flac(INPUT_FOLDER, OUTPUT_FOLDER, 3)
-                compressor_ffmpeg.process_video_folder(INPUT_FOLDER, OUTPUT_FOLDER, "h264", 30)
-
-    if DO_CHECK_FIDELITY:
-        comparator_image.compare_folders(INPUT_FOLDER, OUTPUT_FOLDER, "_optimized")
-        comparator_audio.compare_folders_recursive(INPUT_FOLDER, OUTPUT_FOLDER)
-        comparator_video.batch_compare_videos(INPUT_FOLDER, OUTPUT_FOLDER)
+    manifest = file_manifest.build_manifest(INPUT_FOLDER, OUTPUT_FOLDER)
+    file_manifest.print_manifest_summary(manifest)
+    if zip_direct:
+        archive_sink = compressor_zip.open_archive_sink("compressed_files.zip", OUTPUT_FOLDER)
+        file_manifest.set_output_sink(manifest, lambda entry, output_path: compressor_zip.archive_output(archive_sink, output_path))
+    elif INCREMENTAL:
+        run_journal.open_journal(manifest, OUTPUT_FOLDER)
+    cpu_budget = worker_pool.resolve_jobs(CPU_BUDGET)
+    budget = None
+    if TIME_BUDGET > 0:
+        # Start from the strongest settings for COMPRESSION_LEVEL and let the budget decide how fast to go.
+        plan = stage_registry.plan_backends(1, COMPRESSION_LEVEL, AVOID_DATA_LOSS, from_profile=PLAN_FROM_PROFILE)
+        plan = [choice for choice in plan if stage_registry.has_eligible_files(manifest, choice['stage'])]
+        budget = time_budget.open_budget(manifest, plan, TIME_BUDGET, cpu_budget // max(1, len(plan)),
+                                         AVOID_DATA_LOSS, start_time=start_main_time)
+        stages = [time_budget.budget_stage(budget, choice['group'], manifest, INPUT_FOLDER, OUTPUT_FOLDER,
+                                           {'seekable': SEEKABLE_TEXT_OUTPUTS} if choice['stage'] == "text" else None)
+                  for choice in plan]
+    else:
+        plan = stage_registry.plan_backends(SPEED_LEVEL, COMPRESSION_LEVEL, AVOID_DATA_LOSS, from_profile=PLAN_FROM_PROFILE)
+        stage_registry.print_plan(plan)
+        stages = [backend_stage(choice, manifest) for choice in plan]
+        stages = stage_registry.drop_idle_stages(manifest, stages)
+    follow_stages = fidelity_stages(manifest, stages) if DO_CHECK_FIDELITY else []
+    text_verify_stages = verify_stages(manifest, stages) if VERIFY_TEXT_OUTPUTS else []
+    follow_stages += text_verify_stages
+    if zip_direct and not text_verify_stages:
+        # Nothing reads the text outputs back, so those written in this process skip the spool folder.
+        stream_pipeline.set_direct_output(lambda output_path: compressor_zip.stream_output(archive_sink, output_path))
+    stage_cpus = max(1, (cpu_budget - len(follow_stages)) // max(1, len(stages)))
+    for stage in stages:
+        stage['cpus'] = stage_cpus
+
+    failed_stages = stage_scheduler.run_stages(stages + follow_stages, cpu_budget)
+    if budget is not None:
+        time_budget.print_budget_report(budget)
+    run_journal.close_journal(manifest, stages_failed=bool(failed_stages))
+
     if ZIP_RESULT:
-        compressor_zip.compress_directory_to_zip(OUTPUT_FOLDER, "compressed_files.zip")
+        if zip_direct:
+            compressor_zip.close_archive_sink(archive_sink)
+        else:
+            compressor_zip.compress_directory_to_zip(OUTPUT_FOLDER, "compressed_files.zip",
+                                                     delete_source=not INCREMENTAL,
+                                                     exclude=(run_journal.JOURNAL_FILENAME,),
+                                                     jobs=cpu_budget)
         print("\n" + "=" * 70)
         print("\n--- FOLDER COMPRESSION COMPLETED ---")
         print("\nCompressed .zip file is located in the root folder.")
-        compressor_zip.compare_file_system_sizes(INPUT_FOLDER, "compressed_files.zip")
+        compressor_zip.compare_file_system_sizes(INPUT_FOLDER, "compressed_files.zip", manifest=manifest)
     else:
         print("\n" + "=" * 70)
         print("\n--- FOLDER COMPRESSION COMPLETED ---")
         print(f"\nCompressed files are located in the {OUTPUT_FOLDER} folder.")
-        compressor_zip.compare_file_system_sizes(INPUT_FOLDER, OUTPUT_FOLDER)
+        compressor_zip.compare_file_system_sizes(INPUT_FOLDER, OUTPUT_FOLDER, manifest=manifest)
     total_main_time = time.time() - start_main_time
     print(f"Total Compression Time: {total_main_time:.4f} seconds")
+
+    metrics.set_gauge('run_seconds', total_main_time)
+    metrics.set_gauge('last_run_timestamp_seconds', time.time())
+    stage_registry.print_import_report()
+    metrics.print_summary()
+    metrics.write_json(METRICS_JSON_FILE)
+    metrics.write_prometheus(METRICS_PROMETHEUS_FILE)
+    print(f"Metrics written to {METRICS_JSON_FILE} and {METRICS_PROMETHEUS_FILE}")
@@ -0,0 +1,211 @@
+import json
+import math
+import os
+import threading
+import time
+
+CONSOLE_ENVIRONMENT_VARIABLE = "COMPRESSION_CONSOLE_TABLE"  # Read by worker processes too
+METRIC_PREFIX = "compression_"
+
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, math.inf)
+BYTES_BUCKETS = (1024, 16 * 1024, 256 * 1024, 1024 ** 2, 16 * 1024 ** 2, 256 * 1024 ** 2, 1024 ** 3, math.inf)
+
+HELP = {
+    'files_total': "Files seen by a stage, by outcome (processed, stored, skipped, unchanged, error).",
+    'bytes_in_total': "Input bytes of files a stage processed.",
+    'bytes_out_total': "Output bytes written by a stage.",
+    'file_seconds': "Per-file processing latency in seconds.",
+    'file_input_bytes': "Input size of processed files in bytes.",
+    'stage_seconds': "Wall-clock time of a stage in seconds (summed over its calls).",
+    'run_seconds': "Wall-clock time of the whole run in seconds.",
+    'last_run_timestamp_seconds': "Unix time the last run finished.",
+    'import_seconds': "Cold import time of a lazily loaded stage module in seconds.",
+}
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_histograms = {}
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return name, tuple(sorted(labels.items()))
+
+
+def set_console(enabled: bool):
+    """Turn the per-file console rows on or off, in this process and in workers started after this call."""
+    os.environ[CONSOLE_ENVIRONMENT_VARIABLE] = "1" if enabled else "0"
+
+
+def console_enabled() -> bool:
+    return os.environ.get(CONSOLE_ENVIRONMENT_VARIABLE, "1") != "0"
+
+
+def console(message: str):
+    if console_enabled():
+        print(message)
+
+
+def inc(name: str, value=1, **labels):
+    if not value:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name: str, value, **labels):
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def add_gauge(name: str, value, **labels):
+    # For gauges a stage reports once per call when it may be called several times in a run (time budget batches).
+    key = _key(name, labels)
+    with _lock:
+        _gauges[key] = _gauges.get(key, 0) + value
+
+
+def counter_value(name: str, **labels):
+    with _lock:
+        return _counters.get(_key(name, labels), 0)
+
+
+def observe(name: str, value, buckets=SECONDS_BUCKETS, **labels):
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = {'buckets': buckets, 'counts': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+            _histograms[key] = histogram
+        for i, upper_bound in enumerate(buckets):
+            if value <= upper_bound:
+                histogram['counts'][i] += 1
+                break
+        histogram['sum'] += value
+        histogram['count'] += 1
+
+
+def record_file(stage: str, original_size: int, output_size: int, status="processed"):
+    inc('files_total', stage=stage, status=status)
+    inc('bytes_in_total', original_size, stage=stage)
+    inc('bytes_out_total', output_size, stage=stage)
+    observe('file_input_bytes', original_size, buckets=BYTES_BUCKETS, stage=stage)
+
+
+def record_counts(stage: str, **counts):
+    for status, count in counts.items():
+        inc('files_total', count, stage=stage, status=status)
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
+
+
+def _stage_summary() -> dict:
+    stages = {}
+    for (name, labels), value in _counters.items():
+        stage = dict(labels).get('stage')
+        if stage is None:
+            continue
+        summary = stages.setdefault(stage, {'files': {}, 'bytes_in': 0, 'bytes_out': 0, 'seconds': 0.0})
+        if name == 'files_total':
+            summary['files'][dict(labels)['status']] = value
+        elif name == 'bytes_in_total':
+            summary['bytes_in'] = value
+        elif name == 'bytes_out_total':
+            summary['bytes_out'] = value
+
+    for (name, labels), value in _gauges.items():
+        stage = dict(labels).get('stage')
+        if name == 'stage_seconds' and stage in stages:
+            stages[stage]['seconds'] = value
+
+    for summary in stages.values():
+        summary['ratio'] = summary['bytes_in'] / summary['bytes_out'] if summary['bytes_out'] else 0.0
+        summary['mb_per_s'] = summary['bytes_in'] / (1024 * 1024) / summary['seconds'] if summary['seconds'] else 0.0
+    return stages
+
+
+def snapshot() -> dict:
+    with _lock:
+        return {
+            'created': time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            'stages': _stage_summary(),
+            'counters': [{'name': name, 'labels': dict(labels), 'value': value} for (name, labels), value in _counters.items()],
+            'gauges': [{'name': name, 'labels': dict(labels), 'value': value} for (name, labels), value in _gauges.items()],
+            'histograms': [
+                {'name': name, 'labels': dict(labels), 'buckets': [str(bound) for bound in histogram['buckets']],
+                 'counts': list(histogram['counts']), 'sum': histogram['sum'], 'count': histogram['count']}
+                for (name, labels), histogram in _histograms.items()
+            ],
+        }
+
+
+def _write_atomically(path: str, text: str):
+    # Scrapers and textfile collectors must never see a half-written file.
+    temp_path = path + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(temp_path, path)
+
+
+def write_json(path: str):
+    _write_atomically(path, json.dumps(snapshot(), indent=2))
+
+
+def _format_labels(labels, extra=()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def write_prometheus(path: str):
+    """Write every metric in the Prometheus text exposition format (for the node_exporter textfile collector)."""
+    lines = []
+    with _lock:
+        for kind, series in (('counter', _counters), ('gauge', _gauges)):
+            for name in sorted({name for name, _ in series}):
+                lines.append(f"# HELP {METRIC_PREFIX}{name} {HELP.get(name, name)}")
+                lines.append(f"# TYPE {METRIC_PREFIX}{name} {kind}")
+                for (series_name, labels), value in sorted(series.items()):
+                    if series_name == name:
+                        lines.append(f"{METRIC_PREFIX}{name}{_format_labels(labels)} {value}")
+
+        for name in sorted({name for name, _ in _histograms}):
+            lines.append(f"# HELP {METRIC_PREFIX}{name} {HELP.get(name, name)}")
+            lines.append(f"# TYPE {METRIC_PREFIX}{name} histogram")
+            for (series_name, labels), histogram in sorted(_histograms.items()):
+                if series_name != name:
+                    continue
+                cumulative = 0
+                for upper_bound, count in zip(histogram['buckets'], histogram['counts']):
+                    cumulative += count
+                    le = "+Inf" if upper_bound == math.inf else repr(upper_bound)
+                    lines.append(f"{METRIC_PREFIX}{name}_bucket{_format_labels(labels, (('le', le),))} {cumulative}")
+                lines.append(f"{METRIC_PREFIX}{name}_sum{_format_labels(labels)} {histogram['sum']}")
+                lines.append(f"{METRIC_PREFIX}{name}_count{_format_labels(labels)} {histogram['count']}")
+
+    _write_atomically(path, "\n".join(lines) + "\n")
+
+
+def print_summary():
+    stages = snapshot()['stages']
+    if not stages:
+        return
+
+    print("\n" + "=" * 90)
+    print("Stage Metrics")
+    print("-" * 90)
+    print(f"{'Stage':<12} {'Processed':>10} {'Stored':>8} {'Skipped':>8} {'Unchanged':>10} {'Errors':>8} {'Ratio':>8} {'MB/s':>10}")
+    print("-" * 90)
+    for stage, summary in sorted(stages.items()):
+        files = summary['files']
+        print(f"{stage:<12} {files.get('processed', 0):>10} {files.get('stored', 0):>8} {files.get('skipped', 0):>8} "
+              f"{files.get('unchanged', 0):>10} {files.get('error', 0):>8} {summary['ratio']:>8.2f} {summary['mb_per_s']:>10.2f}")
+    print("=" * 90 + "\n")
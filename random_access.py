@@ -0,0 +1,212 @@
+import base64
+import bz2
+import json
+import os
+import zlib
+
+INDEX_EXTENSION = ".idx"  # Sidecar next to the compressed file: <name>.zlib.idx, <name>.bz2.idx, <name>.lz4.idx
+INDEX_SPAN = 8 * 1024 * 1024  # Minimum uncompressed distance between two access points
+FORMATS = {'.zlib': 'zlib', '.bz2': 'bz2', '.lz4': 'lz4'}
+READ_SIZE = 1024 * 1024
+
+
+def new_index(file_format: str) -> dict:
+    return {'format': file_format, 'size': 0, 'lines': 0, 'points': []}
+
+
+def add_point(index: dict, offset: int, compressed_offset: int, lines: int, window: bytes = b""):
+    """Remember that decoding can start at compressed_offset, which holds uncompressed byte `offset`.
+
+    lines is the number of newlines before offset; window is the 32 KiB of
+    uncompressed data before it, which zlib needs to resume a stream there.
+    Points closer than INDEX_SPAN to the previous one are dropped.
+    """
+    points = index['points']
+    if points and offset - points[-1]['offset'] < INDEX_SPAN:
+        return
+    points.append({
+        'offset': offset,
+        'compressed_offset': compressed_offset,
+        'lines': lines,
+        'window': base64.b64encode(zlib.compress(window)).decode('ascii') if window else "",
+    })
+
+
+def write_index(compressed_path: str, index: dict, size: int, lines: int):
+    index['size'] = size
+    index['lines'] = lines
+    temp_path = compressed_path + INDEX_EXTENSION + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f)
+    os.replace(temp_path, compressed_path + INDEX_EXTENSION)
+
+
+def load_index(compressed_path: str):
+    """The sidecar index of compressed_path, or None if it has none (or it is older than the file)."""
+    index_path = compressed_path + INDEX_EXTENSION
+    if not os.path.isfile(index_path) or os.path.getmtime(index_path) < os.path.getmtime(compressed_path):
+        return None
+    with open(index_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _file_format(compressed_path: str) -> str:
+    file_format = FORMATS.get(os.path.splitext(compressed_path)[1].lower())
+    if file_format is None:
+        raise ValueError(f"Unsupported compressed file: {compressed_path}")
+    return file_format
+
+
+def _find_dictionary(compressed_path: str, dictionary_id: str) -> bytes:
+    import compressor_zlib
+
+    # The shared dictionary sits in the output root, some levels above the file.
+    directory = os.path.dirname(os.path.abspath(compressed_path))
+    while True:
+        dictionary_path = os.path.join(directory, compressor_zlib.DICTIONARY_PREFIX + dictionary_id + compressor_zlib.DICTIONARY_EXTENSION)
+        if os.path.isfile(dictionary_path):
+            with open(dictionary_path, 'rb') as f:
+                return f.read()
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            raise ValueError(f"No dictionary {dictionary_id} found for {compressed_path}")
+        directory = parent
+
+
+def _zlib_chunks(f, point):
+    if point is None:
+        import compressor_zlib
+
+        dictionary_id = compressor_zlib.stream_dictionary_id(f.name)
+        if dictionary_id:
+            decompressor = zlib.decompressobj(zdict=_find_dictionary(f.name, dictionary_id))
+        else:
+            decompressor = zlib.decompressobj()
+    else:
+        window = zlib.decompress(base64.b64decode(point['window'])) if point['window'] else b""
+        # Access points sit on deflate block boundaries, so a raw inflater primed with the window resumes there.
+        decompressor = zlib.decompressobj(-15, zdict=window) if window else zlib.decompressobj(-15)
+
+    while not decompressor.eof:
+        chunk = f.read(READ_SIZE)
+        if not chunk:
+            break
+        yield decompressor.decompress(chunk)
+
+
+def _bz2_chunks(f, point):
+    decompressor = bz2.BZ2Decompressor()
+    while True:
+        chunk = f.read(READ_SIZE)
+        if not chunk:
+            break
+        while chunk:
+            yield decompressor.decompress(chunk)
+            chunk = b""
+            if decompressor.eof:
+                chunk = decompressor.unused_data
+                decompressor = bz2.BZ2Decompressor()
+
+
+def _lz4_chunks(f, point):
+    import compressor_lz4
+    import lz4.frame
+
+    while True:
+        frame = compressor_lz4._read_frame(f)
+        if frame is None:
+            break
+        if frame:
+            yield lz4.frame.decompress(frame)
+
+
+def _chunks_from(compressed_path: str, point):
+    """Uncompressed data from the access point (or the start of the file when point is None) to the end."""
+    reader = {'zlib': _zlib_chunks, 'bz2': _bz2_chunks, 'lz4': _lz4_chunks}[_file_format(compressed_path)]
+    with open(compressed_path, 'rb') as f:
+        if point is not None:
+            f.seek(point['compressed_offset'])
+        yield from reader(f, point)
+
+
+def iter_uncompressed(compressed_path: str):
+    """Uncompressed data of a whole .zlib/.bz2/.lz4 file, in chunks of whatever size its decoder yields."""
+    return _chunks_from(compressed_path, None)
+
+
+def _start_point(index, key: str, value: int, strict=False):
+    if index is None:
+        return None, 0, 0
+    best = None
+    for point in index['points']:
+        if point[key] < value or (not strict and point[key] == value):
+            best = point
+    if best is None:
+        return None, 0, 0
+    return best, best['offset'], best['lines']
+
+
+def read_range(compressed_path: str, offset: int, length: int) -> bytes:
+    """Uncompressed bytes [offset, offset + length) of a .zlib/.bz2/.lz4 file; a negative offset counts from the end.
+
+    With a sidecar index, decoding starts at the nearest access point before
+    offset; without one the file is decoded from the start.
+    """
+    index = load_index(compressed_path)
+    if offset < 0:
+        if index is None:
+            index = {'points': [], 'size': sum(len(chunk) for chunk in _chunks_from(compressed_path, None))}
+        offset = max(0, index['size'] + offset)
+
+    point, position, _ = _start_point(index, 'offset', offset)
+    parts = []
+    wanted = length
+    for chunk in _chunks_from(compressed_path, point):
+        if position + len(chunk) > offset:
+            piece = chunk[max(0, offset - position):]
+            parts.append(piece[:wanted])
+            wanted -= len(parts[-1])
+            if wanted <= 0:
+                break
+        position += len(chunk)
+    return b"".join(parts)
+
+
+def read_lines(compressed_path: str, first_line: int, count: int) -> list:
+    """Lines first_line .. first_line + count - 1 (0-based, with their newlines) of a compressed text file."""
+    # A point with exactly first_line newlines before it may sit in the middle of that line, so take the one before.
+    point, _, lines_before = _start_point(load_index(compressed_path), 'lines', first_line, strict=True)
+    to_skip = first_line - lines_before
+    pending = b""
+    lines = []
+
+    for chunk in _chunks_from(compressed_path, point):
+        pending += chunk
+        position = 0
+        while to_skip:
+            newline = pending.find(b"\n", position)
+            if newline < 0:
+                position = len(pending)
+                break
+            position = newline + 1
+            to_skip -= 1
+        pending = pending[position:]
+        if to_skip:
+            continue
+
+        pieces = pending.split(b"\n")
+        pending = pieces.pop()
+        lines.extend(piece + b"\n" for piece in pieces)
+        if len(lines) >= count:
+            return lines[:count]
+
+    if pending and not to_skip:
+        lines.append(pending)
+    return lines[:count]
+
+
+# --- Test ---
+#COMPRESSED_FILE = "output_processed/logs/server.log.zlib"
+
+#print(read_range(COMPRESSED_FILE, -4096, 4096).decode(errors='replace'))
+#print(b"".join(read_lines(COMPRESSED_FILE, 1000, 5)).decode(errors='replace'))
@@ -0,0 +1,259 @@
+import hashlib
+import json
+import os
+import threading
+import random_access
+
+JOURNAL_FILENAME = ".run_manifest.jsonl"
+
+
+def hash_file(path: str, chunk_size=1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def with_input_checksum(function, input_path, *args):
+    """Worker task: (function(input_path, *args), sha256 of input_path), both computed in the worker.
+
+    For encoders that read their input themselves (PIL, pydub, ffmpeg); the
+    file is hashed while it is still in the page cache, and the parent only
+    has to record the result. The sha256 is None if the input cannot be read.
+    """
+    result = function(input_path, *args)
+    try:
+        return result, hash_file(input_path)
+    except OSError:
+        return result, None
+
+
+def _entry_key(entry: dict) -> str:
+    return os.path.normpath(os.path.join(entry['relative_dir'], entry['name']))
+
+
+def _load_records(journal_path: str) -> dict:
+    records = {}
+    if not os.path.isfile(journal_path):
+        return records
+
+    with open(journal_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A crash can leave a torn last line; everything before it is still valid.
+                continue
+            records[(record['backend'], record['input'])] = record
+    return records
+
+
+def _remove_unreferenced(records: dict, removed_records: list, output_dir: str):
+    # A solid archive is the output of every file packed into it; it goes only with the last of them.
+    referenced = {record['output'] for record in records.values()}
+    for record in removed_records:
+        if record['output'] in referenced:
+            continue
+        output_path = os.path.join(output_dir, record['output'])
+        for path in (output_path, output_path + random_access.INDEX_EXTENSION):
+            if os.path.isfile(path):
+                os.remove(path)
+
+
+def _prune_missing_inputs(manifest: dict, records: dict, output_dir: str):
+    current_inputs = {_entry_key(entry) for entry in manifest['entries']}
+    removed = [records.pop(key) for key, record in list(records.items()) if record['input'] not in current_inputs]
+    _remove_unreferenced(records, removed, output_dir)
+
+    if removed:
+        print(f"Run Journal: Removed {len(removed)} outputs whose inputs no longer exist.")
+
+
+def _rewrite_journal(journal_path: str, records: dict):
+    # Written aside and swapped in, so a crash mid-rewrite leaves the old journal intact.
+    temp_path = journal_path + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        for record in records.values():
+            f.write(json.dumps(record) + "\n")
+    os.replace(temp_path, journal_path)
+
+
+def open_journal(manifest: dict, output_dir: str):
+    """Load the previous run's journal from output_dir and attach it to the manifest.
+
+    Outputs of inputs that have since been deleted are removed, the journal is
+    compacted, and from then on it is appended to after every completed file so
+    an interrupted run resumes from the last file that finished.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    journal_path = os.path.join(output_dir, JOURNAL_FILENAME)
+    records = _load_records(journal_path)
+    _prune_missing_inputs(manifest, records, output_dir)
+
+    _rewrite_journal(journal_path, records)
+
+    manifest['journal'] = {
+        'path': journal_path,
+        'output_dir': output_dir,
+        'records': records,
+        'seen': set(),
+        'written': set(),
+        'started': set(),
+        'finished': set(),
+        'file': open(journal_path, 'a', encoding='utf-8'),
+        'lock': threading.Lock(),
+    }
+    print(f"Run Journal: {len(records)} completed files from previous runs ({journal_path})")
+
+
+def start_backend(manifest: dict, backend: str):
+    """Called when a backend's folder function begins, before anything that can make it give up early."""
+    journal = manifest.get('journal') if manifest else None
+    if journal is not None:
+        with journal['lock']:
+            journal['started'].add(backend)
+
+
+def finish_backend(manifest: dict, backend: str):
+    """Called once a backend has been through every file it was given, so the ones it skipped are really gone."""
+    journal = manifest.get('journal')
+    if journal is not None:
+        with journal['lock']:
+            journal['finished'].add(backend)
+
+
+def _is_stale(journal: dict, key: tuple, stages_failed: bool) -> bool:
+    backend = key[0]
+    if key in journal['seen']:
+        return False
+    if backend in journal['finished']:
+        # The backend ran to the end without producing or confirming it: its settings or eligibility changed.
+        return True
+    # A backend that started but never finished failed; one that never started may be the stage that failed to load.
+    return backend not in journal['started'] and not stages_failed
+
+
+def close_journal(manifest: dict, stages_failed=False):
+    """Drop outputs that this run's plan no longer produces, then close the journal.
+
+    Those belong to backends or settings the current preset no longer uses.
+    Outputs of a backend that failed are kept, and so are those of backends
+    that did not run at all when any stage failed (stages_failed), since a
+    stage that fails to load never says which backend it was.
+    """
+    journal = manifest.get('journal')
+    if journal is None:
+        return
+
+    journal['file'].close()
+    stale = [journal['records'].pop(key) for key in list(journal['records']) if _is_stale(journal, key, stages_failed)]
+    _remove_unreferenced(journal['records'], stale, journal['output_dir'])
+
+    if stale:
+        print(f"Run Journal: Removed {len(stale)} outputs from backends not used in this run.")
+        _rewrite_journal(journal['path'], journal['records'])
+
+    manifest['journal'] = None
+
+
+def load_checksums(compressed_dir: str) -> dict:
+    """Relative path -> sha256 of every original recorded in the journal a compression run left in compressed_dir."""
+    records = _load_records(os.path.join(compressed_dir, JOURNAL_FILENAME))
+    return {record['input']: record['sha256'] for record in records.values()}
+
+
+def matches_checksum(path: str, sha256: str) -> bool:
+    return hash_file(path) == sha256
+
+
+def recorded_checksum(manifest: dict, relative_path: str, output_path: str, backends: tuple):
+    """sha256 the journal holds for the input at relative_path when one of backends wrote it to output_path, or None."""
+    journal = manifest.get('journal')
+    if journal is None:
+        return None
+
+    output = os.path.relpath(output_path, journal['output_dir'])
+    with journal['lock']:
+        for backend in backends:
+            record = journal['records'].get((backend, os.path.normpath(relative_path)))
+            if record is not None and record['output'] == output:
+                return record['sha256']
+    return None
+
+
+def written_this_run(manifest: dict, output_path: str) -> bool:
+    """False for an output kept from an earlier run because its input was unchanged; always True without a journal."""
+    journal = manifest.get('journal')
+    if journal is None:
+        return True
+
+    with journal['lock']:
+        return os.path.relpath(output_path, journal['output_dir']) in journal['written']
+
+
+def recorded_output(manifest: dict, entry: dict, backend: str):
+    """Output path the journal holds for this input and backend, or None."""
+    journal = manifest.get('journal')
+    if journal is None:
+        return None
+
+    record = journal['records'].get((backend, _entry_key(entry)))
+    if record is None:
+        return None
+    return os.path.join(journal['output_dir'], record['output'])
+
+
+def is_up_to_date(manifest: dict, entry: dict, backend: str, params: dict, output_path: str) -> bool:
+    journal = manifest.get('journal')
+    if journal is None:
+        return False
+
+    record = journal['records'].get((backend, _entry_key(entry)))
+    if record is None or record['params'] != params:
+        return False
+    if record['output'] != os.path.relpath(output_path, journal['output_dir']):
+        return False
+    if not os.path.isfile(output_path) or os.path.getsize(output_path) != record['output_size']:
+        return False
+    if record['size'] != entry['size']:
+        return False
+    if record['mtime'] == entry['mtime']:
+        with journal['lock']:
+            journal['seen'].add((backend, record['input']))
+        return True
+
+    # Same size but touched: only the content hash can tell whether it really changed.
+    if hash_file(entry['path']) != record['sha256']:
+        return False
+
+    record_completed(manifest, entry, backend, params, output_path, sha256=record['sha256'])
+    return True
+
+
+def record_completed(manifest: dict, entry: dict, backend: str, params: dict, output_path: str, sha256: str):
+    """Journal a finished output; sha256 is the input's, hashed by the worker that compressed it."""
+    journal = manifest.get('journal')
+    if journal is None or sha256 is None:
+        return
+
+    record = {
+        'input': _entry_key(entry),
+        'size': entry['size'],
+        'mtime': entry['mtime'],
+        'sha256': sha256,
+        'backend': backend,
+        'params': params,
+        'output': os.path.relpath(output_path, journal['output_dir']),
+        'output_size': os.path.getsize(output_path),
+    }
+
+    with journal['lock']:
+        journal['records'][(backend, record['input'])] = record
+        journal['seen'].add((backend, record['input']))
+        journal['written'].add(record['output'])
+        journal['file'].write(json.dumps(record) + "\n")
+        journal['file'].flush()
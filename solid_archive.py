@@ -0,0 +1,306 @@
+import bz2
+import hashlib
+import json
+import os
+import zlib
+import file_manifest
+import metrics
+import random_access
+import run_journal
+import stream_pipeline
+import worker_pool
+
+SOLID_ARCHIVE_NAME = "_small_files.solid"  # Followed by the backend's extension, one per output folder
+SOLID_MAX_FILE_SIZE = 16 * 1024  # Only files below this size are packed
+SOLID_MIN_FILES = 16  # 'auto' packs a folder once it has this many small files...
+SOLID_MIN_SHARE = 0.5  # ...and they are at least this share of its eligible files
+HEADER_MAGIC = b"SOLID1 "  # The archive starts with this, a JSON member index and a newline
+
+
+def _open_compressor(backend: str, level: int):
+    """(compressor, first bytes) for a stream compressor with compress() and flush()."""
+    if backend == 'zlib':
+        return zlib.compressobj(level), b""
+    if backend == 'bz2':
+        return bz2.BZ2Compressor(level), b""
+    if backend == 'lz4':
+        import lz4.frame
+
+        compressor = lz4.frame.LZ4FrameCompressor(compression_level=level)
+        return compressor, compressor.begin()
+    raise ValueError(f"Unsupported solid archive backend: {backend}")
+
+
+def plan_solid_folders(entries: list, extensions: tuple, solid) -> dict:
+    """relative_dir -> small entries to pack, for solid = False, True, 'auto' or a list of relative folders."""
+    if not solid:
+        return {}
+
+    folders = {}
+    for entry in entries:
+        if entry['ext'] in extensions:
+            folders.setdefault(os.path.normpath(entry['relative_dir']), []).append(entry)
+
+    selected = None
+    if isinstance(solid, (list, tuple, set)):
+        selected = {os.path.normpath(folder) for folder in solid}
+
+    plan = {}
+    for relative_dir, folder_entries in folders.items():
+        small = [entry for entry in folder_entries if entry['size'] < SOLID_MAX_FILE_SIZE]
+        if len(small) < 2 or (selected is not None and relative_dir not in selected):
+            continue
+        if solid == 'auto' and (len(small) < SOLID_MIN_FILES or len(small) < SOLID_MIN_SHARE * len(folder_entries)):
+            continue
+        plan[relative_dir] = sorted(small, key=lambda entry: entry['name'])
+    return plan
+
+
+def members_signature(members: list) -> str:
+    # Any member added, removed or changed gives the folder a new signature, so its archive is rebuilt.
+    listing = [(entry['name'], entry['size'], entry['mtime']) for entry in members]
+    return hashlib.sha1(json.dumps(listing).encode('utf-8')).hexdigest()[:16]
+
+
+def write_archive(members: list, archive_path: str, backend: str, level: int) -> tuple:
+    """Pack (name, path, size, mtime) members into one compressed stream.
+
+    Returns (original_size, compressed_size, member name -> sha256), the
+    checksums taken from the same reads that packed the members.
+    """
+    index = []
+    offset = 0
+    for name, _, size, mtime in members:
+        index.append({'name': name, 'offset': offset, 'size': size, 'mtime': mtime})
+        offset += size
+
+    temp_path = archive_path + ".tmp"
+    digests = {}
+    try:
+        compressor, first_bytes = _open_compressor(backend, level)
+        with stream_pipeline.open_output(archive_path, partial_path=temp_path) as f_out:
+            f_out.write(first_bytes)
+            f_out.write(compressor.compress(HEADER_MAGIC + json.dumps(index).encode('utf-8') + b"\n"))
+            for name, path, size, _ in members:
+                with open(path, 'rb') as f_in:
+                    data = f_in.read(size + 1)
+                if len(data) != size:
+                    raise ValueError(f"{name} changed size while it was being packed")
+                digests[name] = hashlib.sha256(data).hexdigest()
+                f_out.write(compressor.compress(data))
+            f_out.write(compressor.flush())
+            compressed_size = f_out.tell()
+        return offset, compressed_size, digests
+
+    except Exception as e:
+        print(f" Error packing {archive_path}: {e}")
+        if os.path.isfile(temp_path):
+            os.remove(temp_path)
+        return 0, 0, {}
+
+
+def is_solid_archive(filename: str) -> bool:
+    return os.path.splitext(filename)[0] == SOLID_ARCHIVE_NAME
+
+
+def read_member_index(archive_path: str) -> list:
+    header = random_access.read_lines(archive_path, 0, 1)[0]
+    if not header.startswith(HEADER_MAGIC):
+        raise ValueError(f"{archive_path} is not a solid archive")
+    return json.loads(header[len(HEADER_MAGIC):])
+
+
+def read_member(archive_path: str, name: str) -> bytes:
+    """Contents of one packed file, without writing the others out."""
+    header = random_access.read_lines(archive_path, 0, 1)[0]
+    for member in json.loads(header[len(HEADER_MAGIC):]):
+        if member['name'] == name:
+            return random_access.read_range(archive_path, len(header) + member['offset'], member['size'])
+    raise KeyError(f"{name} is not in {archive_path}")
+
+
+def _parse_header(header: bytearray, archive_path: str):
+    """(member index, view of the data after it) once header holds the whole first line, else (None, None)."""
+    newline = header.find(b"\n")
+    if newline < 0:
+        return None, None
+    if not header.startswith(HEADER_MAGIC):
+        raise ValueError(f"{archive_path} is not a solid archive")
+    return json.loads(header[len(HEADER_MAGIC):newline]), memoryview(header)[newline + 1:]
+
+
+def extract_archive(archive_path: str, target_dir: str) -> tuple:
+    """Unpack every member into target_dir with its original mtime; returns (files, restored_size) written."""
+    os.makedirs(target_dir, exist_ok=True)
+    header = bytearray()
+    members = None
+    files = 0
+    restored_size = 0
+    f_out = None
+    member = None
+    remaining = 0
+
+    try:
+        for chunk in random_access.iter_uncompressed(archive_path):
+            if members is None:
+                header += chunk
+                members, data = _parse_header(header, archive_path)
+                if members is None:
+                    continue
+                members.reverse()
+            else:
+                data = memoryview(chunk)
+
+            # Members are cut straight out of the decoded chunk; nothing is carried over to the next one.
+            offset = 0
+            while True:
+                if f_out is None:
+                    if not members:
+                        break
+                    member = members.pop()
+                    f_out = open(os.path.join(target_dir, member['name']), 'wb')
+                    remaining = member['size']
+
+                piece = data[offset:offset + remaining]
+                offset += len(piece)
+                f_out.write(piece)
+                remaining -= len(piece)
+                restored_size += len(piece)
+                if remaining:
+                    break
+
+                f_out.close()
+                os.utime(f_out.name, (member['mtime'], member['mtime']))
+                f_out = None
+                files += 1
+
+        if members is None or members or f_out is not None:
+            raise ValueError(f"{archive_path} ends before its last member")
+        return files, restored_size
+
+    except Exception as e:
+        print(f" Error extracting {archive_path}: {e}")
+        return files, restored_size
+
+    finally:
+        if f_out is not None:
+            f_out.close()
+
+
+def hash_members(archive_path: str) -> dict:
+    """Member name -> sha256 of its contents, decoded in one pass without writing anything; members cut off by damage are left out."""
+    header = bytearray()
+    members = None
+    digests = {}
+    digest = None
+    remaining = 0
+
+    for chunk in random_access.iter_uncompressed(archive_path):
+        if members is None:
+            header += chunk
+            members, data = _parse_header(header, archive_path)
+            if members is None:
+                continue
+        else:
+            data = memoryview(chunk)
+
+        # Members are stored back to back in index order; each one's hash is fed straight from the decoded chunk.
+        offset = 0
+        while len(digests) < len(members):
+            if digest is None:
+                digest = hashlib.sha256()
+                remaining = members[len(digests)]['size']
+
+            piece = data[offset:offset + remaining]
+            offset += len(piece)
+            digest.update(piece)
+            remaining -= len(piece)
+            if remaining:
+                break
+
+            digests[members[len(digests)]['name']] = digest.hexdigest()
+            digest = None
+
+    return digests
+
+
+def _archive_path(target_dir: str, backend: str) -> str:
+    return os.path.join(target_dir, SOLID_ARCHIVE_NAME + "." + backend)
+
+
+def compress_solid_folders(manifest: dict, output_dir: str, stage: str, params: dict, solid_folders: dict,
+                           level=None, jobs=1, choose=None) -> dict:
+    """Write one archive per planned folder (or confirm it is up to date) and record it for every member.
+
+    Archives use the stage's own format at `level`, unless choose(members)
+    returns the (backend, level) per folder, as the auto stage does. Returns
+    processed/unchanged file counts and original/compressed bytes for the
+    calling stage's summary.
+    """
+    totals = {'processed': 0, 'unchanged': 0, 'original': 0, 'compressed': 0}
+    tasks = []
+
+    for relative_dir, members in solid_folders.items():
+        target_dir = file_manifest.ensure_output_dir(manifest, output_dir, members[0])
+        folder_params = {**params, 'solid': members_signature(members)}
+
+        if choose is None:
+            backend, archive_path = stage, _archive_path(target_dir, stage)
+        else:
+            # The choice is only made again when the folder changed, otherwise timing noise could flip the format.
+            backend, archive_path = None, run_journal.recorded_output(manifest, members[0], stage)
+
+        if archive_path and all(run_journal.is_up_to_date(manifest, entry, stage, folder_params, archive_path) for entry in members):
+            _record_archive(manifest, members, archive_path)
+            totals['unchanged'] += len(members)
+            continue
+
+        if backend is None:
+            backend, level = choose(members)
+            archive_path = _archive_path(target_dir, backend)
+
+        tasks.append(worker_pool.make_task(
+            sum(entry['size'] for entry in members),
+            (members, archive_path, folder_params),
+            ([(entry['name'], entry['path'], entry['size'], entry['mtime']) for entry in members], archive_path, backend, level),
+            label=f"  [PACK]: {os.path.relpath(archive_path, output_dir)} ({len(members)} files)"
+        ))
+
+    for (members, archive_path, folder_params), (original_size, compressed_size, digests) in worker_pool.run_tasks(write_archive, tasks, jobs, stage=stage):
+        if original_size == 0 and compressed_size == 0:
+            metrics.record_counts(stage, error=len(members))
+            continue
+
+        for entry in members:
+            # Files that were compressed one by one last time leave their own outputs behind.
+            previous_output = run_journal.recorded_output(manifest, entry, stage)
+            if previous_output and os.path.normpath(previous_output) != os.path.normpath(archive_path) and os.path.isfile(previous_output):
+                os.remove(previous_output)
+            run_journal.record_completed(manifest, entry, stage, folder_params, archive_path, digests[entry['name']])
+            metrics.record_file(stage, entry['size'], compressed_size * entry['size'] // max(1, original_size))
+
+        _record_archive(manifest, members, archive_path)
+        totals['processed'] += len(members)
+        totals['original'] += original_size
+        totals['compressed'] += compressed_size
+
+        ratio = original_size / compressed_size if compressed_size else 1.0
+        archive_info = os.path.relpath(archive_path, output_dir)
+        metrics.console(f"{archive_info:40.40} | {original_size:13,} B | {compressed_size:15,} B | {ratio:5.2f}:1")
+
+    return totals
+
+
+def _record_archive(manifest: dict, members: list, archive_path: str):
+    # Every member points at the archive, but the sink must only receive it once: after all of them, so the
+    # holds their watchers take keep it in place until the last member has been read.
+    for entry in members:
+        file_manifest.record_output(manifest, entry, archive_path, to_sink=False)
+    file_manifest.record_shared_output(manifest, archive_path)
+
+
+# --- Test ---
+#ARCHIVE = "output_processed/configs/_small_files.solid.zlib"
+
+#print([member['name'] for member in read_member_index(ARCHIVE)])
+#extract_archive(ARCHIVE, "restored/configs")
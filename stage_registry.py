@@ -0,0 +1,264 @@
+import importlib
+import json
+import math
+import os
+import sys
+import threading
+import time
+import file_manifest
+import metrics
+
+# Stage name -> file type (file_manifest.FILE_TYPES) it needs at least one input of to be worth loading
+STAGE_FILE_TYPES = {
+    'text': 'text',
+    'mozjpeg': 'image',
+    'oxipng': 'image',
+    'flac': 'audio',
+    'mp3': 'audio',
+    'video': 'video',
+}
+
+# Backend name -> what it runs as and what it can be tuned with.
+#   group: backends in the same group compete, the planner runs at most one of them
+#   stage: stage name the backend runs under (also its key in STAGE_FILE_TYPES)
+#   parameter/values: the folder function keyword the planner sets and the values it may pick
+#   lossless: values that keep every bit of the input (the only ones allowed with AVOID_DATA_LOSS)
+#   lossless_only: only planned when data loss must be avoided
+#   kwargs: fixed keyword arguments passed along with the parameter
+#   extensions: the extensions of its file type it compresses, when not all of them
+#   metric_stage: stage label its metrics are recorded under, when not the backend name
+#   parallel_min_size: module constant from which one file is compressed on all of the stage's jobs
+BACKENDS = {
+    'lz4': {'group': 'text', 'stage': 'text', 'function': "compressor_lz4.compress_folder_streaming",
+            'parameter': 'level', 'values': (1, 4, 9, 16), 'lossless': (1, 4, 9, 16),
+            'parallel_min_size': "compressor_lz4.PARALLEL_MIN_SIZE"},
+    'zlib': {'group': 'text', 'stage': 'text', 'function': "compressor_zlib.compress_folder_streaming",
+             'parameter': 'level', 'values': (1, 6, 9), 'lossless': (1, 6, 9),
+             'parallel_min_size': "compressor_zlib.PARALLEL_MIN_SIZE"},
+    'bz2': {'group': 'text', 'stage': 'text', 'function': "compressor_bz2.compress_folder_streaming",
+            'parameter': 'level', 'values': (1, 5, 9), 'lossless': (1, 5, 9),
+            'parallel_min_size': "compressor_bz2.PARALLEL_MIN_SIZE"},
+    'mozjpeg': {'group': 'image', 'stage': 'mozjpeg', 'function': "compressor_mozjpeg.optimize_folder_batch",
+                'parameter': 'quality', 'values': (60, 70, 80, 90, 100), 'lossless': (100,),
+                'extensions': ('.jpg', '.jpeg', '.png', '.webp', '.tiff')},
+    'oxipng': {'group': 'png', 'stage': 'oxipng', 'function': "compressor_oxipng.optimize_folder_with_oxipng",
+               'parameter': 'level', 'values': (2, 4, 6), 'lossless': (2, 4, 6), 'lossless_only': True,
+               'kwargs': {'png_only': True}, 'extensions': ('.png',)},
+    'flac': {'group': 'audio', 'stage': 'flac', 'function': "compressor_pydub_flac.compress_folder_to_flac",
+             'parameter': 'compression_level', 'values': (1, 2, 3, 4, 6, 8), 'lossless': (1, 2, 3, 4, 6, 8)},
+    'mp3': {'group': 'audio', 'stage': 'mp3', 'function': "compressor_pydub_mp3.compress_folder_to_mp3",
+            'parameter': 'bitrate', 'values': ("192k", "320k"), 'lossless': ()},
+    # ffmpeg threads each encode itself, so the video stage only reserves CPUs for it.
+    'h264': {'group': 'video', 'stage': 'video', 'function': "compressor_ffmpeg.process_video_folder",
+             'parameter': 'crf', 'values': (30,), 'lossless': (), 'kwargs': {'codec': 'h264'}, 'pass_jobs': False,
+             'metric_stage': 'ffmpeg'},
+    'hevc': {'group': 'video', 'stage': 'video', 'function': "compressor_ffmpeg.process_video_folder",
+             'parameter': 'crf', 'values': (30,), 'lossless': (), 'kwargs': {'codec': 'hevc'}, 'pass_jobs': False,
+             'metric_stage': 'ffmpeg'},
+    'av1': {'group': 'video', 'stage': 'video', 'function': "compressor_ffmpeg.process_video_folder",
+            'parameter': 'crf', 'values': (30,), 'lossless': (), 'kwargs': {'codec': 'av1'}, 'pass_jobs': False,
+            'metric_stage': 'ffmpeg'},
+}
+
+# (backend, value) -> (MB/s, ratio) until benchmark.py has measured them on this machine
+DEFAULT_PROFILE = {
+    ('lz4', 1): (450, 2.1), ('lz4', 4): (90, 2.5), ('lz4', 9): (35, 2.6), ('lz4', 16): (8, 2.7),
+    ('zlib', 1): (70, 2.8), ('zlib', 6): (25, 3.2), ('zlib', 9): (10, 3.25),
+    ('bz2', 1): (12, 3.6), ('bz2', 5): (10, 3.8), ('bz2', 9): (8, 3.9),
+    ('mozjpeg', 60): (9, 4.5), ('mozjpeg', 70): (9, 3.8), ('mozjpeg', 80): (8, 3.0),
+    ('mozjpeg', 90): (7, 2.0), ('mozjpeg', 100): (5, 1.1),
+    ('oxipng', 2): (3, 1.08), ('oxipng', 4): (1.2, 1.11), ('oxipng', 6): (0.5, 1.12),
+    ('flac', 1): (90, 1.55), ('flac', 2): (80, 1.57), ('flac', 3): (70, 1.58),
+    ('flac', 4): (45, 1.65), ('flac', 6): (30, 1.67), ('flac', 8): (15, 1.68),
+    ('mp3', "192k"): (20, 7.3), ('mp3', "320k"): (18, 4.4),
+    ('h264', 30): (25, 8.0), ('hevc', 30): (7, 11.0), ('av1', 30): (2, 13.0),
+}
+# (SPEED_LEVEL, COMPRESSION_LEVEL) -> (backend, value) per group: the named presets, as main.py has always run them
+PRESETS = {
+    (1, 1): {'text': ('lz4', 4), 'image': ('mozjpeg', 100), 'png': ('oxipng', 6), 'audio': ('flac', 8), 'video': ('av1', 30)},
+    (1, 2): {'text': ('zlib', 9), 'image': ('mozjpeg', 90), 'audio': ('mp3', "320k"), 'video': ('h264', 30)},
+    (1, 3): {'text': ('bz2', 9), 'image': ('mozjpeg', 80), 'audio': ('mp3', "192k"), 'video': ('hevc', 30)},
+    (2, 1): {'text': ('lz4', 4), 'image': ('mozjpeg', 90), 'audio': ('flac', 4), 'video': ('h264', 30)},
+    (2, 2): {'text': ('zlib', 9), 'image': ('mozjpeg', 80), 'audio': ('flac', 6), 'video': ('h264', 30)},
+    (2, 3): {'text': ('zlib', 9), 'image': ('mozjpeg', 70), 'audio': ('mp3', "320k"), 'video': ('hevc', 30)},
+    (3, 1): {'text': ('lz4', 4), 'image': ('mozjpeg', 80), 'audio': ('flac', 1), 'video': ('h264', 30)},
+    (3, 2): {'text': ('lz4', 4), 'image': ('mozjpeg', 70), 'audio': ('flac', 2), 'video': ('h264', 30)},
+    (3, 3): {'text': ('zlib', 9), 'image': ('mozjpeg', 60), 'audio': ('flac', 3), 'video': ('h264', 30)},
+}
+# With AVOID_DATA_LOSS a preset keeps its text setting and takes these for every other group
+LOSSLESS_PRESET = {'image': ('mozjpeg', 100), 'png': ('oxipng', 6), 'audio': ('flac', 8), 'video': ('av1', 30)}
+
+PROFILE_FILE = "benchmark_results.json"  # Written by benchmark.py; its measurements replace the defaults
+
+_lock = threading.RLock()
+_import_times = {}
+
+
+def load_module(module_name: str):
+    """Import module_name on first use and remember how long the cold import took."""
+    with _lock:
+        if module_name in _import_times or module_name in sys.modules:
+            return sys.modules[module_name]
+
+        start_time = time.perf_counter()
+        module = importlib.import_module(module_name)
+        duration = time.perf_counter() - start_time
+
+        _import_times[module_name] = duration
+        metrics.set_gauge('import_seconds', duration, module=module_name)
+        return module
+
+
+def lazy_function(qualified_name: str):
+    """Stand-in for 'module.function' that only imports the module when it is first called."""
+    module_name, function_name = qualified_name.rsplit(".", 1)
+
+    def call(*args, **kwargs):
+        return getattr(load_module(module_name), function_name)(*args, **kwargs)
+
+    call.__name__ = qualified_name
+    return call
+
+
+def lazy_attribute(qualified_name: str):
+    """Value of 'module.ATTR', importing the module if this is the first time it is needed."""
+    module_name, attribute_name = qualified_name.rsplit(".", 1)
+    return getattr(load_module(module_name), attribute_name)
+
+
+def has_eligible_files(manifest: dict, stage_name: str) -> bool:
+    file_type = STAGE_FILE_TYPES.get(stage_name)
+    if file_type is None:
+        return True
+    return file_manifest.count_by_type(manifest).get(file_type, 0) > 0
+
+
+def drop_idle_stages(manifest: dict, stages: list) -> list:
+    kept = []
+    for stage in stages:
+        if has_eligible_files(manifest, stage['name']):
+            kept.append(stage)
+        else:
+            print(f"Skipping stage '{stage['name']}': no {STAGE_FILE_TYPES[stage['name']]} files in the input.")
+    return kept
+
+
+def print_import_report():
+    if not _import_times:
+        return
+
+    print("\n" + "-" * 70)
+    print("Module Import Times")
+    print("-" * 70)
+    for module_name, duration in sorted(_import_times.items(), key=lambda item: item[1], reverse=True):
+        print(f"{module_name:<40} {duration:>10.4f} seconds")
+    print(f"{'Total':<40} {sum(_import_times.values()):>10.4f} seconds")
+    print("-" * 70)
+
+
+def candidate_cases() -> list:
+    """Every (case name, file type, module, function, keyword arguments) the registry can plan, for benchmark.py."""
+    cases = []
+    for name, backend in BACKENDS.items():
+        module_name, function_name = backend['function'].rsplit(".", 1)
+        for value in backend['values']:
+            kwargs = {backend['parameter']: value, **backend.get('kwargs', {})}
+            cases.append((f"{name}-{value}", STAGE_FILE_TYPES[backend['stage']], module_name, function_name, kwargs))
+    return cases
+
+
+def load_profile(profile_file=PROFILE_FILE) -> dict:
+    """(backend, value) -> (MB/s, ratio, source), with benchmark measurements taking precedence over the defaults."""
+    profile = {key: (*figures, 'default') for key, figures in DEFAULT_PROFILE.items()}
+    if not profile_file or not os.path.isfile(profile_file):
+        return profile
+
+    try:
+        with open(profile_file, 'r', encoding='utf-8') as f:
+            results = json.load(f).get('results', [])
+    except (OSError, ValueError) as e:
+        print(f"Warning: Could not read {profile_file} ({e}); using the default cost profile.")
+        return profile
+
+    cases = {f"{name}-{value}": (name, value) for name, backend in BACKENDS.items() for value in backend['values']}
+    for result in results:
+        key = cases.get(result.get('case'))
+        if key and result.get('status') == 'ok' and result.get('mb_per_s', 0) > 0 and result.get('ratio', 0) > 0:
+            profile[key] = (result['mb_per_s'], result['ratio'], 'measured')
+    return profile
+
+
+def _normalize(values: list) -> list:
+    # Log scale, so a level that is twice as fast counts the same at 5 MB/s as at 500 MB/s.
+    logs = [math.log(value) for value in values]
+    low, high = min(logs), max(logs)
+    return [(value - low) / (high - low) if high > low else 1.0 for value in logs]
+
+
+def _plan_entry(name: str, value, profile: dict) -> dict:
+    mb_per_s, ratio, source = profile[(name, value)]
+    return {'backend': name, 'stage': BACKENDS[name]['stage'], 'group': BACKENDS[name]['group'], 'value': value,
+            'mb_per_s': mb_per_s, 'ratio': ratio, 'source': source}
+
+
+def plan_backends(speed_level: int, compression_level: int, avoid_data_loss: bool, profile: dict = None,
+                  from_profile=False) -> list:
+    """Pick one (backend, value) per group for the given SPEED_LEVEL and COMPRESSION_LEVEL.
+
+    The pair's entry in PRESETS decides, unless from_profile: then every group
+    gets the candidate of the cost profile closest to the levels' aim, which
+    is not what the preset would pick (1/2 gets zlib level 1 and hevc, not
+    zlib level 9 and h264). Returns a list of {'backend', 'stage', 'group',
+    'value', 'mb_per_s', 'ratio', 'source'} dicts.
+    """
+    if profile is None:
+        profile = load_profile()
+
+    if not from_profile:
+        preset = PRESETS[(speed_level, compression_level)]
+        if avoid_data_loss:
+            preset = {'text': preset['text'], **LOSSLESS_PRESET}
+        return [_plan_entry(name, value, profile) for name, value in preset.values()]
+
+    groups = {}
+    for name, backend in BACKENDS.items():
+        if backend.get('lossless_only') and not avoid_data_loss:
+            continue
+        for value in backend['values']:
+            if (name, value) in profile:
+                groups.setdefault(backend['group'], []).append((name, value, value in backend['lossless']))
+
+    plan = []
+    for group, candidates in groups.items():
+        # COMPRESSION_LEVEL sets where in the group's ratio range to aim (lossy backends lose more the
+        # higher they compress); SPEED_LEVEL sets how much a faster backend may drift from that aim.
+        target_ratio = (compression_level - 1) / 2
+        speed_weight = (speed_level - 1) / 2
+        if avoid_data_loss:
+            lossless = [candidate for candidate in candidates if candidate[2]]
+            if lossless:
+                candidates = lossless
+            else:
+                # Nothing in this group is lossless (video): keep the most efficient encoder regardless of speed.
+                target_ratio, speed_weight = 1, 0
+
+        speeds = _normalize([profile[(name, value)][0] for name, value, _ in candidates])
+        ratios = _normalize([profile[(name, value)][1] for name, value, _ in candidates])
+        scores = [speed_weight * speed - abs(ratio - target_ratio) for ratio, speed in zip(ratios, speeds)]
+        best = max(range(len(candidates)), key=lambda i: (scores[i], ratios[i]))
+
+        name, value, _ = candidates[best]
+        plan.append(_plan_entry(name, value, profile))
+    return plan
+
+
+def print_plan(plan: list):
+    print("\n" + "-" * 70)
+    print("Backend Plan")
+    print("-" * 70)
+    print(f"{'Group':<8} {'Backend':<10} {'Setting':<22} {'MB/s':>8} {'Ratio':>7} {'Profile':>9}")
+    for choice in plan:
+        setting = f"{BACKENDS[choice['backend']]['parameter']}={choice['value']}"
+        print(f"{choice['group']:<8} {choice['backend']:<10} {setting:<22} {choice['mb_per_s']:>8.1f} "
+              f"{choice['ratio']:>7.2f} {choice['source']:>9}")
+    print("-" * 70)
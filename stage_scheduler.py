@@ -0,0 +1,174 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import file_manifest
+import worker_pool
+
+
+def make_stage(name, function, args=(), kwargs=None, after=(), cpus=1, pass_jobs=True):
+    return {
+        'name': name,
+        'function': function,
+        'args': tuple(args),
+        'kwargs': dict(kwargs or {}),
+        'after': tuple(after),
+        'cpus': cpus,
+        'pass_jobs': pass_jobs,
+    }
+
+
+def make_follow_stage(name, manifest, compare_function, report_function, follows, accepts, cpus=1):
+    """Stage that compares each output as soon as one of the `follows` stages records it.
+
+    compare_function(input_path, output_path, input_relative_path) runs for every
+    recorded output accepted by accepts(entry, output_path); once every followed
+    stage has finished, report_function receives the collected results.
+    """
+    return {
+        'name': name,
+        'manifest': manifest,
+        'compare_function': compare_function,
+        'report_function': report_function,
+        'follows': tuple(follows),
+        'accepts': accepts,
+        'after': (),
+        'cpus': cpus,
+    }
+
+
+def _is_follow_stage(stage: dict) -> bool:
+    return 'follows' in stage
+
+
+def _start_following(stage: dict) -> dict:
+    executor = ThreadPoolExecutor(max_workers=max(1, stage['cpus']), thread_name_prefix=stage['name'])
+    futures = []
+
+    def on_output(entry, output_path):
+        if not stage['accepts'](entry, output_path):
+            return
+        input_relative_path = os.path.join(entry['relative_dir'], entry['name'])
+        file_manifest.hold_output(stage['manifest'], output_path)
+        future = executor.submit(stage['compare_function'], entry['path'], output_path, input_relative_path)
+        future.add_done_callback(lambda _: file_manifest.release_output(stage['manifest'], output_path))
+        futures.append(future)
+
+    file_manifest.watch_outputs(stage['manifest'], on_output)
+
+    return {'executor': executor, 'futures': futures, 'callback': on_output, 'producers_done': threading.Event()}
+
+
+def _finish_following(stage: dict, follower: dict):
+    follower['producers_done'].wait()
+    file_manifest.unwatch_outputs(stage['manifest'], follower['callback'])
+    follower['executor'].shutdown(wait=True)
+
+    results = []
+    for future in follower['futures']:
+        try:
+            results.append(future.result())
+        except Exception as e:
+            print(f"Error: Comparison failed in stage '{stage['name']}': {e}")
+
+    if results:
+        stage['report_function'](results)
+    else:
+        print(f"\nNo outputs were produced for stage '{stage['name']}'.")
+
+
+def _print_timeline(stages: list, timings: dict, budget: int, total_time: float):
+    print("\n" + "=" * 70)
+    print(f"Stage Timeline (CPU Budget: {budget})")
+    print("-" * 70)
+    print(f"{'Stage':<30} {'CPUs':>6} {'Start (s)':>12} {'Duration (s)':>14}")
+    print("-" * 70)
+    for stage in stages:
+        if stage['name'] not in timings:
+            continue
+        started, duration, cpus = timings[stage['name']]
+        print(f"{stage['name']:<30} {cpus:>6} {started:>12.2f} {duration:>14.2f}")
+    print("-" * 70)
+    print(f"Wall-clock Time: {total_time:.4f} seconds")
+    print("=" * 70 + "\n")
+
+
+def run_stages(stages: list, cpu_budget=0) -> list:
+    """Run stages concurrently once their `after` dependencies finish, within cpu_budget CPUs; returns the names of failed stages."""
+    budget = worker_pool.resolve_jobs(cpu_budget)
+
+    names = [stage['name'] for stage in stages]
+    stage_by_name = {stage['name']: stage for stage in stages}
+    if len(stage_by_name) != len(names):
+        raise ValueError(f"Stage names must be unique: {names}")
+    for stage in stages:
+        for dependency in stage['after'] + stage.get('follows', ()):
+            if dependency not in names:
+                raise ValueError(f"Stage '{stage['name']}' depends on unknown stage '{dependency}'")
+
+    condition = threading.Condition()
+    pending = list(stages)
+    running = set()
+    finished = set()
+    timings = {}
+    failed = []
+    cpus_in_use = 0
+    followers = {stage['name']: _start_following(stage) for stage in stages if _is_follow_stage(stage)}
+    start_time = time.time()
+
+    def release_followers():
+        for stage in stages:
+            if _is_follow_stage(stage) and all(name in finished for name in stage['follows']):
+                followers[stage['name']]['producers_done'].set()
+
+    def run(stage, cpus):
+        nonlocal cpus_in_use
+        stage_start = time.time()
+        try:
+            if _is_follow_stage(stage):
+                _finish_following(stage, followers[stage['name']])
+            else:
+                kwargs = dict(stage['kwargs'])
+                if stage['pass_jobs']:
+                    kwargs['jobs'] = cpus
+                stage['function'](*stage['args'], **kwargs)
+        except Exception as e:
+            print(f"\nERROR: Stage '{stage['name']}' failed: {e}")
+            with condition:
+                failed.append(stage['name'])
+        finally:
+            with condition:
+                timings[stage['name']] = (stage_start - start_time, time.time() - stage_start, cpus)
+                cpus_in_use -= cpus
+                running.discard(stage['name'])
+                finished.add(stage['name'])
+                release_followers()
+                condition.notify_all()
+
+    with condition:
+        release_followers()
+
+        while pending or running:
+            for stage in list(pending):
+                if not all(name in finished for name in stage['after']):
+                    continue
+
+                cpus = max(1, min(stage['cpus'], budget))
+                producers_running = any(not _is_follow_stage(stage_by_name[name]) for name in running)
+                if not _is_follow_stage(stage) and producers_running and cpus_in_use + cpus > budget:
+                    continue
+
+                pending.remove(stage)
+                running.add(stage['name'])
+                cpus_in_use += cpus
+                threading.Thread(target=run, args=(stage, cpus), name=stage['name'], daemon=True).start()
+
+            if pending and not running:
+                raise ValueError(f"Stages can never start (circular dependencies?): "
+                                 f"{[stage['name'] for stage in pending]}")
+
+            if pending or running:
+                condition.wait()
+
+    _print_timeline(stages, timings, budget, time.time() - start_time)
+    return failed
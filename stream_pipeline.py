@@ -0,0 +1,202 @@
+import contextlib
+import mmap
+import os
+import queue
+import threading
+
+PIPELINE_DEPTH = 4  # Chunks that may be read ahead of the compressor, and as many waiting to be written behind it
+PIPELINE_MIN_SIZE = 1024 * 1024  # Smaller files take the plain loop; two threads per file would cost more than they save
+MMAP_MIN_SIZE = 16 * 1024 * 1024  # Files at least this large are mapped and compressed in place (None = always read)
+MAPPED_CHUNK_SIZE = 1024 * 1024  # Slice of a mapped file handed to the compressor at a time
+OUTPUT_BUFFER_SIZE = 1024 * 1024  # Write buffer of output files, reused for every small piece a compressor returns
+_STOP = object()
+_direct_output = None  # See set_direct_output
+
+
+def set_direct_output(opener):
+    """Have open_output write to opener(output_path) instead of a file whenever that returns a context manager.
+
+    Only this process is affected: worker processes start without it and keep writing files.
+    """
+    global _direct_output
+    _direct_output = opener
+
+
+@contextlib.contextmanager
+def open_output(output_path: str, partial_path: str = None):
+    """Writable output for output_path (write and tell are all it is guaranteed to have).
+
+    With partial_path the file is written there and only renamed to output_path
+    once it is complete. Outputs the direct output opener takes are never partial.
+    """
+    member = _direct_output(output_path) if _direct_output is not None else None
+    if member is not None:
+        with member as f_out:
+            yield f_out
+        return
+
+    # Compressors return many small pieces; one large reused buffer turns them into few large writes.
+    with open(partial_path or output_path, 'wb', buffering=OUTPUT_BUFFER_SIZE) as f_out:
+        yield f_out
+    if partial_path:
+        os.replace(partial_path, output_path)
+
+
+def _map_input(f_in, size: int):
+    if MMAP_MIN_SIZE is None or size < MMAP_MIN_SIZE:
+        return None
+    try:
+        mapped = mmap.mmap(f_in.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        # Pipes, some network and virtual filesystems cannot be mapped; they are read as before.
+        return None
+    if hasattr(mapped, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+        mapped.madvise(mmap.MADV_SEQUENTIAL)
+    return mapped
+
+
+def input_blocks(f_in, block_size: int):
+    """Yield the rest of f_in in block_size pieces and leave f_in at its end, as read() would.
+
+    Files of at least MMAP_MIN_SIZE come as memoryview slices of a read-only
+    mapping, so no bytes object is allocated per block and the pages stay in
+    the shared page cache; everything else comes from read(). The mapping is
+    never closed explicitly: it goes away with the last slice still in use.
+    """
+    size = os.fstat(f_in.fileno()).st_size
+    start = f_in.tell()
+    mapped = _map_input(f_in, size)
+    if mapped is None:
+        while True:
+            block = f_in.read(block_size)
+            if not block:
+                return
+            yield block
+
+    view = memoryview(mapped)
+    for offset in range(start, size, block_size):
+        yield view[offset:offset + block_size]
+    f_in.seek(size)
+
+
+def count_newlines(block) -> int:
+    # memoryview has no count(); only indexed outputs need this, and they pay for one transient copy per block.
+    return (block if isinstance(block, bytes) else bytes(block)).count(b"\n")
+
+
+def _read_ahead(f_in, free_buffers: queue.Queue, filled: queue.Queue):
+    try:
+        while True:
+            buffer = free_buffers.get()
+            if buffer is _STOP:
+                return
+            size = f_in.readinto(buffer)
+            filled.put((buffer, size))
+            if not size:
+                return
+    except Exception as e:
+        filled.put((e, 0))
+
+
+def _write_behind(f_out, pending: queue.Queue, errors: list):
+    while True:
+        data = pending.get()
+        if data is _STOP:
+            return
+        if not errors:
+            try:
+                f_out.write(data)
+            except Exception as e:
+                # Keep draining, so the compressor never blocks on a full queue.
+                errors.append(e)
+
+
+def _run_serial(f_in, f_out, compress, chunk_size, digest=None):
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    while True:
+        size = f_in.readinto(buffer)
+        if not size:
+            break
+        if digest is not None:
+            digest.update(view[:size])
+        f_out.write(compress(view[:size]))
+
+
+def _read_ahead_chunks(free_buffers: queue.Queue, filled: queue.Queue):
+    while True:
+        buffer, size = filled.get()
+        if isinstance(buffer, Exception):
+            raise buffer
+        if not size:
+            return
+        yield memoryview(buffer)[:size]
+        # The compressor is done with the chunk once it asks for the next one.
+        free_buffers.put(buffer)
+
+
+def pipe_file(f_in, f_out, compress, flush, chunk_size=65536, digest=None):
+    """Feed f_in through compress(chunk) and then flush() into f_out, each step overlapping the others.
+
+    A writer thread writes the results while the calling thread only
+    compresses; zlib, bz2 and lz4 release the GIL while they work, so a slow
+    disk or network mount costs about max(I/O, CPU) instead of their sum.
+    Files of at least MMAP_MIN_SIZE are compressed straight from a mapping
+    (see input_blocks); smaller ones are read ahead by a reader thread into
+    preallocated buffers with readinto, and handed over as memoryview slices
+    of them. Files below PIPELINE_MIN_SIZE take a plain loop over one buffer.
+    A hashlib digest, if given, is updated with every chunk on its way to
+    compress, so the input's checksum costs no read of its own.
+    """
+    size = os.fstat(f_in.fileno()).st_size
+    if size < PIPELINE_MIN_SIZE:
+        _run_serial(f_in, f_out, compress, chunk_size, digest)
+        f_out.write(flush())
+        return
+
+    pending = queue.Queue(PIPELINE_DEPTH)
+    write_errors = []
+    writer = threading.Thread(target=_write_behind, args=(f_out, pending, write_errors), daemon=True)
+    writer.start()
+
+    reader = None
+    free_buffers = queue.Queue()
+    if MMAP_MIN_SIZE is not None and size >= MMAP_MIN_SIZE:
+        chunks = input_blocks(f_in, max(chunk_size, MAPPED_CHUNK_SIZE))
+    else:
+        for _ in range(PIPELINE_DEPTH):
+            free_buffers.put(bytearray(chunk_size))
+        filled = queue.Queue()
+        reader = threading.Thread(target=_read_ahead, args=(f_in, free_buffers, filled), daemon=True)
+        reader.start()
+        chunks = _read_ahead_chunks(free_buffers, filled)
+
+    try:
+        for chunk in chunks:
+            if digest is not None:
+                digest.update(chunk)
+            data = compress(chunk)
+            if write_errors:
+                break
+            if data:
+                pending.put(data)
+        else:
+            pending.put(flush())
+    finally:
+        chunks.close()
+        pending.put(_STOP)
+        writer.join()
+        if reader is not None:
+            free_buffers.put(_STOP)
+            reader.join()
+
+    if write_errors:
+        raise write_errors[0]
+
+
+# --- Test ---
+#import zlib
+#compressor = zlib.compressobj(9)
+
+#with open("input/text/big.log", 'rb') as f_in, open("big.log.zlib", 'wb') as f_out:
+#    pipe_file(f_in, f_out, compressor.compress, compressor.flush)
@@ -0,0 +1,232 @@
+import collections
+import threading
+import time
+import file_manifest
+import metrics
+import stage_registry
+import stage_scheduler
+import worker_pool
+
+BATCH_SHARE = 0.05 # Each batch is sized to take about this share of the budget, so the plan is revisited often
+MIN_BATCH_SECONDS = 2 # ...but never less than this, the per-batch setup of some backends is not free
+
+
+def _parallelism(backend: dict, cpus: int) -> int:
+    # ffmpeg threads each encode itself, its measured throughput already covers every core.
+    return cpus if backend.get('pass_jobs', True) else 1
+
+
+def _takes(state: dict, entry: dict) -> bool:
+    # mozjpeg and oxipng share the image type but not its extensions; each group only counts what it compresses.
+    return entry['type'] == state['file_type'] and (state['extensions'] is None or entry['ext'] in state['extensions'])
+
+
+def _estimate_seconds(budget: dict, group: str, choice=None) -> float:
+    state = budget['groups'][group]
+    name, value = choice or state['choice']
+    mb_per_s = budget['profile'][(name, value)][0]
+    return state['remaining'] / (1024 * 1024) / mb_per_s / _parallelism(stage_registry.BACKENDS[name], budget['cpus'])
+
+
+def _file_seconds(budget: dict, choice, size: int) -> float:
+    # A file runs on one worker, unless its backend compresses files that large on every job.
+    name, value = choice
+    backend = stage_registry.BACKENDS[name]
+    seconds = size / (1024 * 1024) / budget['profile'][(name, value)][0]
+    if 'parallel_min_size' in backend and size >= stage_registry.lazy_attribute(backend['parallel_min_size']):
+        return seconds / _parallelism(backend, budget['cpus'])
+    return seconds
+
+
+def _downgrade(budget: dict, group: str) -> bool:
+    """Move group to the next faster setting on its ladder; False when it is already at the fastest."""
+    state = budget['groups'][group]
+    current_speed = budget['profile'][state['choice']][0]
+    faster = [candidate for candidate in state['ladder'] if budget['profile'][candidate][0] > current_speed]
+    if not faster:
+        return False
+
+    state['choice'] = min(faster, key=lambda candidate: budget['profile'][candidate][0])
+    return True
+
+
+def _fit(budget: dict, available_seconds: float) -> list:
+    """Downgrade the slowest group until every group's estimate fits; returns the (group, old, new) changes."""
+    previous = {group: state['choice'] for group, state in budget['groups'].items()}
+    while True:
+        estimates = {group: _estimate_seconds(budget, group) for group in budget['groups']}
+        slowest = max(estimates, key=estimates.get, default=None)
+        if slowest is None or estimates[slowest] <= available_seconds or not _downgrade(budget, slowest):
+            break
+
+    changes = []
+    for group, state in budget['groups'].items():
+        if state['choice'] != previous[group]:
+            state['downgrades'].append((previous[group], state['choice']))
+            changes.append((group, previous[group], state['choice']))
+    return changes
+
+
+def _fit_file(budget: dict, group: str, size: int, available_seconds: float) -> list:
+    """Downgrade group until one file of `size` bytes fits in available_seconds on its own (files are never split)."""
+    state = budget['groups'][group]
+    previous = state['choice']
+    while _file_seconds(budget, state['choice'], size) > available_seconds and _downgrade(budget, group):
+        pass
+
+    if state['choice'] == previous:
+        return []
+    state['downgrades'].append((previous, state['choice']))
+    return [(group, previous, state['choice'])]
+
+
+def _format_choice(choice) -> str:
+    name, value = choice
+    return f"{name} {stage_registry.BACKENDS[name]['parameter']}={value}"
+
+
+def open_budget(manifest: dict, plan: list, seconds: float, cpus_per_stage: int, avoid_data_loss: bool,
+                start_time=None, profile: dict = None) -> dict:
+    """Fit the plan into `seconds` from start_time and return the budget shared by the budgeted stages.
+
+    Each group's ladder holds the settings it may be downgraded to: the
+    candidates of its group that are faster than the planned one.
+    """
+    if profile is None:
+        profile = stage_registry.load_profile()
+
+    budget = {
+        'seconds': seconds,
+        'deadline': (start_time or time.time()) + seconds,
+        'cpus': max(1, cpus_per_stage),
+        'profile': dict(profile),
+        'groups': {},
+        'lock': threading.Lock(),
+    }
+
+    for choice in plan:
+        file_type = stage_registry.STAGE_FILE_TYPES[choice['stage']]
+        ladder = [(name, value, value in backend['lossless'])
+                  for name, backend in stage_registry.BACKENDS.items() if backend['group'] == choice['group']
+                  for value in backend['values'] if (name, value) in profile]
+        if avoid_data_loss and any(lossless for _, _, lossless in ladder):
+            ladder = [candidate for candidate in ladder if candidate[2]]
+
+        state = {
+            'stage': choice['stage'],
+            'file_type': file_type,
+            'extensions': stage_registry.BACKENDS[choice['backend']].get('extensions'),
+            'choice': (choice['backend'], choice['value']),
+            'ladder': [(name, value) for name, value, _ in ladder],
+            'downgrades': [],
+        }
+        state['remaining'] = sum(entry['size'] for entry in manifest['entries'] if _takes(state, entry))
+        budget['groups'][choice['group']] = state
+
+    changes = _fit(budget, budget['deadline'] - time.time())
+    print_budget(budget, "Time Budget Plan")
+    if changes:
+        print(f"Downgraded {len(changes)} settings to fit {seconds:.0f} seconds.")
+    return budget
+
+
+def print_budget(budget: dict, title: str):
+    print("\n" + "-" * 70)
+    print(f"{title} ({budget['seconds']:.0f} seconds, {max(0.0, budget['deadline'] - time.time()):.0f} left)")
+    print("-" * 70)
+    print(f"{'Group':<8} {'Setting':<28} {'Remaining MB':>14} {'Estimate (s)':>14}")
+    for group, state in budget['groups'].items():
+        print(f"{group:<8} {_format_choice(state['choice']):<28} {state['remaining'] / (1024 * 1024):>14.2f} "
+              f"{_estimate_seconds(budget, group):>14.1f}")
+    print("-" * 70)
+
+
+def _next_batch(budget: dict, group: str, entries: collections.deque) -> list:
+    target_seconds = max(budget['seconds'] * BATCH_SHARE, MIN_BATCH_SECONDS)
+    name, value = budget['groups'][group]['choice']
+    bytes_per_second = budget['profile'][(name, value)][0] * 1024 * 1024 * _parallelism(stage_registry.BACKENDS[name], budget['cpus'])
+
+    batch = []
+    batch_bytes = 0
+    while entries and (not batch or batch_bytes + entries[0]['size'] <= target_seconds * bytes_per_second):
+        entry = entries.popleft()
+        batch.append(entry)
+        batch_bytes += entry['size']
+    return batch
+
+
+def run_budgeted_group(budget: dict, group: str, manifest: dict, input_dir: str, output_dir: str, extra_kwargs=None, jobs=1):
+    """Stage function: run the group's files in batches, re-planning against the deadline before each batch.
+
+    The batches share one worker pool, and the largest file of each is checked
+    against the time left before it is scheduled.
+    """
+    state = budget['groups'][group]
+    manifest = file_manifest.batch_manifest(manifest)
+    entries = collections.deque(entry for entry in manifest['entries'] if _takes(state, entry))
+    # Files the group does not compress only need the backend's skip check, so they go along with the first batch.
+    other_entries = [entry for entry in manifest['entries'] if not _takes(state, entry)]
+
+    previous_choice = None
+    worker_pool.open_shared_pool(jobs)
+    try:
+        while entries or other_entries:
+            with budget['lock']:
+                available_seconds = budget['deadline'] - time.time()
+                changes = _fit(budget, available_seconds)
+                batch = _next_batch(budget, group, entries)
+                if batch:
+                    changes += _fit_file(budget, group, max(entry['size'] for entry in batch), available_seconds)
+                name, value = state['choice']
+            for changed_group, previous, current in changes:
+                print(f"\nBehind schedule: {changed_group} downgraded from {_format_choice(previous)} to {_format_choice(current)}.")
+
+            backend = stage_registry.BACKENDS[name]
+            subset = file_manifest.subset_manifest(manifest, batch + other_entries)
+            subset['continues_batch'] = previous_choice == (name, value)
+            kwargs = {backend['parameter']: value, **backend.get('kwargs', {}), **(extra_kwargs or {}),
+                      'manifest': subset}
+            if backend.get('pass_jobs', True):
+                kwargs['jobs'] = jobs
+            other_entries = []
+            previous_choice = (name, value)
+
+            batch_bytes = sum(entry['size'] for entry in batch)
+            # Only the bytes the backend compressed count towards its speed, not the unchanged files it skipped.
+            metric_stage = backend.get('metric_stage', name)
+            compressed_before = metrics.counter_value('bytes_in_total', stage=metric_stage)
+            start_time = time.perf_counter()
+            stage_registry.lazy_function(backend['function'])(input_dir, output_dir, **kwargs)
+            duration = time.perf_counter() - start_time
+            compressed_bytes = metrics.counter_value('bytes_in_total', stage=metric_stage) - compressed_before
+
+            with budget['lock']:
+                state['remaining'] -= batch_bytes
+                if compressed_bytes and duration > 0:
+                    # What this host actually achieves replaces the profile figure for the remaining estimates.
+                    mb_per_s = compressed_bytes / (1024 * 1024) / duration / _parallelism(backend, budget['cpus'])
+                    budget['profile'][(name, value)] = (mb_per_s, budget['profile'][(name, value)][1], 'observed')
+    finally:
+        worker_pool.close_shared_pool()
+        # Shared outputs such as the zlib dictionary reach the sink once every batch is done with them.
+        file_manifest.end_batches(manifest)
+
+
+def budget_stage(budget: dict, group: str, manifest: dict, input_dir: str, output_dir: str, extra_kwargs=None):
+    return stage_scheduler.make_stage(budget['groups'][group]['stage'], run_budgeted_group,
+                                      (budget, group, manifest, input_dir, output_dir, extra_kwargs))
+
+
+def print_budget_report(budget: dict):
+    print_budget(budget, "Time Budget Result")
+    overrun = time.time() - budget['deadline']
+    if overrun > 0:
+        print(f"Budget exceeded by {overrun:.1f} seconds.")
+    for group, state in budget['groups'].items():
+        for previous, current in state['downgrades']:
+            print(f"{group}: {_format_choice(previous)} -> {_format_choice(current)}")
+
+
+# --- Test ---
+#manifest = file_manifest.build_manifest("input_test", "output_processed")
+#budget = open_budget(manifest, stage_registry.plan_backends(1, 3, False), 600, 4, False)
@@ -0,0 +1,121 @@
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import metrics
+
+# Pool that run_tasks calls from a thread share between open_shared_pool and close_shared_pool.
+_shared = threading.local()
+
+
+def resolve_jobs(jobs=None) -> int:
+    if jobs is None or jobs <= 0:
+        return os.cpu_count() or 1
+    return jobs
+
+
+def make_task(size: int, context, args: tuple, label: str = None) -> dict:
+    return {'size': size, 'context': context, 'args': args, 'label': label}
+
+
+def _pool_context():
+    # Pools are started from stage scheduler threads; forking a process with other threads running can copy
+    # held locks into the child, so workers always start from a fresh interpreter.
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+
+def open_shared_pool(jobs=1):
+    """Make the run_tasks calls this thread makes share one pool of `jobs` workers, started on first use.
+
+    A stage that calls a folder function once per batch (see time_budget)
+    keeps its workers between the calls instead of starting a pool for each.
+    """
+    _shared.pool = {'jobs': resolve_jobs(jobs), 'executor': None}
+
+
+def close_shared_pool():
+    pool = getattr(_shared, 'pool', None)
+    _shared.pool = None
+    if pool and pool['executor'] is not None:
+        pool['executor'].shutdown()
+
+
+def _task_failed(task: dict, error: Exception, stage):
+    print(f"Error: Worker failed for {task['args'][0]}: {error}")
+    if stage:
+        metrics.record_counts(stage, error=1)
+
+
+def _call_task(function, label, args):
+    if label:
+        metrics.console(label)
+    start_time = time.perf_counter()
+    try:
+        return function(*args), time.perf_counter() - start_time
+    finally:
+        sys.stdout.flush()
+
+
+def run_tasks(function, tasks: list, jobs=1, stage=None):
+    """Run function(*task['args']) for every task and yield (context, result) pairs.
+
+    With more than one job the tasks are fanned out to worker processes, largest
+    first, and results are yielded as they complete. function must be a
+    module-level callable so it can be sent to the workers. A task that raises
+    is reported and counted as an error (with a stage name) and yields nothing,
+    however many jobs there are. With a stage name, each task's latency goes
+    into that stage's file_seconds histogram.
+    """
+    jobs = resolve_jobs(jobs)
+
+    if jobs == 1 or len(tasks) <= 1:
+        for task in tasks:
+            try:
+                result, duration = _call_task(function, task['label'], task['args'])
+            except Exception as e:
+                _task_failed(task, e, stage)
+                continue
+            if stage:
+                metrics.observe('file_seconds', duration, stage=stage)
+            yield task['context'], result
+        return
+
+    ordered_tasks = sorted(tasks, key=lambda task: task['size'], reverse=True)
+
+    pool = getattr(_shared, 'pool', None)
+    if pool is not None:
+        if pool['executor'] is None:
+            pool['executor'] = ProcessPoolExecutor(max_workers=pool['jobs'], mp_context=_pool_context())
+        yield from _run_on(pool['executor'], function, ordered_tasks, stage)
+        return
+
+    with ProcessPoolExecutor(max_workers=min(jobs, len(ordered_tasks)), mp_context=_pool_context()) as executor:
+        yield from _run_on(executor, function, ordered_tasks, stage)
+
+
+def _run_on(executor, function, ordered_tasks: list, stage):
+    futures = {
+        executor.submit(_call_task, function, task['label'], task['args']): task
+        for task in ordered_tasks
+    }
+
+    try:
+        for future in as_completed(futures):
+            task = futures[future]
+            try:
+                result, duration = future.result()
+            except Exception as e:
+                _task_failed(task, e, stage)
+                continue
+
+            if stage:
+                metrics.observe('file_seconds', duration, stage=stage)
+            yield task['context'], result
+    finally:
+        # A caller that stops early leaves nothing queued behind it (a shared pool carries on with other work).
+        for future in futures:
+            future.cancel()